@@ -0,0 +1,234 @@
+"""
+ASGI 入口 - 热点 JSON 接口在事件循环中处理，上游请求经 AsyncUpstream 异步发送，
+等待 Pixiv 响应期间不占用线程；其余路由（/ui、管理接口、图片下载、?pages= / ?all= 的 NDJSON 翻页等）
+交给原 Flask 应用，在线程池中以 WSGI 方式执行，同步模式的蓝图无需修改
+
+异步处理的接口与 Flask 路由使用相同的鉴权、账号范围、响应缓存与 ?fields= 投影；不做下一页预取
+"""
+import asyncio
+import io
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NamedTuple, Pattern
+from urllib.parse import parse_qs
+
+try:
+    import uvicorn
+    UVICORN_AVAILABLE = True
+except ImportError:
+    UVICORN_AVAILABLE = False
+
+from app import upstream, metrics, timing
+from app.async_upstream import AsyncUpstream, HTTPX_AVAILABLE
+from app.auth import check_api_key
+from app.config import config
+from app.projection import compile_fields, InvalidFields
+from app.routes.common import scope_for_key, error_body, encode_json
+
+
+def _int(query, name, default=0):
+    try:
+        return int(query.get(name, default))
+    except ValueError:
+        return default
+
+
+class NativeRoute(NamedTuple):
+    pattern: Pattern
+    rule: str  # Flask 路由规则，用于 API Key 访问控制
+    build: Callable  # (match, query) -> (method, args, kwargs)，参数与 Flask 路由一致以共用缓存键
+    paginated: bool = False
+
+
+NATIVE_ROUTES = (
+    NativeRoute(re.compile(r"/api/illust/(\d+)"), "/api/illust/<int:illust_id>",
+                lambda m, q: ("illust_detail", (int(m[1]),), {})),
+    NativeRoute(re.compile(r"/api/search"), "/api/search",
+                lambda m, q: ("search_illust", (q.get("word", ""),), {"offset": _int(q, "offset")}), True),
+    NativeRoute(re.compile(r"/api/ranking"), "/api/ranking",
+                lambda m, q: ("illust_ranking", (), {"mode": q.get("mode", "day"), "offset": _int(q, "offset")}),
+                True),
+    NativeRoute(re.compile(r"/api/recommended"), "/api/recommended",
+                lambda m, q: ("illust_recommended", (), {"offset": _int(q, "offset")}), True),
+    NativeRoute(re.compile(r"/api/user/(\d+)"), "/api/user/<int:user_id>",
+                lambda m, q: ("user_detail", (int(m[1]),), {})),
+    NativeRoute(re.compile(r"/api/user/(\d+)/illusts"), "/api/user/<int:user_id>/illusts",
+                lambda m, q: ("user_illusts", (int(m[1]),), {"offset": _int(q, "offset")}), True),
+)
+
+
+class AsgiApp:
+    """ASGI 应用：NATIVE_ROUTES 异步处理，其余请求转交 WSGI 应用"""
+
+    def __init__(self, wsgi_app, async_upstream: AsyncUpstream = None, wsgi_workers: int = 0):
+        self.wsgi_app = wsgi_app
+        self.upstream = async_upstream or AsyncUpstream()
+        self._executor = ThreadPoolExecutor(max_workers=wsgi_workers or config.asgi.get("wsgi_workers", 16),
+                                            thread_name_prefix="wsgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+        route, match = self._match(scope)
+        if route is not None:
+            start = time.perf_counter()
+            request_timing = timing.begin()
+            try:
+                status = await self._handle(route, match, scope, send)
+            finally:
+                timing.end()
+            metrics.REQUEST_DURATION.observe(time.perf_counter() - start, route.rule, "GET", status)
+            if request_timing is not None:
+                timing.log(request_timing, "GET", scope["path"], route.rule, status)
+            return
+        return await self._wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.upstream.close()
+                self._executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    def _match(scope):
+        if scope["method"] != "GET":
+            return None, None
+        for route in NATIVE_ROUTES:
+            match = route.pattern.fullmatch(scope["path"])
+            if match is None:
+                continue
+            if route.paginated:
+                query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+                if "pages" in query or "all" in query:
+                    return None, None  # NDJSON 流式翻页由 Flask 处理
+            return route, match
+        return None, None
+
+    async def _handle(self, route, match, scope, send):
+        """处理请求，返回响应状态码"""
+        headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+        query = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode("utf-8")).items()}
+
+        key_value, error, status = check_api_key(headers.get("authorization", ""), route.rule)
+        if error:
+            return await self._send_json(send, {"error": error}, status)
+        try:
+            spec = query.get("fields", "").strip()
+            projection = compile_fields(spec) if spec else None
+        except InvalidFields as e:
+            return await self._send_json(send, {"error": str(e)}, 400)
+
+        method, args, kwargs = route.build(match, query)
+        try:
+            # 账号选择与上游请求在合并的任务中执行，这里整体计为 upstream
+            with timing.phase("upstream"):
+                result, cache_status = await self.upstream.cached_call(
+                    method, *args, scope=scope_for_key(key_value, query.get("lb")), **kwargs)
+        except Exception as e:
+            body, status = error_body(e)
+            return await self._send_json(send, body, status)
+        if projection is not None and not upstream.error_message(result):
+            result = projection.apply_response(result)
+        return await self._send_json(send, result, 200, headers.get("accept-encoding", ""), cache_status)
+
+    @staticmethod
+    async def _send_json(send, obj, status, accept_encoding="", cache_status=None):
+        body, encoding = encode_json(obj, accept_encoding)
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        if encoding:
+            headers += [(b"content-encoding", encoding.encode()), (b"vary", b"Accept-Encoding")]
+        if cache_status:
+            headers.append((b"x-cache", cache_status.encode()))
+            timing.note("cache", cache_status)
+        server_timing = timing.server_timing_header()
+        if server_timing:
+            headers.append((b"server-timing", server_timing.encode()))
+        with timing.phase("send"):
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+        return status
+
+    async def _wsgi(self, scope, receive, send):
+        """在线程池中执行 WSGI 应用，响应体逐块转发（下载、NDJSON 等流式响应不整体缓冲）"""
+        body = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            body.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        environ = _environ(scope, b"".join(body))
+
+        started = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                                  for name, value in response_headers]
+            return lambda data: None  # 不支持 write()，Flask 不使用
+
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self._executor, self.wsgi_app, environ, start_response)
+        try:
+            chunks = iter(result)
+            chunk = await loop.run_in_executor(self._executor, next, chunks, None)
+            await send({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+            while chunk is not None:
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await loop.run_in_executor(self._executor, next, chunks, None)
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(result, "close"):
+                await loop.run_in_executor(self._executor, result.close)
+
+
+def _environ(scope, body: bytes):
+    """由 ASGI scope 构造 WSGI environ"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name, value = name.decode("latin-1"), value.decode("latin-1")
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name == "content-length":
+            continue
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    environ["CONTENT_LENGTH"] = str(len(body))  # 请求体已完整读取（包括分块上传）
+    return environ
+
+
+def serve(wsgi_app, host, port) -> bool:
+    """用 uvicorn 以 ASGI 模式运行，缺少 uvicorn / httpx 时返回 False"""
+    if not (UVICORN_AVAILABLE and HTTPX_AVAILABLE):
+        print("[ASGI] uvicorn and httpx are required for server.mode: asgi, run: pip install uvicorn httpx")
+        return False
+    uvicorn.run(AsgiApp(wsgi_app), host=host, port=port, log_level="warning")
+    return True
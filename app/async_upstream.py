@@ -0,0 +1,229 @@
+"""
+异步上游调用 - ASGI 模式下用 httpx.AsyncClient 请求 app-api，少量线程即可承载大量进行中的请求
+
+请求的 URL / 参数 / 请求头仍由 pixivpy3 的方法生成（RequestBuilder 截获其 requests_call 而不发送），
+账号选择、失败转移、冷却、响应缓存与同步模式（upstream.call / response_cache.call）一致；
+选择账号可能同步刷新 token 或排队等待并发名额，放到小线程池中执行，不阻塞事件循环
+httpx 不处理 Cloudflare 质询，质询页面与其他非 JSON 响应一样视为网络错误并换账号重试
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional
+
+from pixivpy3 import AppPixivAPI, PixivError
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+from app import upstream, response_cache, transport, json_codec, metrics
+from app.config import config
+from app.json_codec import RawJson
+from app.pool import pool, get_proxy_settings
+from app.upstream import AccountScope, NoAvailableAccount, UpstreamFailed
+
+
+class PreparedRequest(NamedTuple):
+    method: str
+    url: str
+    headers: dict
+    params: Optional[dict]
+    data: Optional[dict]
+
+
+class _Captured(Exception):
+    def __init__(self, request: PreparedRequest):
+        super().__init__(request.url)
+        self.request = request
+
+
+class RequestBuilder(AppPixivAPI):
+    """只生成请求、不发送的 AppPixivAPI，使用账号当前的 token 与附加请求头"""
+
+    def __init__(self, api):
+        # 不调用父类 __init__：不需要为每次请求创建 cloudscraper 会话
+        self.user_id = api.user_id
+        self.access_token = api.access_token
+        self.refresh_token = None
+        self.hosts = api.hosts
+        self.additional_headers = api.additional_headers
+        self.requests_kwargs = {}
+
+    def requests_call(self, method, url, headers=None, params=None, data=None, stream=False):
+        merged_headers = dict(self.additional_headers)
+        merged_headers.update(headers or {})
+        raise _Captured(PreparedRequest(method, url, merged_headers, params, data))
+
+
+def build_request(api, method: str, *args, **kwargs) -> PreparedRequest:
+    """生成 AppPixivAPI 方法对应的 HTTP 请求"""
+    try:
+        getattr(RequestBuilder(api), method)(*args, **kwargs)
+    except _Captured as captured:
+        return captured.request
+    raise PixivError(f"{method} did not issue a request")
+
+
+def create_client(proxy: Optional[str]):
+    """按 http 与 asgi 配置创建 httpx.AsyncClient"""
+    if not HTTPX_AVAILABLE:
+        raise RuntimeError("httpx not installed, run: pip install httpx")
+    connect_timeout, read_timeout = transport.default_timeout()
+    limits = httpx.Limits(
+        max_connections=config.asgi.get("max_connections", 1000),
+        max_keepalive_connections=config.http.get("pool_maxsize", 32),
+    )
+    return httpx.AsyncClient(proxy=proxy, timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                             limits=limits)
+
+
+class AsyncUpstream:
+    """异步的 upstream.call + response_cache.call（只在事件循环线程中使用）"""
+
+    def __init__(self, client_factory=create_client, select_workers: int = 0):
+        """
+        client_factory: proxy -> 异步 HTTP 客户端（需提供 request() 与 aclose()）
+        select_workers: 选择账号的线程数，0 时使用 asgi.select_workers
+        """
+        self._client_factory = client_factory
+        self._clients = {}  # 代理地址 -> 客户端，代理设置修改后创建新客户端
+        self._flights = {}  # key -> Task，合并相同的并发调用
+        self._background = set()  # 后台刷新任务，保持引用直到完成
+        self._executor = ThreadPoolExecutor(max_workers=select_workers or config.asgi.get("select_workers", 8),
+                                            thread_name_prefix="async-select")
+        self.executed = 0
+        self.shared = 0
+
+    def _client(self):
+        proxy = (get_proxy_settings() or {}).get("https") or None
+        client = self._clients.get(proxy)
+        if client is None:
+            client = self._clients[proxy] = self._client_factory(proxy)
+        return client
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+        self._executor.shutdown(wait=False)
+
+    async def _select(self, scope: AccountScope, exclude):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, upstream.select_account, scope, list(exclude))
+
+    async def _send(self, account, method: str, args, kwargs):
+        """发送一次上游请求，非 JSON 响应抛出 PixivError（同 ProxiedAppPixivAPI.parse_result）"""
+        request = build_request(account.api, method, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            response = await self._client().request(request.method, request.url, headers=request.headers,
+                                                    params=request.params, data=request.data)
+        except Exception as e:
+            account.record_upstream(time.perf_counter() - start, False)
+            raise PixivError(f"requests {request.method} {request.url} error: {e}")
+        account.record_upstream(time.perf_counter() - start, response.status_code < 400)
+        body = response.content
+        if body.lstrip()[:1] != b"{":
+            raise PixivError(f"Unexpected response from {request.url} (HTTP {response.status_code})")
+        if config.json_response.get("passthrough", True):
+            return RawJson(body)
+        return json_codec.loads(body)
+
+    async def call(self, method: str, *args, scope: AccountScope = AccountScope(), **kwargs):
+        """异步版 upstream.call，返回 (result, account)"""
+        failover_cfg = config.failover
+        deadline = time.monotonic() + failover_cfg.get("deadline", 20)
+        max_attempts = failover_cfg.get("max_attempts", 3)
+        tried: List = []
+        last_kind, last_message = None, ""
+
+        while len(tried) < max_attempts and time.monotonic() < deadline:
+            account = await self._select(scope, tried)
+            if account is None:
+                break
+            tried.append(account)
+            start = time.perf_counter()
+            try:
+                result, exc = await self._send(account, method, args, kwargs), None
+            except Exception as e:
+                result, exc = None, e
+            finally:
+                pool.release(account)
+
+            kind = upstream.classify_error(result, exc)
+            metrics.UPSTREAM_DURATION.observe(time.perf_counter() - start, account.name, method,
+                                              upstream.result_label(kind, exc))
+            if kind is None:
+                if exc is not None:
+                    raise exc
+                return result, account
+
+            last_kind, last_message = kind, str(exc) if exc is not None else upstream.error_message(result)
+            cooldown = upstream._cooldown_for(kind)
+            if cooldown:
+                pool.quarantine(account, cooldown, kind)
+            print(f"[AsyncUpstream] {method} failed on [{account.name}] ({kind}), attempt {len(tried)}/{max_attempts}")
+
+        if last_kind is None:
+            raise NoAvailableAccount("No available account")
+        raise UpstreamFailed(last_kind, last_message)
+
+    async def _coalesce(self, key: str, factory):
+        """相同 key 的并发调用共享同一个任务；单个等待方取消不影响其他等待方"""
+        task = self._flights.get(key)
+        if task is None:
+            task = self._flights[key] = asyncio.get_running_loop().create_task(factory())
+            task.add_done_callback(lambda t: self._flights.pop(key, None) if self._flights.get(key) is t else None)
+            self.executed += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    async def cached_call(self, method: str, *args, scope: AccountScope = AccountScope(), **kwargs):
+        """异步版 response_cache.call，返回 (result, X-Cache 状态)，与同步模式共用缓存"""
+        ttl = response_cache.ttl_for(method)
+        key = response_cache.make_key(method, args, kwargs, scope)
+
+        async def fetch_result():
+            return (await self.call(method, *args, scope=scope, **kwargs))[0]
+
+        if not ttl:
+            return await self._coalesce(key, fetch_result), None
+
+        cache_cfg = config.response_cache
+
+        async def fetch():
+            result = await fetch_result()
+            if not upstream.error_message(result):
+                response_cache.response_cache.set(key, result, ttl, cache_cfg.get("stale_while_revalidate", 300))
+            elif response_cache.is_not_found(result):
+                response_cache.response_cache.set(key, result, cache_cfg.get("negative_ttl", 60))
+            return result
+
+        value, status = response_cache.response_cache.get(key)
+        if status == response_cache.HIT:
+            return value, status
+        if status == response_cache.STALE:
+            self._revalidate(key, fetch)
+            return value, status
+        return await self._coalesce(key, fetch), response_cache.MISS
+
+    def _revalidate(self, key: str, fetch):
+        if key in self._flights:
+            return
+
+        async def run():
+            try:
+                await self._coalesce(key, fetch)
+            except Exception as e:
+                print(f"[AsyncUpstream] Revalidate {key} failed: {e}")
+
+        task = asyncio.get_running_loop().create_task(run())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def stats(self):
+        return {"in_flight": len(self._flights), "executed": self.executed, "shared": self.shared}
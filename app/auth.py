@@ -1,41 +1,51 @@
 from functools import wraps
 from flask import request, jsonify, g
 from app.config import config
+from app import timing
 
 
 def require_auth(f):
     """Token 鉴权装饰器 - 用于 UI 控制台和管理接口"""
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get("Authorization")
-        if token != f"Bearer {config.auth_token}":
+        with timing.phase("auth"):
+            authorized = request.headers.get("Authorization") == f"Bearer {config.auth_token}"
+        if not authorized:
             return jsonify({"error": "Unauthorized"}), 401
         return f(*args, **kwargs)
     return decorated
 
 
+def check_api_key(auth_header, endpoint):
+    """
+    校验 Authorization 头中的 API Key 对 endpoint 的访问权限
+    返回 (key_value, None, 200)，失败时返回 (None, 错误信息, 状态码)
+    """
+    from app.key_manager import key_manager
+    
+    # 提取 API Key
+    if not auth_header.startswith("Bearer "):
+        return None, "API key required", 401
+    
+    key_value = auth_header[7:]  # 移除 "Bearer " 前缀
+    allowed, error = key_manager.check_access(key_value, endpoint)
+    if not allowed:
+        if error in ("Invalid API key", "API key is disabled"):
+            return None, error, 401
+        return None, error, 403
+    return key_value, None, 200
+
+
 def require_api_key(f):
     """API Key 鉴权装饰器 - 用于 API 调用"""
     @wraps(f)
     def decorated(*args, **kwargs):
-        from app.key_manager import key_manager
-        
-        auth_header = request.headers.get("Authorization", "")
-        
-        # 提取 API Key
-        if not auth_header.startswith("Bearer "):
-            return jsonify({"error": "API key required"}), 401
-        
-        key_value = auth_header[7:]  # 移除 "Bearer " 前缀
-        
-        # 检查访问权限
-        endpoint = request.path
-        allowed, error = key_manager.check_access(key_value, endpoint)
-        
-        if not allowed:
-            if error in ("Invalid API key", "API key is disabled"):
-                return jsonify({"error": error}), 401
-            return jsonify({"error": error}), 403
+        # 检查访问权限：优先使用匹配到的 URL 规则（如 /api/illust/<int:illust_id>），
+        # 规范化结果按规则缓存，不随具体 ID 变化
+        endpoint = request.url_rule.rule if request.url_rule is not None else request.path
+        key_value, error, status = check_api_key(request.headers.get("Authorization", ""), endpoint)
+        if error:
+            return jsonify({"error": error}), status
         
         # 将 API Key 值存储到请求上下文，供后续使用
         g.api_key_value = key_value
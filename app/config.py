@@ -1,17 +1,87 @@
 import yaml
+import atexit
+import copy
 import os
 import shutil
+import tempfile
+import threading
+import time
+from functools import wraps
+
+
+_MISSING = object()
+
+# 三方合并时按哪个字段识别列表中的同一条目
+MERGE_IDENTITY = {"pixiv_accounts": "name", "api_keys": "key"}
+
+
+def _merge3(base, local, theirs, path, conflicts):
+    """
+    三方合并单个值（_MISSING 表示不存在），冲突的路径追加到 conflicts，冲突处取 local
+    一方删除、另一方修改的条目视为冲突，整体取 local
+    """
+    if local == base or theirs == local:
+        return theirs
+    if theirs == base:
+        return local
+    if isinstance(local, dict) and isinstance(theirs, dict):
+        base = base if isinstance(base, dict) else {}
+        merged = {}
+        for key in list(theirs) + [k for k in local if k not in theirs]:
+            value = _merge3(base.get(key, _MISSING), local.get(key, _MISSING), theirs.get(key, _MISSING),
+                            f"{path}.{key}" if path else str(key), conflicts)
+            if value is not _MISSING:
+                merged[key] = value
+        return merged
+    identity = MERGE_IDENTITY.get(path)
+    if identity and _identified(local, identity) and _identified(theirs, identity):
+        base_items, local_items, their_items = (
+            {item[identity]: item for item in v} if _identified(v, identity) else {} for v in (base, local, theirs))
+        merged = []
+        for key in list(their_items) + [k for k in local_items if k not in their_items]:
+            value = _merge3(base_items.get(key, _MISSING), local_items.get(key, _MISSING),
+                            their_items.get(key, _MISSING), f"{path}[{key}]", conflicts)
+            if value is not _MISSING:
+                merged.append(value)
+        return merged
+    conflicts.append(path)
+    return local
+
+
+def _identified(value, identity):
+    """是否为每个条目都带有 identity 字段的列表"""
+    return isinstance(value, list) and all(isinstance(item, dict) and identity in item for item in value)
+
+
+def _synchronized(method):
+    """在配置锁内执行，串行化对配置数据的修改与写入"""
+    @wraps(method)
+    def decorated(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return decorated
 
 
 class Config:
     _instance = None
     
+    SAVE_DELAY = 0.5  # 合并写入窗口（秒）：窗口内的多次修改只写一次文件
+    
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
             cls._instance._config_path = os.getenv("CONFIG_PATH", "config.yaml")
+            cls._instance._file_signature = None
+            cls._instance._synced = {}
+            cls._instance._reload_listeners = []
+            cls._instance._watcher_thread = None
+            cls._instance._lock = threading.RLock()
+            cls._instance._dirty = False
+            cls._instance._save_timer = None
             cls._instance._ensure_config_exists()
             cls._instance._load()
+            # 进程退出前写入尚未落盘的修改
+            atexit.register(cls._instance.flush)
         return cls._instance
     
     def _ensure_config_exists(self):
@@ -30,15 +100,156 @@ class Config:
     def _load(self):
         with open(self._config_path, "r", encoding="utf-8") as f:
             self._data = yaml.safe_load(f)
+        self._file_signature = self._stat_signature()
+        self._synced = copy.deepcopy(self._data)
+    
+    def _stat_signature(self):
+        """配置文件的 (mtime, size) 签名，用于检测外部修改"""
+        try:
+            st = os.stat(self._config_path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
     
+    @_synchronized
     def save(self):
-        """保存配置到文件"""
-        with open(self._config_path, "w", encoding="utf-8") as f:
-            yaml.dump(self._data, f, allow_unicode=True, default_flow_style=False, sort_keys=False)
+        """
+        标记配置已修改并安排写入
+        SAVE_DELAY 内的多次修改合并为一次写入；需要立即落盘时调用 flush()
+        """
+        self._dirty = True
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.SAVE_DELAY, self._flush_scheduled)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+    
+    def _flush_scheduled(self):
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"[Config] Save failed: {e}")
+    
+    def flush(self):
+        """
+        立即写入未保存的修改（临时文件 + 原子替换，写入期间持有配置锁）
+        文件在修改待写入期间被外部修改时先与之合并（见 _merge_pending），不会覆盖外部修改
+        """
+        with self._lock:
+            merged = self._flush_locked()
+        if merged:
+            self._notify_reload()
+    
+    def _flush_locked(self):
+        """写入未保存的修改，返回是否从文件合并了外部修改"""
+        if self._save_timer is not None:
+            self._save_timer.cancel()
+            self._save_timer = None
+        if not self._dirty:
+            return False
+        
+        merged = False
+        signature = self._stat_signature()
+        if signature is not None and signature != self._file_signature:
+            base, local = self._synced, self._data
+            self._load()
+            merged = True
+            if not self._merge_pending(base, local):
+                self._dirty = False
+                return merged
+        
+        directory = os.path.dirname(os.path.abspath(self._config_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".config-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                yaml.dump(self._data, f, allow_unicode=True, default_flow_style=False, sort_keys=False)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(self._config_path):
+                shutil.copymode(self._config_path, tmp_path)
+            os.replace(tmp_path, self._config_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._dirty = False
+        # 记录自身写入后的签名，避免监视线程把自己的保存当作外部修改
+        self._file_signature = self._stat_signature()
+        self._synced = copy.deepcopy(self._data)
         print(f"[Config] Saved to {self._config_path}")
+        return merged
+    
+    def _merge_pending(self, base, local):
+        """
+        三方合并：base 为上次读取 / 写入文件时的内容，local 为含待写入修改的内存数据，
+        self._data 为刚读取的文件内容，合并结果写回 self._data
+        逐层合并字典；账号与 API Key 列表按 MERGE_IDENTITY 中的字段逐条合并，只有一方修改的字段采用修改方的值
+        双方把同一字段改成不同值时保留本进程的值（进程可能已经据此行动，例如刷新后旧 refresh_token 已失效、
+        新建的 API Key 已返回给调用方），并输出冲突日志
+        返回是否有本地修改需要写回文件
+        """
+        conflicts = []
+        merged = _merge3(base, local, self._data, "", conflicts)
+        if conflicts:
+            print(f"[Config] {self._config_path} was modified externally while local changes were pending; "
+                  f"conflicting values kept from this process: {', '.join(conflicts)}")
+        applied = merged != self._data
+        self._data = merged
+        return applied
+    
+    def _notify_reload(self):
+        for listener in list(self._reload_listeners):
+            listener()
     
     def reload(self):
-        self._load()
+        """
+        重新读取配置文件
+        有待写入的本地修改时先写入：文件未被外部修改则直接写入后读取；
+        已被外部修改则与文件逐项合并后写回（见 _merge_pending）
+        """
+        with self._lock:
+            if not self._flush_locked():
+                self._load()
+        self._notify_reload()
+    
+    def add_reload_listener(self, callback):
+        """注册配置重载回调（reload 成功后调用）"""
+        if callback not in self._reload_listeners:
+            self._reload_listeners.append(callback)
+    
+    def start_watcher(self, interval=0.5):
+        """
+        启动配置文件监视线程
+        interval: mtime 轮询间隔（秒）；签名需连续两次一致才重载（防抖），
+        因此外部修改约在 2 * interval 内生效
+        """
+        if self._watcher_thread is not None:
+            return
+        
+        def watch_loop():
+            pending = None
+            while True:
+                time.sleep(interval)
+                signature = self._stat_signature()
+                if signature is None or signature == self._file_signature or self._dirty:
+                    # 有待写入的本地修改时跳过，写入后签名会更新
+                    pending = None
+                    continue
+                # 防抖：文件可能仍在写入，等签名稳定后再重载
+                if signature != pending:
+                    pending = signature
+                    continue
+                pending = None
+                try:
+                    self.reload()
+                    print(f"[Config] Reloaded {self._config_path} (file changed)")
+                except Exception as e:
+                    # 记录签名，避免对同一个损坏的文件反复重试
+                    self._file_signature = signature
+                    print(f"[Config] Reload failed: {e}")
+        
+        self._watcher_thread = threading.Thread(target=watch_loop, daemon=True)
+        self._watcher_thread.start()
+        print(f"[Config] Watching {self._config_path}, interval: {interval}s")
     
     @property
     def server(self):
@@ -48,14 +259,80 @@ class Config:
     def auth_token(self):
         return self._data.get("auth", {}).get("token", "")
     
+    @property
+    def load_balance(self):
+        return self._data.get("load_balance", {}) or {}
+    
     @property
     def lb_strategy(self):
-        return self._data.get("load_balance", {}).get("strategy", "round_robin")
+        return self.load_balance.get("strategy", "round_robin")
+    
+    @property
+    def ewma_alpha(self):
+        """上游延迟 / 错误率 EWMA 的平滑系数（0~1，越大越看重最近的请求）"""
+        return self.load_balance.get("ewma_alpha", 0.2)
+    
+    @property
+    def startup(self):
+        return self._data.get("startup", {}) or {}
+    
+    @property
+    def token_refresh(self):
+        return self._data.get("token_refresh", {}) or {}
+    
+    @property
+    def http(self):
+        return self._data.get("http", {}) or {}
+    
+    @property
+    def image_cache(self):
+        return self._data.get("image_cache", {}) or {}
+    
+    @property
+    def response_cache(self):
+        return self._data.get("response_cache", {}) or {}
+    
+    @property
+    def batch(self):
+        return self._data.get("batch", {}) or {}
+    
+    @property
+    def pagination(self):
+        return self._data.get("pagination", {}) or {}
+    
+    @property
+    def prefetch(self):
+        return self._data.get("prefetch", {}) or {}
+    
+    @property
+    def shared_state(self):
+        return self._data.get("shared_state", {}) or {}
+    
+    @property
+    def asgi(self):
+        return self._data.get("asgi", {}) or {}
+    
+    @property
+    def json_response(self):
+        return self._data.get("json_response", {}) or {}
+    
+    @property
+    def metrics(self):
+        return self._data.get("metrics", {}) or {}
+    
+    @property
+    def timing(self):
+        return self._data.get("timing", {}) or {}
+    
+    @property
+    def failover(self):
+        return self._data.get("failover", {}) or {}
     
     @property
     def pixiv_accounts(self):
         return self._data.get("pixiv_accounts", []) or []
     
+    @_synchronized
     def add_account(self, name, refresh_token, username=None):
         """添加账号到配置"""
         if "pixiv_accounts" not in self._data or self._data["pixiv_accounts"] is None:
@@ -78,6 +355,7 @@ class Config:
         })
         self.save()
     
+    @_synchronized
     def remove_account(self, name):
         """从配置删除账号"""
         if "pixiv_accounts" not in self._data or self._data["pixiv_accounts"] is None:
@@ -87,6 +365,7 @@ class Config:
         ]
         self.save()
     
+    @_synchronized
     def set_proxy(self, enabled, http_proxy, https_proxy=None):
         """设置代理配置"""
         if "proxy" not in self._data:
@@ -101,11 +380,13 @@ class Config:
         """获取 API Keys 列表"""
         return self._data.get("api_keys", []) or []
     
+    @_synchronized
     def set_api_keys(self, keys: list):
         """设置 API Keys 列表并保存"""
         self._data["api_keys"] = keys
         self.save()
     
+    @_synchronized
     def add_api_key(self, key_data: dict):
         """添加 API Key"""
         if "api_keys" not in self._data or self._data["api_keys"] is None:
@@ -120,6 +401,7 @@ class Config:
         self.save()
         return True
     
+    @_synchronized
     def update_api_key(self, name: str, key_data: dict):
         """更新 API Key"""
         if "api_keys" not in self._data or self._data["api_keys"] is None:
@@ -132,6 +414,7 @@ class Config:
                 return True
         return False
     
+    @_synchronized
     def remove_api_key(self, name: str):
         """删除 API Key"""
         if "api_keys" not in self._data or self._data["api_keys"] is None:
@@ -0,0 +1,148 @@
+"""
+内存热点层 - 位于图片磁盘缓存之前，缓存小图（缩略图等）
+
+严格的字节预算 + TinyLFU 准入：新对象只有在近期访问频率高于将被淘汰的对象时才写入，
+避免一次性访问的大图把高频缩略图挤出内存
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class FrequencySketch:
+    """
+    Count-Min Sketch，估算 key 的近期访问次数
+    计数上限 15；累计记录 sample_size 次后所有计数减半（老化），让频率反映近期热度
+    """
+
+    DEPTH = 4
+    MAX_COUNT = 15
+
+    def __init__(self, width: int):
+        self.width = 1 << max(4, (max(1, width) - 1).bit_length())  # 取 2 的幂，便于取模
+        self._mask = self.width - 1
+        self._table = [[0] * self.width for _ in range(self.DEPTH)]
+        self.sample_size = 10 * self.width
+        self._additions = 0
+
+    def _indexes(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=self.DEPTH * 4).digest()
+        for row in range(self.DEPTH):
+            yield row, int.from_bytes(digest[row * 4:row * 4 + 4], "little") & self._mask
+
+    def increment(self, key: str):
+        for row, i in self._indexes(key):
+            if self._table[row][i] < self.MAX_COUNT:
+                self._table[row][i] += 1
+        self._additions += 1
+        if self._additions >= self.sample_size:
+            self._reset()
+
+    def estimate(self, key: str) -> int:
+        return min(self._table[row][i] for row, i in self._indexes(key))
+
+    def _reset(self):
+        for row in self._table:
+            for i, count in enumerate(row):
+                row[i] = count >> 1
+        self._additions //= 2
+
+
+class HotTier:
+    """按字节预算限制的 LRU 内存缓存，写入由 TinyLFU 准入策略决定（线程安全）"""
+
+    def __init__(self, max_bytes: int, max_object_size: int, expected_items: int = 0):
+        """
+        max_bytes: 内存中缓存对象的总字节上限
+        max_object_size: 超过该大小的对象不进入内存层
+        expected_items: 预计常驻对象数，用于确定频率统计的宽度（默认按 16 KB / 个估算）
+        """
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self.sketch = FrequencySketch(4 * (expected_items or max(1, max_bytes // (16 * 1024))))
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # key -> (size, value)，按最近使用排序
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        """查找并记录一次访问（无论命中与否都计入频率）"""
+        with self._lock:
+            self.sketch.increment(key)
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def _victims_locked(self, key: str, size: int):
+        """
+        写入 key 需要淘汰的对象列表，不应接纳时返回 None
+        依次检查最久未使用的对象：只要有一个比新对象更常用，就放弃写入
+        """
+        frequency = self.sketch.estimate(key)
+        victims = []
+        freed = 0
+        for victim_key, (victim_size, _) in self._items.items():
+            if self.size - freed + size <= self.max_bytes:
+                break
+            if self.sketch.estimate(victim_key) >= frequency:
+                return None
+            victims.append(victim_key)
+            freed += victim_size
+        return victims
+
+    def would_admit(self, key: str, size: int) -> bool:
+        """写入前的准入预判（不修改缓存），用于在读取对象内容之前跳过不会被接纳的对象"""
+        if size > self.max_object_size or size > self.max_bytes:
+            return False
+        with self._lock:
+            return key in self._items or self._victims_locked(key, size) is not None
+
+    def put(self, key: str, value, size: int) -> bool:
+        """尝试写入，返回是否被接纳"""
+        if size > self.max_object_size or size > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return True
+            victims = self._victims_locked(key, size)
+            if victims is None:
+                self.rejected += 1
+                return False
+            for victim_key in victims:
+                victim_size, _ = self._items.pop(victim_key)
+                self.size -= victim_size
+                self.evictions += 1
+            self._items[key] = (size, value)
+            self.size += size
+            self.admitted += 1
+            return True
+
+    def discard(self, key: str):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is not None:
+                self.size -= item[0]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "size": self.size,
+                "max_size": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,321 @@
+"""
+图片磁盘缓存 - 按规范化的 pximg URL 寻址，LRU + 总大小 / 存活时间限制
+
+每个条目是两个文件：<dir>/<k[:2]>/<k>（图片内容）与 <k>.json（URL、类型、ETag）
+k 为规范化 URL 的 sha256；ETag 为图片内容的 sha256，写入时流式计算
+可选的内存热点层（HotTier）位于磁盘之前，缓存不超过 max_object_kb 的小图
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit
+
+from app.config import config
+from app.hot_tier import HotTier
+from app.singleflight import SingleFlight
+
+# i.pximg.net 的镜像 / 分流域名，内容与 i.pximg.net 相同
+PXIMG_HOSTS = ("i.pximg.net", "i-f.pximg.net", "i-cf.pximg.net")
+
+# 未超出大小上限时，两次过期清理之间的最短间隔（秒）
+SWEEP_INTERVAL = 60
+
+
+def normalize_url(url: str) -> Optional[str]:
+    """规范化 pximg 图片 URL（统一协议 / 域名，去掉查询参数），非 pximg URL 返回 None"""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if parts.scheme.lower() not in ("http", "https") or host not in PXIMG_HOSTS:
+        return None
+    if not parts.path or parts.path.endswith("/"):
+        return None
+    return f"https://i.pximg.net{parts.path}"
+
+
+def cache_key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+class CacheEntry(NamedTuple):
+    key: str
+    path: str
+    size: int
+    content_type: str
+    etag: str
+    created_at: float
+    data: Optional[bytes] = None  # 来自内存热点层时为图片内容
+
+
+class FetchError(Exception):
+    """上游没有返回完整图片（404 等），status_code 原样返回给客户端"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ImageCache:
+    """磁盘图片缓存（线程安全）"""
+
+    def __init__(self, directory: str, max_size: int, max_age: float, hot_tier: Optional[HotTier] = None):
+        """
+        directory: 缓存目录
+        max_size: 缓存总大小上限（字节），超出时按最近最少使用淘汰
+        max_age: 条目最长存活时间（秒），0 表示不限制
+        hot_tier: 内存热点层，None 表示只使用磁盘
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hot_tier = hot_tier
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> CacheEntry，按最近使用排序
+        self._flights = SingleFlight()  # 合并同一 URL 的并发下载
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._last_sweep = time.time()
+        os.makedirs(directory, exist_ok=True)
+        self._scan()
+
+    @classmethod
+    def from_config(cls):
+        cache_cfg = config.image_cache
+        memory_cfg = cache_cfg.get("memory", {}) or {}
+        hot_tier = None
+        if memory_cfg.get("enabled", True):
+            hot_tier = HotTier(
+                max_bytes=int(memory_cfg.get("max_size_mb", 64) * 1024 * 1024),
+                max_object_size=int(memory_cfg.get("max_object_kb", 512) * 1024),
+            )
+        return cls(
+            directory=cache_cfg.get("dir", "./cache/images"),
+            max_size=int(cache_cfg.get("max_size_mb", 1024) * 1024 * 1024),
+            max_age=cache_cfg.get("max_age", 7 * 24 * 3600),
+            hot_tier=hot_tier,
+        )
+
+    def _paths(self, key):
+        directory = os.path.join(self.directory, key[:2])
+        return os.path.join(directory, key), os.path.join(directory, key + ".json")
+
+    def _scan(self):
+        """启动时从磁盘重建索引，按文件修改时间近似 LRU 顺序；已过期的条目直接删除"""
+        found = []
+        expired = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    if name.startswith(".tmp-"):
+                        os.remove(os.path.join(root, name))  # 上次异常退出残留的临时文件
+                    continue
+                key = name[:-len(".json")]
+                data_path, meta_path = self._paths(key)
+                try:
+                    with open(meta_path, "r", encoding="utf-8") as f:
+                        meta = json.load(f)
+                    st = os.stat(data_path)
+                except (OSError, ValueError):
+                    self._remove_files(key)
+                    continue
+                entry = CacheEntry(key, data_path, st.st_size, meta.get("content_type", ""),
+                                   meta.get("etag", ""), meta.get("created_at", st.st_mtime))
+                if self._expired(entry):
+                    self._remove_files(key)
+                    expired += 1
+                    continue
+                found.append(entry)
+        found.sort(key=lambda e: os.path.getmtime(e.path))
+        with self._lock:
+            for entry in found:
+                self._entries[entry.key] = entry
+                self.total_size += entry.size
+            self._evict_locked()
+        if found:
+            print(f"[ImageCache] Loaded {len(found)} entries ({self.total_size // 1024} KB) from {self.directory}")
+        if expired:
+            print(f"[ImageCache] Removed {expired} expired entries")
+
+    def _expired(self, entry):
+        return bool(self.max_age) and time.time() - entry.created_at > self.max_age
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """查找条目（不计入命中统计），过期条目删除后返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry):
+                self._discard_locked(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def fetch(self, url: str, download) -> CacheEntry:
+        """
+        返回 url 的缓存条目，未命中时调用 download(fileobj) 写入图片并返回 Content-Type
+        同一 URL 的并发未命中只下载一次，其余请求等待结果（包括失败）
+        依次查找内存热点层与磁盘；小图读出后尝试放入热点层，放入成功时 entry.data 为图片内容
+        """
+        key = cache_key(url)
+        if self.hot_tier is not None:
+            entry = self.hot_tier.get(key)
+            if entry is not None:
+                if not self._expired(entry):
+                    with self._lock:
+                        # 热点层命中也计入磁盘 LRU，避免高频小图在磁盘上被淘汰后连带移出热点层
+                        if key in self._entries:
+                            self._entries.move_to_end(key)
+                    return entry
+                self.hot_tier.discard(key)
+
+        entry = self.get(key)
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+            return self._promote(entry)
+
+        def load():
+            with self._lock:
+                self.misses += 1
+            return self._promote(self._store(key, url, download))
+
+        return self._flights.do(key, load)
+
+    def _promote(self, entry):
+        """小图通过热点层准入预判后才读入内存，再交给热点层写入"""
+        hot_tier = self.hot_tier
+        if hot_tier is None or not hot_tier.would_admit(entry.key, entry.size):
+            return entry
+        try:
+            with open(entry.path, "rb") as f:
+                hot_entry = entry._replace(data=f.read())
+        except FileNotFoundError:
+            return entry
+        return hot_entry if hot_tier.put(entry.key, hot_entry, entry.size) else entry
+
+    def _store(self, key, url, download):
+        """下载到同目录临时文件，计算内容哈希后原子替换为正式文件"""
+        data_path, meta_path = self._paths(key)
+        directory = os.path.dirname(data_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                writer = _HashingWriter(f)
+                content_type = download(writer)
+                f.flush()
+                os.fsync(f.fileno())
+            content_type = content_type or mimetypes.guess_type(url)[0] or "application/octet-stream"
+            entry = CacheEntry(key, data_path, writer.size, content_type,
+                               writer.sha256.hexdigest(), time.time())
+            meta = {"url": url, "content_type": entry.content_type, "etag": entry.etag,
+                    "created_at": entry.created_at}
+            # 先写元数据再替换图片文件：扫描时只认同时存在的两者
+            with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(meta_path + ".tmp", meta_path)
+            os.replace(tmp_path, data_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_size -= old.size
+                if self.hot_tier is not None:
+                    self.hot_tier.discard(key)
+            self._entries[key] = entry
+            self.total_size += entry.size
+            self._evict_locked(keep=key)
+        return entry
+
+    def _evict_locked(self, keep=None):
+        """
+        先删除过期条目，再淘汰最久未使用的条目直到总大小不超过上限（保留刚写入的条目）
+        过期清理需要遍历全部条目，未超出上限时每 SWEEP_INTERVAL 秒最多执行一次
+        """
+        now = time.time()
+        if self.max_age and (self.total_size > self.max_size or now - self._last_sweep >= SWEEP_INTERVAL):
+            self._last_sweep = now
+            for key in [k for k, e in self._entries.items() if k != keep and self._expired(e)]:
+                self._discard_locked(key)
+        while self.total_size > self.max_size and self._entries:
+            key = next(iter(self._entries))
+            if key == keep:
+                if len(self._entries) == 1:
+                    break
+                self._entries.move_to_end(key)
+                continue
+            self._discard_locked(key)
+            self.evictions += 1
+
+    def _discard_locked(self, key):
+        """删除磁盘条目（淘汰或过期），同时移出内存热点层"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_size -= entry.size
+            self._remove_files(key)
+        if self.hot_tier is not None:
+            self.hot_tier.discard(key)
+
+    def _remove_files(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """磁盘层统计（内存热点层命中的请求不计入）"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size": self.total_size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self._flights.shared,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class _HashingWriter:
+    """写入文件的同时计算 sha256 与字节数"""
+
+    def __init__(self, f):
+        self._f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._f.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> Optional[ImageCache]:
+    """获取进程内共享的磁盘缓存，image_cache.enabled 为 false 时返回 None"""
+    global _cache
+    if not config.image_cache.get("enabled", True):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ImageCache.from_config()
+    return _cache
@@ -0,0 +1,96 @@
+"""
+JSON 编解码 - 上游原始响应体透传，以及更快的序列化（可选 orjson）
+
+RawJson 保存 app-api 返回的原始字节，只在需要读取字段时才解析；
+不需要修改结果的路由直接把原始字节发给客户端，省去一次解析和一次序列化
+"""
+import json
+import re
+from collections.abc import Mapping
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Pixiv 错误响应形如 {"error": {...}}，允许空白
+ERROR_PREFIX = re.compile(rb'\s*\{\s*"error"\s*:')
+# 不超过该长度且含 "error" 键名的响应体也视为可能的错误（键顺序不同时），由调用方解析确认
+SMALL_BODY = 1024
+
+
+def loads(data):
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _default(obj):
+    if isinstance(obj, RawJson):
+        return obj.parsed
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> bytes:
+    """序列化为 UTF-8 JSON 字节（orjson 可用时使用 orjson）；RawJson 只读，总是返回原始字节"""
+    if isinstance(obj, RawJson):
+        return obj.raw
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class RawJson(Mapping):
+    """
+    延迟解析的上游 JSON 对象（只读）
+    按字典方式访问时才解析；raw 为原始响应体，可直接作为响应返回
+    """
+
+    __slots__ = ("raw", "_parsed")
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        self._parsed = None
+
+    @property
+    def is_parsed(self) -> bool:
+        return self._parsed is not None
+
+    @property
+    def parsed(self) -> dict:
+        if self._parsed is None:
+            self._parsed = loads(self.raw)
+        return self._parsed
+
+    def maybe_error(self) -> bool:
+        """
+        是否可能是错误响应（返回 False 时确定不是，无需解析正常响应）：
+        以 {"error": 开头（允许空白），或是含 "error" 键名的较小响应体
+        """
+        raw = self.raw
+        return bool(ERROR_PREFIX.match(raw)) or (len(raw) <= SMALL_BODY and b'"error"' in raw)
+
+    def __getitem__(self, key):
+        return self.parsed[key]
+
+    def __iter__(self):
+        return iter(self.parsed)
+
+    def __len__(self):
+        return len(self.parsed)
+
+    def __getattr__(self, attr):
+        # 兼容 pixivpy3 JsonDict 的属性访问
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return self.parsed.get(attr)
+
+    def __eq__(self, other):
+        if isinstance(other, RawJson):
+            return self.raw == other.raw
+        return self.parsed == other
+
+    __hash__ = None
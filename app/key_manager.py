@@ -3,9 +3,69 @@ API Key Manager - 管理 API 密钥的创建、验证和访问控制
 """
 import secrets
 import re
-from dataclasses import dataclass, field, asdict
+import threading
+from dataclasses import dataclass, field, asdict, replace
 from datetime import datetime, timezone
-from typing import List, Optional, Tuple
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+from app import timing
+
+
+_NUMERIC_SEGMENT = re.compile(r"/\d+")
+_NUMERIC_CONVERTER = re.compile(r"/<(?:int|float)(?:\([^)]*\))?:[^>]+>")
+
+
+@lru_cache(maxsize=1024)
+def normalize_endpoint(endpoint: str) -> str:
+    """
+    规范化端点路径，移除动态参数
+    既接受实际路径（/api/illust/123），也接受 Flask URL 规则（/api/illust/<int:illust_id>），
+    两者都得到 /api/illust/<id>；按 URL 规则调用时缓存键只有路由数量那么多
+    """
+    normalized = endpoint.split("?")[0]
+    normalized = _NUMERIC_CONVERTER.sub("/<id>", normalized)
+    normalized = _NUMERIC_SEGMENT.sub("/<id>", normalized)
+    return normalized
+
+
+class EndpointMatcher:
+    """
+    预编译的端点规则集合
+    精确规则放入集合，通配规则（以 /* 结尾）按路径段建前缀树，
+    匹配代价只与路径段数有关，与规则数量无关
+    """
+
+    __slots__ = ("_exact", "_prefixes")
+
+    def __init__(self, patterns: Iterable[str]):
+        self._exact = set()
+        self._prefixes = {}
+        for pattern in patterns:
+            if pattern.endswith("/*"):
+                # "/api/proxy/*" -> 前缀 "/api/proxy/" -> 路径段 ["", "api", "proxy"]
+                node = self._prefixes
+                for segment in pattern[:-1].split("/")[:-1]:
+                    node = node.setdefault(segment, {})
+                node[None] = True
+            else:
+                self._exact.add(pattern)
+
+    def match(self, endpoint: str) -> bool:
+        """检查端点是否匹配任一规则"""
+        if endpoint in self._exact:
+            return True
+        node = self._prefixes
+        if not node:
+            return False
+        for segment in endpoint.split("/"):
+            # 前缀之后还有剩余路径段，等价于 endpoint.startswith(prefix)
+            if None in node:
+                return True
+            node = node.get(segment)
+            if node is None:
+                return False
+        return False
 
 
 @dataclass
@@ -43,6 +103,22 @@ class APIKey:
     created_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"))
     enabled: bool = True
     pool_restriction: PoolRestriction = field(default_factory=PoolRestriction)
+    _allowed_matcher: EndpointMatcher = field(init=False, repr=False, compare=False)
+    _denied_matcher: EndpointMatcher = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.compile_rules()
+
+    def compile_rules(self):
+        """编译端点规则；直接修改 allowed/denied_endpoints 后需重新调用"""
+        self._allowed_matcher = EndpointMatcher(self.allowed_endpoints)
+        self._denied_matcher = EndpointMatcher(self.denied_endpoints)
+
+    def is_endpoint_allowed(self, normalized_endpoint: str) -> bool:
+        """按访问模式判断已规范化的端点是否允许访问"""
+        if self.access_mode == "whitelist":
+            return self._allowed_matcher.match(normalized_endpoint)
+        return not self._denied_matcher.match(normalized_endpoint)
 
     def to_dict(self) -> dict:
         """转换为字典用于序列化"""
@@ -72,6 +148,14 @@ class APIKey:
         )
 
 
+class _KeySnapshot(NamedTuple):
+    """API Key 的不可变快照，附带按 key 值和名称的索引"""
+    keys: Tuple[APIKey, ...]
+    by_key: Dict[str, APIKey]
+    by_name: Dict[str, APIKey]
+    pool_scopes: Dict[str, Tuple[str, FrozenSet[str]]]
+
+
 class KeyManager:
     """API 密钥管理器"""
 
@@ -80,9 +164,33 @@ class KeyManager:
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
-            cls._instance._keys: List[APIKey] = []
+            cls._instance._write_lock = threading.RLock()
+            cls._instance._set_keys([])
+            cls._instance.store = None  # 集群模式下共享 API Key 列表的 StateStore
+            cls._instance._store_version = 0
         return cls._instance
 
+    @property
+    def _keys(self) -> Tuple[APIKey, ...]:
+        return self._snapshot.keys
+
+    @_keys.setter
+    def _keys(self, keys: List[APIKey]):
+        self._set_keys(keys)
+
+    def _set_keys(self, keys: List[APIKey]):
+        """构建新快照并整体替换（读取方无需加锁）"""
+        keys = tuple(keys)
+        self._snapshot = _KeySnapshot(
+            keys=keys,
+            by_key={k.key: k for k in keys},
+            by_name={k.name: k for k in keys},
+            pool_scopes={
+                k.key: (k.pool_restriction.mode, frozenset(k.pool_restriction.allowed_accounts))
+                for k in keys
+            },
+        )
+
     @staticmethod
     def generate_key() -> str:
         """生成 32 字符的随机 API Key，带 pk_ 前缀"""
@@ -91,25 +199,25 @@ class KeyManager:
 
     def load_from_config(self, api_keys_data: List[dict]):
         """从配置数据加载 API Keys"""
-        self._keys = [APIKey.from_dict(k) for k in (api_keys_data or [])]
+        with self._write_lock:
+            self._set_keys([APIKey.from_dict(k) for k in (api_keys_data or [])])
+
+    def watch_config(self):
+        """配置重载（手动或文件监视触发）后自动刷新 API Key 快照"""
+        from app.config import config
+        config.add_reload_listener(self._reload_from_config)
 
     def list_keys(self) -> List[APIKey]:
         """列出所有 API Keys"""
-        return self._keys.copy()
+        return list(self._snapshot.keys)
 
     def get_key(self, key_value: str) -> Optional[APIKey]:
         """根据 key 值获取 APIKey"""
-        for k in self._keys:
-            if k.key == key_value:
-                return k
-        return None
+        return self._snapshot.by_key.get(key_value)
 
     def get_key_by_name(self, name: str) -> Optional[APIKey]:
         """根据名称获取 APIKey"""
-        for k in self._keys:
-            if k.name == name:
-                return k
-        return None
+        return self._snapshot.by_name.get(name)
 
     def create_key(
         self,
@@ -121,6 +229,20 @@ class KeyManager:
         allowed_accounts: List[str] = None,
     ) -> Tuple[Optional[APIKey], str]:
         """创建新的 API Key，返回 (api_key, error_message)"""
+        with self._write_lock:
+            return self._create_key(
+                name, access_mode, allowed_endpoints, denied_endpoints, pool_mode, allowed_accounts
+            )
+
+    def _create_key(
+        self,
+        name: str,
+        access_mode: str,
+        allowed_endpoints: Optional[List[str]],
+        denied_endpoints: Optional[List[str]],
+        pool_mode: str,
+        allowed_accounts: Optional[List[str]],
+    ) -> Tuple[Optional[APIKey], str]:
         if self.get_key_by_name(name):
             return None, "Key name already exists"
 
@@ -147,7 +269,7 @@ class KeyManager:
             denied_endpoints=denied_endpoints or [],
             pool_restriction=pool_restriction,
         )
-        self._keys.append(api_key)
+        self._set_keys(self._keys + (api_key,))
         self._save_to_config()
         return api_key, ""
 
@@ -162,55 +284,73 @@ class KeyManager:
         allowed_accounts: List[str] = None,
     ) -> Tuple[bool, str]:
         """更新 API Key 配置，返回 (success, error_message)"""
-        api_key = self.get_key_by_name(name)
-        if not api_key:
-            return False, "Key not found"
+        with self._write_lock:
+            current = self.get_key_by_name(name)
+            if not current:
+                return False, "Key not found"
 
-        if access_mode is not None:
-            if access_mode not in ("whitelist", "blacklist"):
-                return False, "Invalid access mode"
-            api_key.access_mode = access_mode
+            # 在副本上修改，校验通过后再整体替换快照
+            api_key = self._copy_key(current)
 
-        if allowed_endpoints is not None:
-            api_key.allowed_endpoints = allowed_endpoints
+            if access_mode is not None:
+                if access_mode not in ("whitelist", "blacklist"):
+                    return False, "Invalid access mode"
+                api_key.access_mode = access_mode
 
-        if denied_endpoints is not None:
-            api_key.denied_endpoints = denied_endpoints
+            if allowed_endpoints is not None:
+                api_key.allowed_endpoints = allowed_endpoints
 
-        if enabled is not None:
-            api_key.enabled = enabled
+            if denied_endpoints is not None:
+                api_key.denied_endpoints = denied_endpoints
 
-        # 处理池限制更新
-        if pool_mode is not None:
-            if pool_mode not in ("all", "specific"):
-                return False, "Invalid pool mode"
+            if enabled is not None:
+                api_key.enabled = enabled
+
+            # 处理池限制更新
+            if pool_mode is not None:
+                if pool_mode not in ("all", "specific"):
+                    return False, "Invalid pool mode"
             
-            # 如果更新为 specific 模式，检查是否有账号
-            new_accounts = allowed_accounts if allowed_accounts is not None else api_key.pool_restriction.allowed_accounts
-            if pool_mode == "specific" and not new_accounts:
-                return False, "At least one account must be selected for specific mode"
+                # 如果更新为 specific 模式，检查是否有账号
+                new_accounts = allowed_accounts if allowed_accounts is not None else api_key.pool_restriction.allowed_accounts
+                if pool_mode == "specific" and not new_accounts:
+                    return False, "At least one account must be selected for specific mode"
             
-            api_key.pool_restriction.mode = pool_mode
-            if allowed_accounts is not None:
+                api_key.pool_restriction.mode = pool_mode
+                if allowed_accounts is not None:
+                    api_key.pool_restriction.allowed_accounts = allowed_accounts
+            elif allowed_accounts is not None:
+                # 仅更新账号列表
+                if api_key.pool_restriction.mode == "specific" and not allowed_accounts:
+                    return False, "At least one account must be selected for specific mode"
                 api_key.pool_restriction.allowed_accounts = allowed_accounts
-        elif allowed_accounts is not None:
-            # 仅更新账号列表
-            if api_key.pool_restriction.mode == "specific" and not allowed_accounts:
-                return False, "At least one account must be selected for specific mode"
-            api_key.pool_restriction.allowed_accounts = allowed_accounts
 
-        self._save_to_config()
-        return True, ""
+            api_key.compile_rules()
+            self._set_keys(api_key if k is current else k for k in self._keys)
+            self._save_to_config()
+            return True, ""
 
     def delete_key(self, name: str) -> bool:
         """删除 API Key"""
-        api_key = self.get_key_by_name(name)
-        if not api_key:
-            return False
+        with self._write_lock:
+            api_key = self.get_key_by_name(name)
+            if not api_key:
+                return False
 
-        self._keys.remove(api_key)
-        self._save_to_config()
-        return True
+            self._set_keys(k for k in self._keys if k is not api_key)
+            self._save_to_config()
+            return True
+
+    @staticmethod
+    def _copy_key(api_key: APIKey) -> APIKey:
+        """复制 APIKey（包括可变的池限制），供写时复制使用"""
+        return replace(
+            api_key,
+            pool_restriction=PoolRestriction(
+                mode=api_key.pool_restriction.mode,
+                allowed_accounts=api_key.pool_restriction.allowed_accounts.copy(),
+            ),
+        )
 
     def get_allowed_accounts(self, key_value: str) -> Tuple[Optional[str], List[str]]:
         """获取 API Key 的账号池限制配置，返回 (mode, allowed_account_names)"""
@@ -219,19 +359,28 @@ class KeyManager:
             return None, []
         return api_key.pool_restriction.mode, api_key.pool_restriction.allowed_accounts.copy()
 
+    def get_pool_scope(self, key_value: str) -> Tuple[Optional[str], FrozenSet[str]]:
+        """获取预先计算的账号池范围 (mode, allowed_account_names)，随快照更新"""
+        return self._snapshot.pool_scopes.get(key_value, (None, frozenset()))
+
     def remove_account_from_all_keys(self, account_name: str):
         """从所有 API Key 的 allowed_accounts 中移除指定账号"""
-        for api_key in self._keys:
-            if account_name in api_key.pool_restriction.allowed_accounts:
-                api_key.pool_restriction.allowed_accounts.remove(account_name)
-        self._save_to_config()
+        with self._write_lock:
+            keys = []
+            for api_key in self._keys:
+                if account_name in api_key.pool_restriction.allowed_accounts:
+                    api_key = self._copy_key(api_key)
+                    api_key.pool_restriction.allowed_accounts.remove(account_name)
+                keys.append(api_key)
+            self._set_keys(keys)
+            self._save_to_config()
 
     def check_access(self, key_value: str, endpoint: str) -> Tuple[bool, str]:
         """检查 API Key 是否有权访问指定端点"""
-        # 每次检查时从配置重新加载，确保配置变更立即生效
-        self._reload_from_config()
-        
-        api_key = self.get_key(key_value)
+        # 配置文件的变更由 config 监视线程重载后推送到快照（见 watch_config），
+        # 这里只做字典查找，不再每次请求都解析 YAML
+        with timing.phase("auth"):
+            api_key = self.get_key(key_value)
 
         if not api_key:
             return False, "Invalid API key"
@@ -239,45 +388,62 @@ class KeyManager:
         if not api_key.enabled:
             return False, "API key is disabled"
 
-        normalized_endpoint = self._normalize_endpoint(endpoint)
-
-        if api_key.access_mode == "whitelist":
-            if self._match_endpoint(normalized_endpoint, api_key.allowed_endpoints):
-                return True, ""
-            return False, "Access denied to this endpoint"
-        else:
-            if self._match_endpoint(normalized_endpoint, api_key.denied_endpoints):
-                return False, "Access denied to this endpoint"
+        with timing.phase("key"):
+            allowed = api_key.is_endpoint_allowed(normalize_endpoint(endpoint))
+        if allowed:
             return True, ""
+        return False, "Access denied to this endpoint"
     
     def _reload_from_config(self):
-        """从配置文件重新加载 API Keys"""
+        """从已重载的配置中重建 API Key 快照（集群模式下手动修改的配置同时写入共享存储）"""
         from app.config import config
-        config.reload()
-        self._keys = [APIKey.from_dict(k) for k in (config.api_keys or [])]
-
-    def _normalize_endpoint(self, endpoint: str) -> str:
-        """规范化端点路径，移除动态参数"""
-        normalized = re.sub(r"/\d+", "/<id>", endpoint)
-        normalized = normalized.split("?")[0]
-        return normalized
-
-    def _match_endpoint(self, endpoint: str, patterns: List[str]) -> bool:
-        """检查端点是否匹配任一模式"""
-        for pattern in patterns:
-            if pattern.endswith("/*"):
-                prefix = pattern[:-1]
-                if endpoint.startswith(prefix):
-                    return True
-            elif pattern == endpoint:
-                return True
-        return False
+        self.load_from_config(config.api_keys)
+        if self.store is not None:
+            with self._write_lock:
+                keys = [k.to_dict() for k in self._keys]
+                if keys != self.store.get_api_keys()[1]:
+                    self._store_version = self.store.put_api_keys(keys)
 
     def _save_to_config(self):
-        """保存到配置文件"""
+        """保存到配置文件，集群模式下同时写入共享存储"""
+        from app.config import config
+
+        keys = [k.to_dict() for k in self._keys]
+        if self.store is not None:
+            self._store_version = self.store.put_api_keys(keys)
+        config.set_api_keys(keys)
+        # 新建的 Key 已返回给调用方，立即落盘而不是等待合并写入
+        config.flush()
+
+    def use_state_store(self, store):
+        """
+        接入共享存储：存储中已有 API Key 时以存储为准（写入本地配置），否则上传本地的 API Key
+        """
+        with self._write_lock:
+            self.store = store
+            version, keys = store.get_api_keys()
+            if keys is None:
+                self._store_version = store.put_api_keys([k.to_dict() for k in self._keys])
+            else:
+                self._apply_store_keys(version, keys)
+
+    def sync_from_store(self):
+        """其他实例修改了 API Key 时更新本地快照与配置文件"""
+        if self.store is None:
+            return
+        version, keys = self.store.get_api_keys()
+        if keys is None or version == self._store_version:
+            return
+        with self._write_lock:
+            self._apply_store_keys(version, keys)
+
+    def _apply_store_keys(self, version, keys):
         from app.config import config
 
-        config.set_api_keys([k.to_dict() for k in self._keys])
+        self._store_version = version
+        self._set_keys([APIKey.from_dict(k) for k in keys])
+        if keys != config.api_keys:
+            config.set_api_keys(keys)
 
 
 key_manager = KeyManager()
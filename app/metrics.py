@@ -0,0 +1,315 @@
+"""
+Prometheus 指标 - 请求、上游调用、账号选择与 token 刷新的延迟直方图，以文本格式在 /metrics 输出
+
+记录路径不加锁：每个线程只写自己的分片（threading.local），输出时合并所有分片；
+已退出线程的分片在输出时并入累计值后丢弃，线程频繁创建时分片数也不会增长
+缓存命中、账号并发等已有的统计在输出时读取，不在请求路径上重复记录
+"""
+import bisect
+import threading
+import time
+from typing import Callable, Iterable, Sequence, Tuple
+
+# 直方图默认分桶（秒）：覆盖本地缓存命中到慢速上游请求
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# 账号选择 / 排队等待的分桶（秒）：正常情况下是微秒级
+FAST_BUCKETS = (0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _merge(totals: dict, shard: dict):
+    for key, cell in list(shard.items()):
+        total = totals.get(key)
+        if total is None:
+            totals[key] = list(cell)
+        else:
+            for i, value in enumerate(cell):
+                total[i] += value
+
+
+class Registry:
+    """指标注册表，持有各线程的计数分片"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []  # [(thread, shard)]，shard: {(metric, label_values): cell}
+        self._retired = {}  # 已退出线程的累计值
+        self._metrics = []
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> dict:
+        """合并所有线程的分片，返回 {(metric, label_values): cell}"""
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    _merge(self._retired, shard)
+            self._shards = alive
+            totals = {}
+            _merge(totals, self._retired)
+            for _, shard in alive:
+                _merge(totals, shard)
+        return totals
+
+    def per_scrape(self, func):
+        """装饰无参函数：同一次 render 中只调用一次，多个指标共用其结果"""
+        def cached():
+            scrape = getattr(self._local, "scrape", None)
+            if scrape is None:
+                return func()
+            if func not in scrape:
+                scrape[func] = func()
+            return scrape[func]
+        return cached
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        self._local.scrape = {}
+        try:
+            return self._render()
+        finally:
+            self._local.scrape = None
+
+    def _render(self) -> str:
+        totals = self.snapshot()
+        by_metric = {}
+        for (metric, values), cell in totals.items():
+            by_metric.setdefault(metric, []).append((values, cell))
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render(sorted(by_metric.get(metric, ()), key=lambda item: item[0])))
+            except Exception as e:
+                print(f"[Metrics] Failed to collect {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter:
+    """单调递增计数"""
+
+    type = "counter"
+
+    def __init__(self, registry: Registry, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def inc(self, *labels, amount=1):
+        shard = self.registry._shard()
+        key = (self, labels)
+        cell = shard.get(key)
+        if cell is None:
+            cell = shard[key] = [0]
+        cell[0] += amount
+
+    def render(self, series):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        for values, cell in series:
+            yield f"{self.name}{_labels(self.labelnames, values)} {_number(cell[0])}"
+
+
+class Histogram(Counter):
+    """累计分桶直方图，cell 为各桶计数（最后一个为 +Inf）加上总和"""
+
+    type = "histogram"
+
+    def __init__(self, registry: Registry, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        shard = self.registry._shard()
+        key = (self, labels)
+        cell = shard.get(key)
+        if cell is None:
+            cell = shard[key] = [0] * (len(self.buckets) + 2)
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def time(self, *labels):
+        """计时上下文：with histogram.time("label"): ..."""
+        return _Timer(self, labels)
+
+    def render(self, series):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        for values, cell in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), cell):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}"
+            labels = _labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_number(float(cell[-1]))}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Collected:
+    """输出时由 callback 读取的指标，callback 返回 [(label_values, value)]"""
+
+    def __init__(self, registry: Registry, name: str, help: str, labelnames: Sequence[str] = (),
+                 callback: Callable[[], Iterable[Tuple[tuple, float]]] = None, type: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self.type = type
+        registry.register(self)
+
+    def render(self, series):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        for values, value in self.callback():
+            yield f"{self.name}{_labels(self.labelnames, values)} {_number(value)}"
+
+
+registry = Registry()
+
+REQUEST_DURATION = Histogram(
+    registry, "pixiv_http_request_duration_seconds",
+    "HTTP request latency by route template, method and status (_count is the request count)",
+    ("route", "method", "status"))
+UPSTREAM_DURATION = Histogram(
+    registry, "pixiv_upstream_request_duration_seconds",
+    "Pixiv API call latency by account, API method and result",
+    ("account", "method", "result"))
+ACCOUNT_SELECT = Histogram(
+    registry, "pixiv_account_select_seconds",
+    "Time to pick an account, including queue wait and synchronous token refresh",
+    buckets=FAST_BUCKETS)
+QUEUE_WAIT = Histogram(
+    registry, "pixiv_pool_queue_wait_seconds",
+    "Time requests waited for a free account slot, by outcome",
+    ("outcome",), buckets=FAST_BUCKETS)
+TOKEN_REFRESH = Histogram(
+    registry, "pixiv_token_refresh_seconds",
+    "Token refresh duration by account and result (result=\"failed\" counts failures)",
+    ("account", "result"))
+
+
+@registry.per_scrape
+def _cache_stats():
+    """
+    各缓存的 [(名称, 命中数, 未命中数)]
+    图片缓存只读取已创建的实例：未下载过图片的进程不因输出指标而创建缓存目录、扫描磁盘
+    """
+    from app import image_cache
+    from app.prefetch import prefetcher
+    from app.response_cache import response_cache
+
+    stats = response_cache.stats()
+    result = [("response", stats["hits"] + stats["stale_hits"], stats["misses"])]
+    cache = image_cache._cache
+    if cache is not None:
+        if cache.hot_tier is not None:
+            stats = cache.hot_tier.stats()
+            result.append(("image_memory", stats["hits"], stats["misses"]))
+        stats = cache.stats()
+        result.append(("image_disk", stats["hits"], stats["misses"]))
+    stats = prefetcher.stats()
+    result.append(("prefetch", stats["used"], stats["issued"] - stats["used"]))
+    return result
+
+
+def _accounts():
+    from app.pool import pool
+    return list(pool.accounts)
+
+
+def _pool():
+    from app.pool import pool
+    return pool
+
+
+Collected(registry, "pixiv_cache_hits_total", "Cache hits by cache", ("cache",),
+          lambda: [((name,), hits) for name, hits, _ in _cache_stats()], type="counter")
+Collected(registry, "pixiv_cache_misses_total", "Cache misses by cache", ("cache",),
+          lambda: [((name,), misses) for name, _, misses in _cache_stats()], type="counter")
+Collected(registry, "pixiv_cache_hit_ratio", "Cache hit ratio since start by cache", ("cache",),
+          lambda: [((name,), hits / (hits + misses) if hits + misses else 0.0)
+                   for name, hits, misses in _cache_stats()])
+Collected(registry, "pixiv_account_inflight", "In-flight upstream requests by account", ("account",),
+          lambda: [((a.name,), a.inflight) for a in _accounts()])
+Collected(registry, "pixiv_account_available", "1 if the account is authenticated and not cooling down",
+          ("account",), lambda: [((a.name,), int(a.authenticated and not a.in_cooldown())) for a in _accounts()])
+Collected(registry, "pixiv_account_requests_total", "Requests served by account", ("account",),
+          lambda: [((a.name,), a.request_count) for a in _accounts()], type="counter")
+Collected(registry, "pixiv_pool_waiting", "Requests currently queued for a free account slot",
+          callback=lambda: [((), _pool().waiting)])
+
+
+def instrument(app):
+    """
+    为 Flask 应用记录每个请求的路由、状态码与耗时
+    在 teardown_request 中记录：未处理的异常不会经过 after_request，这类请求按 500 计入
+    """
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def remember_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request(exc=None):
+        start = g.pop("metrics_start", None)
+        status = g.pop("metrics_status", 500)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            REQUEST_DURATION.observe(time.perf_counter() - start, route, request.method,
+                                     500 if exc is not None else status)
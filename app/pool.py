@@ -1,9 +1,23 @@
+import bisect
+import heapq
+import math
+import random
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 from pixivpy3 import AppPixivAPI
 from app.config import config
 from app.gppt_auth import gppt_auth, GPPT_AVAILABLE
+from app.refresher import TokenRefresher
+from app import transport, metrics, timing
+from app.json_codec import RawJson
+
+# Pixiv access token 有效期（秒），认证响应中缺少 expires_in 时使用
+DEFAULT_TOKEN_TTL = 3600
+
+# least_latency 策略中错误率的惩罚系数：错误率 10% 的账号评分按延迟的 2 倍计算
+ERROR_PENALTY = 10
 
 
 def get_proxy_settings():
@@ -24,7 +38,41 @@ def get_proxy_settings():
 
 
 class ProxiedAppPixivAPI(AppPixivAPI):
-    """支持代理的 AppPixivAPI"""
+    """支持代理的 AppPixivAPI，所有实例共享 transport 中的连接池"""
+    
+    timeout = None  # 账号单独设置的 requests 超时（秒），None 时使用 http 配置的 (connect, read) 超时
+    stats_callback = None  # 每次上游请求结束后调用 callback(elapsed, ok)
+    
+    def __init__(self, **requests_kwargs):
+        super().__init__(**requests_kwargs)
+        # 替换 pixivpy3 为每个实例创建的独立会话
+        self.requests = transport.get_session()
+        self.requests_kwargs["timeout"] = transport.default_timeout()
+    
+    def requests_call(self, method, url, headers=None, params=None, data=None, stream=False):
+        """记录每次上游请求的耗时与结果（HTTP 4xx/5xx 或异常视为失败）"""
+        start = time.perf_counter()
+        try:
+            response = super().requests_call(method, url, headers, params, data, stream)
+        except Exception:
+            self._report(time.perf_counter() - start, False)
+            raise
+        self._report(time.perf_counter() - start, response.status_code < 400)
+        return response
+    
+    def parse_result(self, res):
+        """
+        保留原始响应体、延迟解析（json_response.passthrough 关闭时同 pixivpy3）
+        不是 JSON 对象的响应（如 Cloudflare 页面）仍交给 pixivpy3 解析并抛出 PixivError
+        """
+        body = res.content
+        if not config.json_response.get("passthrough", True) or body.lstrip()[:1] != b"{":
+            return super().parse_result(res)
+        return RawJson(body)
+    
+    def _report(self, elapsed, ok):
+        if self.stats_callback:
+            self.stats_callback(elapsed, ok)
     
     def set_proxy(self, proxies):
         """设置代理"""
@@ -33,29 +81,61 @@ class ProxiedAppPixivAPI(AppPixivAPI):
             print(f"[Pixiv] Proxy set: {proxies}")
         else:
             self.requests_kwargs = {}
+        self.requests_kwargs["timeout"] = self.timeout or transport.default_timeout()
+    
+    def set_timeout(self, timeout):
+        """设置 requests 超时，避免单个账号卡住认证线程"""
+        self.timeout = timeout
+        self.requests_kwargs["timeout"] = timeout or transport.default_timeout()
+
+
+class PoolBusy(Exception):
+    """所有可用账号的并发都已达上限，且排队超时或队列已满"""
 
 
 class PixivAccount:
     """单个 Pixiv 账号"""
-    def __init__(self, name, refresh_token=None, username=None, password=None):
+    def __init__(self, name, refresh_token=None, username=None, password=None, timeout=None,
+                 weight=1, max_inflight=0):
         self.name = name
         self.refresh_token = refresh_token
         self.username = username
         self.password = password
         self.api = ProxiedAppPixivAPI()
-        # 设置代理
+        # 设置代理和超时
+        self.api.set_timeout(timeout)
         self.api.set_proxy(get_proxy_settings())
+        self.api.stats_callback = self.record_upstream
         self.request_count = 0
         self.last_request_time = 0
+        self.weight = max(1, int(weight or 1))  # 加权轮询权重
+        self.max_inflight = max(0, int(max_inflight or 0))  # 并发请求上限，0 表示不限制
+        self.inflight = 0  # 正在进行的上游请求数
+        self.cooldown_until = 0  # 冷却结束时间（被限流 / token 失效时设置）
+        self.cooldown_reason = None
+        self.latency_ewma = None  # 上游请求耗时的指数加权移动平均（秒）
+        self.error_rate_ewma = 0.0  # 上游请求失败率的指数加权移动平均
         self.last_refresh_time = 0  # 上次刷新 token 的时间
+        self.token_expires_at = 0  # access token 过期时间
         self.lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
         self.authenticated = False
+        self.shared = None  # 多进程共享状态（SharedState），None 表示只使用本进程状态
+        self.token_version = 0  # 已采用的共享 token 版本
+        self.unsynced_requests = 0  # 尚未合并到共享计数的请求数
+        self.position = float("inf")  # 在账号池中的排序位置（配置中的序号），手动添加的账号排在最后
     
     def auth(self, auto_gppt=False):
         """
         认证账号
         auto_gppt: 是否自动尝试 gppt 登录（启动时为 False，手动添加时为 True）
+        启用共享状态时只有持有租约的 worker 访问 Pixiv，其余 worker 使用其发布的 token
         """
+        if self.shared is not None:
+            return self.shared.authenticate(self, lambda: self._auth(auto_gppt))
+        return self._auth(auto_gppt)
+    
+    def _auth(self, auto_gppt):
         # 优先使用 refresh_token
         if self.refresh_token:
             if self._auth_with_token(self.refresh_token):
@@ -76,9 +156,11 @@ class PixivAccount:
     
     def _auth_with_token(self, token):
         try:
-            self.api.auth(refresh_token=token)
+            result = self.api.auth(refresh_token=token)
             self.authenticated = True
             self.last_refresh_time = time.time()
+            expires_in = (result.get("response") or {}).get("expires_in") if result else None
+            self.token_expires_at = self.last_refresh_time + (expires_in or DEFAULT_TOKEN_TTL)
             # 更新 refresh_token（pixivpy3 认证后会更新）
             if hasattr(self.api, 'refresh_token') and self.api.refresh_token:
                 self.refresh_token = self.api.refresh_token
@@ -107,7 +189,27 @@ class PixivAccount:
         return False
     
     def refresh(self):
-        """刷新 token"""
+        """
+        刷新 token（single-flight）
+        同一账号的并发刷新只会发起一次认证，其余调用等待其完成并复用结果
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            with self._refresh_lock:
+                return self.authenticated
+        start = time.perf_counter()
+        ok = False
+        try:
+            with timing.phase("refresh"):
+                if self.shared is not None:
+                    ok = self.shared.authenticate(self, self._refresh)
+                else:
+                    ok = self._refresh()
+            return ok
+        finally:
+            metrics.TOKEN_REFRESH.observe(time.perf_counter() - start, self.name, "ok" if ok else "failed")
+            self._refresh_lock.release()
+    
+    def _refresh(self):
         # 先尝试用 pixivpy3 自带的刷新
         if self.refresh_token:
             if self._auth_with_token(self.refresh_token):
@@ -121,12 +223,35 @@ class PixivAccount:
                 return self._auth_with_token(new_token)
         return False
     
-    def check_and_refresh(self, refresh_interval=3500):
+    def in_cooldown(self):
+        return time.time() < self.cooldown_until
+    
+    def saturated(self):
+        """并发请求数是否已达上限"""
+        return bool(self.max_inflight) and self.inflight >= self.max_inflight
+    
+    def try_acquire(self):
+        """占用一个并发名额，已达上限时返回 False"""
+        with self.lock:
+            if self.max_inflight and self.inflight >= self.max_inflight:
+                return False
+            self.inflight += 1
+            return True
+    
+    def release(self):
+        with self.lock:
+            self.inflight = max(0, self.inflight - 1)
+    
+    def is_stale(self, margin=100):
+        """token 是否即将过期（剩余有效期不足 margin 秒）"""
+        return time.time() > self.token_expires_at - margin
+    
+    def check_and_refresh(self, margin=100):
         """
-        检查并刷新 token
-        refresh_interval: 刷新间隔（秒），默认约1小时（Pixiv token 有效期约1小时）
+        检查并同步刷新 token
+        margin: 剩余有效期不足多少秒时刷新
         """
-        if time.time() - self.last_refresh_time > refresh_interval:
+        if self.is_stale(margin):
             print(f"[Pool] Account [{self.name}] token may expire, refreshing...")
             return self.refresh()
         return True
@@ -134,7 +259,160 @@ class PixivAccount:
     def record_request(self):
         with self.lock:
             self.request_count += 1
+            self.unsynced_requests += 1
             self.last_request_time = time.time()
+    
+    def record_upstream(self, elapsed, ok):
+        """更新上游延迟与错误率的 EWMA"""
+        alpha = config.ewma_alpha
+        with self.lock:
+            if self.latency_ewma is None:
+                self.latency_ewma = elapsed
+            else:
+                self.latency_ewma += alpha * (elapsed - self.latency_ewma)
+            self.error_rate_ewma += alpha * ((0.0 if ok else 1.0) - self.error_rate_ewma)
+    
+    def load_score(self):
+        """
+        负载评分（越小越好）：延迟 EWMA 按错误率、并发数加权，再除以权重；
+        尚无数据的账号为 0，优先探测
+        """
+        latency = (self.latency_ewma or 0.0) * (1 + ERROR_PENALTY * self.error_rate_ewma)
+        return latency * (1 + self.inflight) / self.weight
+
+class AccountView:
+    """
+    账号范围（全部账号，或某个 Key 允许的账号）的预计算视图
+    轮询使用权重前缀和 + 游标，最少使用使用惰性修正的最小堆，
+    构建代价 O(n)，选择代价与账号总数、权重大小基本无关；账号池变化时整体重建
+    """
+
+    # 步长从总权重的黄金分割比例附近选取：相邻游标在权重环上相距约 0.618 圈，同一账号的各份权重分散开
+    GOLDEN_RATIO = 0.6180339887
+    MAX_PARTIAL_QUOTIENT = 3  # 步长 / 总权重 的连分数部分商上限，越小选择间隔越均匀
+    STRIDE_SEARCH = 64
+
+    def __init__(self, accounts):
+        self.accounts = list(accounts)
+        self.lock = threading.Lock()
+        self.index = 0
+        self.next_index = None  # 多进程共享的轮询游标（返回递增前的值），None 时使用本地游标
+        self._bounds, self.total_weight, self._stride = self._weighted_ring(self.accounts)
+        self._heap = [self._heap_entry(a, a.request_count, i) for i, a in enumerate(self.accounts)]
+        heapq.heapify(self._heap)
+
+    @classmethod
+    def _weighted_ring(cls, accounts):
+        """
+        加权轮询的权重环：每个账号按权重占一段连续区间（权重先按最大公约数约简），
+        返回 (各区间的右端点, 总权重, 步长)
+        第 k 次选择落在位置 k * 步长 mod 总权重，步长与总权重互素，因此每一圈中
+        每个账号恰好被选中 权重 次；权重都相同时步长为 1，即按列表顺序轮询
+        """
+        if not accounts:
+            return [], 0, 1
+        divisor = 0
+        for account in accounts:
+            divisor = math.gcd(divisor, account.weight)
+        bounds = []
+        total = 0
+        for account in accounts:
+            total += account.weight // divisor
+            bounds.append(total)
+        stride = 1
+        if total != len(accounts):
+            stride = cls._stride_for(total)
+        return bounds, total, stride
+
+    @classmethod
+    def _stride_for(cls, total):
+        """
+        与 total 互素、且 步长 / total 的连分数部分商都不超过 MAX_PARTIAL_QUOTIENT 的步长
+        （部分商越小，k * 步长 mod total 在任意一段游标内越均匀，同一账号不会扎堆）；
+        在黄金分割点附近搜索，找不到时取部分商最小的候选
+        """
+        center = round(total * cls.GOLDEN_RATIO)
+        best = (total, 1)
+        for distance in range(cls.STRIDE_SEARCH + 1):
+            for stride in (center - distance, center + distance):
+                if not 0 < stride < total or math.gcd(stride, total) != 1:
+                    continue
+                quotients = []
+                a, b = total, stride
+                while b:
+                    quotients.append(a // b)
+                    a, b = b, a % b
+                largest = max(quotients[:-1] or quotients)
+                if largest <= cls.MAX_PARTIAL_QUOTIENT:
+                    return stride
+                best = min(best, (largest, stride))
+        return best[1]
+
+    def at(self, position):
+        """游标位置对应的账号下标"""
+        return bisect.bisect_right(self._bounds, position * self._stride % self.total_weight)
+
+    @staticmethod
+    def _heap_entry(account, count, seq):
+        # 按 请求数 / 权重 排序，同时记录入堆时的请求数用于判断条目是否过期
+        return (count / account.weight, seq, count, account)
+
+    def round_robin(self, usable):
+        """取游标位置在权重环上对应的账号，不可用时按列表顺序取其后第一个可用账号"""
+        accounts = self.accounts
+        n = len(accounts)
+        if not n:
+            return None
+        if self.next_index is not None:
+            start = self.next_index()
+        else:
+            with self.lock:
+                start = self.index
+                self.index += 1
+        first = self.at(start)
+        for offset in range(n):
+            account = accounts[(first + offset) % n]
+            if usable(account):
+                return account
+        return None
+
+    def least_used(self, usable):
+        """
+        取 请求数 / 权重 最小的可用账号
+        计数只增不减，堆中过期（偏小）的条目会先浮到堆顶，在那里按当前计数修正
+        """
+        with self.lock:
+            heap = self._heap
+            skipped = []
+            chosen = None
+            while heap:
+                _, seq, count, account = heap[0]
+                if count != account.request_count:
+                    heapq.heapreplace(heap, self._heap_entry(account, account.request_count, seq))
+                    continue
+                if usable(account):
+                    chosen = account
+                    # 预先计入本次请求，record_request 之后与账号计数一致
+                    heapq.heapreplace(heap, self._heap_entry(account, count + 1, seq))
+                    break
+                skipped.append(heapq.heappop(heap))
+            for entry in skipped:
+                heapq.heappush(heap, entry)
+        return chosen
+
+    def sample_two(self, usable, tries=8):
+        """随机取最多两个不同的可用账号；可用账号很少时退化为全量扫描"""
+        n = len(self.accounts)
+        picks = []
+        for _ in range(tries):
+            account = self.accounts[random.randrange(n)]
+            if account not in picks and usable(account):
+                picks.append(account)
+                if len(picks) == 2:
+                    return picks
+        candidates = [a for a in self.accounts if usable(a)]
+        return random.sample(candidates, min(2, len(candidates)))
+
 
 class AccountPool:
     """多账号负载均衡池"""
@@ -147,12 +425,53 @@ class AccountPool:
         return cls._instance
     
     def _init_pool(self):
-        self.accounts = []
         self.lock = threading.Lock()
-        self.index = 0
+        self.accounts = []
+        self._capacity = threading.Condition()  # 有账号释放并发名额时通知排队的请求
+        self.waiting = 0  # 因所有账号都已满载而排队等待的请求数
+        self._releases = 0  # 名额释放次数，避免在检查与等待之间错过通知
+        self.refresher = None
+        self.pending_auth = 0  # 启动时仍在后台认证的账号数
+        self.min_ready_accounts = 1
+        self.shared = None  # 多进程共享状态（SharedState）
 
-    def load_from_config(self):
-        """从 config.yaml 加载账号"""
+    @property
+    def accounts(self):
+        return self._accounts
+    
+    @accounts.setter
+    def accounts(self, accounts):
+        """替换账号列表（写时复制），同时使所有预计算视图失效"""
+        self._accounts = accounts
+        self._views = {}
+    
+    def _view(self, pool_mode="all", allowed_accounts=None):
+        """获取（必要时构建）账号范围视图；allowed_accounts 传 frozenset 时哈希有缓存"""
+        key = "all" if pool_mode == "all" else frozenset(allowed_accounts or ())
+        view = self._views.get(key)
+        if view is None:
+            with self.lock:
+                accounts = self._accounts
+                if key != "all":
+                    accounts = [a for a in accounts if a.name in key]
+                view = AccountView(accounts)
+                if self.shared is not None and config.shared_state.get("shared_round_robin", True):
+                    scope_key = "all" if key == "all" else ",".join(sorted(key))
+                    view.next_index = lambda: self.shared.next_index(scope_key)
+                self._views[key] = view
+        return view
+    
+    def _executor(self, prefix):
+        """创建有界线程池，用于并行认证 / 刷新"""
+        workers = config.startup.get("auth_workers", 8)
+        return ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=prefix)
+
+    def load_from_config(self, wait_ready=True):
+        """
+        从 config.yaml 加载账号（并行认证）
+        wait_ready: 是否阻塞到可用账号数达到 min_ready_accounts（或全部认证结束）；
+        其余账号在后台继续认证，完成后自动加入账号池
+        """
         # 初始化 gppt 缓存目录
         gppt_config = config._data.get("gppt", {})
         if gppt_config.get("enabled", False):
@@ -160,31 +479,116 @@ class AccountPool:
             gppt_auth.cache_dir = Path(cache_dir)
             gppt_auth.cache_dir.mkdir(exist_ok=True)
         
-        # 从 config.yaml 加载
-        for acc in config.pixiv_accounts:
+        startup_cfg = config.startup
+        self.min_ready_accounts = startup_cfg.get("min_ready_accounts", 1)
+        auth_timeout = startup_cfg.get("auth_timeout", 30)
+        
+        # 从 config.yaml 加载；名称与排序位置在提交认证前按配置顺序确定，
+        # 并行认证的完成顺序不影响账号名与账号池顺序
+        configured = config.pixiv_accounts
+        taken = {acc.get("name") for acc in configured if acc.get("name")} | {a.name for a in self.accounts}
+        entries = []
+        for index, acc in enumerate(configured):
+            name = acc.get("name")
+            if not name:
+                name = self._unused_name(taken, index)
+                taken.add(name)
             if acc.get("enabled", True):
-                self.add_account(
+                entries.append((index, name, acc))
+        with self.lock:
+            self.pending_auth += len(entries)
+        
+        def auth_entry(index, name, acc):
+            try:
+                return self.add_account(
                     refresh_token=acc.get("refresh_token"),
-                    name=acc.get("name"),
+                    name=name,
+                    position=index,
                     username=acc.get("username"),
                     password=acc.get("password"),
-                    save=False  # 启动时不重复保存
+                    save=False,  # 启动时不重复保存
+                    timeout=acc.get("timeout"),
+                    auth_timeout=auth_timeout,
+                    weight=acc.get("weight", 1),
+                    max_inflight=acc.get("max_inflight"),
                 )
+            finally:
+                with self.lock:
+                    self.pending_auth -= 1
         
-        print(f"[Pool] Loaded {len(self.accounts)} accounts from config.yaml")
+        executor = self._executor("pool-auth")
+        futures = [executor.submit(auth_entry, *entry) for entry in entries]
+        executor.shutdown(wait=False)
+        
+        if wait_ready:
+            pending = set(futures)
+            while pending and not self.is_ready():
+                _, pending = wait(pending, return_when=FIRST_COMPLETED)
+        
+        print(f"[Pool] Loaded {len(self.accounts)}/{len(entries)} accounts from config.yaml"
+              + (f", {self.pending_auth} still authenticating" if self.pending_auth else ""))
+    
+    def enable_shared_state(self, shared):
+        """接入多进程共享状态（需在加载账号之前调用）"""
+        self.shared = shared
+        for account in self.accounts:
+            account.shared = shared
+        self.accounts = self.accounts  # 重建视图以使用共享轮询游标
     
-    def add_account(self, refresh_token=None, name=None, username=None, password=None, auto_gppt=False, save=True):
+    def is_ready(self):
+        """可用账号数是否达到 min_ready_accounts"""
+        return len(self.get_available_account_names()) >= self.min_ready_accounts
+    
+    def load(self):
+        """当前负载：(正在进行的上游请求数, 可用账号数, 排队等待的请求数)"""
+        usable = [a for a in self.accounts if a.authenticated and not a.in_cooldown()]
+        return sum(a.inflight for a in usable), len(usable), self.waiting
+    
+    @staticmethod
+    def _unused_name(taken, index):
+        """未命名账号的默认名 account_<index>，与已有名称冲突时顺延"""
+        while f"account_{index}" in taken:
+            index += 1
+        return f"account_{index}"
+    
+    def add_account(self, refresh_token=None, name=None, username=None, password=None, auto_gppt=False, save=True,
+                    timeout=None, weight=1, max_inflight=None, auth_timeout=None, position=None):
         """
         添加账号
         auto_gppt: 是否自动尝试 gppt 登录
         save: 是否保存到 config.yaml
+        timeout: 该账号 HTTP 请求超时（秒），None 时使用 http 配置的超时
+        auth_timeout: 仅用于首次认证的 HTTP 请求超时（秒），认证结束后恢复为 timeout
+        weight: 加权轮询权重
+        max_inflight: 并发请求上限，未指定时使用 load_balance.max_inflight
+        position: 在账号池中的排序位置（配置中的序号），None 时排在最后
         """
-        name = name or f"account_{len(self.accounts)}"
-        account = PixivAccount(name, refresh_token, username, password)
-        if account.auth(auto_gppt=auto_gppt):
-            self.accounts.append(account)
+        if not name:
+            with self.lock:
+                name = self._unused_name({a.name for a in self.accounts}, len(self.accounts))
+        if max_inflight is None:
+            max_inflight = config.load_balance.get("max_inflight", 0)
+        account = PixivAccount(name, refresh_token, username, password, timeout=timeout,
+                               weight=weight, max_inflight=max_inflight)
+        account.shared = self.shared
+        if position is not None:
+            account.position = position
+        if auth_timeout is not None:
+            account.api.set_timeout(auth_timeout)
+        try:
+            authenticated = account.auth(auto_gppt=auto_gppt)
+        finally:
+            account.api.set_timeout(timeout)
+        if authenticated:
+            with self.lock:
+                accounts = list(self.accounts)
+                bisect.insort_right(accounts, account, key=lambda a: a.position)
+                self.accounts = accounts
+            if self.refresher:
+                self.refresher.schedule(account)
             if save:
                 config.add_account(name, account.refresh_token, username)
+                config.flush()
             return True
         return False
     
@@ -197,7 +601,11 @@ class AccountPool:
     
     def remove_account(self, name):
         with self.lock:
+            removed = [a for a in self.accounts if a.name == name]
             self.accounts = [a for a in self.accounts if a.name != name]
+        if self.refresher:
+            for account in removed:
+                self.refresher.unschedule(account)
         config.remove_account(name)
         # 从所有 API Key 的 allowed_accounts 中移除该账号
         from app.key_manager import key_manager
@@ -207,71 +615,125 @@ class AccountPool:
         """获取所有可用账号名称列表"""
         return [a.name for a in self.accounts if a.authenticated]
     
-    def get_account(self, strategy=None):
-        """获取账号（支持多种策略）"""
-        if not self.accounts:
-            return None
-        
-        strategy = strategy or config.lb_strategy
-        
-        if strategy == "least_used":
-            return self._get_least_used()
-        return self._get_round_robin()
+    def get_account(self, strategy=None, exclude=None):
+        """
+        获取账号（支持多种策略）
+        exclude: 本次请求已尝试过、需要跳过的账号
+        """
+        return self._select(self._view(), strategy, exclude)
 
-    def get_account_for_key(self, pool_mode, allowed_accounts, strategy=None):
+    def get_account_for_key(self, pool_mode, allowed_accounts, strategy=None, exclude=None):
         """
         根据 API Key 的池限制获取账号
         pool_mode: "all" 或 "specific"
-        allowed_accounts: 允许的账号名称列表（仅 specific 模式有效）
+        allowed_accounts: 允许的账号名称集合（仅 specific 模式有效）
         strategy: 负载均衡策略
+        exclude: 本次请求已尝试过、需要跳过的账号
         """
-        # 获取可用账号列表
-        if pool_mode == "all":
-            available = [a for a in self.accounts if a.authenticated]
-        else:
-            # specific 模式：仅使用允许的账号
-            available = [a for a in self.accounts if a.authenticated and a.name in allowed_accounts]
-        
-        if not available:
+        return self._select(self._view(pool_mode, allowed_accounts), strategy, exclude)
+
+    def quarantine(self, account, seconds, reason):
+        """
+        让账号冷却一段时间，期间不参与选择
+        token 失效（invalid_grant）时同时安排后台刷新
+        """
+        with account.lock:
+            account.cooldown_until = max(account.cooldown_until, time.time() + seconds)
+            account.cooldown_reason = reason
+        print(f"[Pool] Account [{account.name}] cooling down for {seconds}s ({reason})")
+        if self.shared is not None:
+            self.shared.report_cooldown(account)
+        if reason == "invalid_grant":
+            account.token_expires_at = 0
+            self._schedule_refresh(account)
+
+    def _select(self, view, strategy=None, exclude=None):
+        """
+        按策略从视图中选择：round_robin（加权）| least_used | least_latency
+        优先选择 token 新鲜的账号（过期的交给后台刷新），都过期时才同步刷新；
+        跳过并发已满的账号，全部满载时在有界队列中等待名额释放
+        选中的账号占用一个并发名额，调用方用完后必须 release()
+        """
+        if not view.accounts:
             return None
-        
         strategy = strategy or config.lb_strategy
         
-        if strategy == "least_used":
-            return self._get_least_used_from(available)
-        return self._get_round_robin_from(available)
-
-    def _get_round_robin_from(self, accounts):
-        """从指定账号列表中轮询获取"""
-        with self.lock:
-            account = accounts[self.index % len(accounts)]
-            self.index += 1
-        account.check_and_refresh()
-        account.record_request()
-        return account
+        def eligible(account):
+            return (account.authenticated and not account.in_cooldown()
+                    and not (exclude and account in exclude))
+        
+        def available(account):
+            return eligible(account) and not account.saturated()
+        
+        def fresh(account):
+            if not available(account):
+                return False
+            if account.is_stale():
+                self._schedule_refresh(account)
+                return False
+            return True
+        
+        deadline = queued_at = None
+        while True:
+            releases = self._releases
+            account = self._pick(view, strategy, fresh) or self._pick(view, strategy, available)
+            if account is not None:
+                if account.try_acquire():
+                    if queued_at is not None:
+                        metrics.QUEUE_WAIT.observe(time.perf_counter() - queued_at, "acquired")
+                    return self._checkout(account)
+                continue  # 并发名额被其他请求抢先占用，重新选择
+            
+            # 没有可用账号：若只是都满载则排队等待，否则直接失败
+            if not any(eligible(a) for a in view.accounts):
+                return None
+            lb_cfg = config.load_balance
+            if deadline is None:
+                deadline = time.monotonic() + lb_cfg.get("queue_timeout", 5)
+                queued_at = time.perf_counter()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                metrics.QUEUE_WAIT.observe(time.perf_counter() - queued_at, "timeout")
+                raise PoolBusy("All accounts are busy")
+            with self._capacity:
+                if self.waiting >= lb_cfg.get("queue_size", 100):
+                    metrics.QUEUE_WAIT.observe(time.perf_counter() - queued_at, "rejected")
+                    raise PoolBusy("Request queue is full")
+                if self._releases != releases:
+                    continue  # 检查期间已有名额释放，直接重新选择
+                self.waiting += 1
+                try:
+                    self._capacity.wait(timeout=remaining)
+                finally:
+                    self.waiting -= 1
+    
+    def release(self, account):
+        """归还账号的并发名额，并唤醒一个排队的请求"""
+        account.release()
+        with self._capacity:
+            self._releases += 1
+            self._capacity.notify()
 
-    def _get_least_used_from(self, accounts):
-        """从指定账号列表中获取最少使用的"""
-        with self.lock:
-            account = min(accounts, key=lambda a: a.request_count)
-        account.check_and_refresh()
-        account.record_request()
-        return account
+    @staticmethod
+    def _pick(view, strategy, usable):
+        if strategy == "least_used":
+            return view.least_used(usable)
+        if strategy == "least_latency":
+            # power-of-two-choices：随机取两个账号，选负载评分较低的一个，
+            # 慢或频繁出错的账号/代理会自动分到更少的流量
+            picks = view.sample_two(usable)
+            return min(picks, key=lambda a: a.load_score()) if picks else None
+        return view.round_robin(usable)
     
-    def _get_round_robin(self):
-        with self.lock:
-            account = self.accounts[self.index % len(self.accounts)]
-            self.index += 1
-        # 检查并刷新 token
-        account.check_and_refresh()
-        account.record_request()
-        return account
+    def _schedule_refresh(self, account):
+        """请求路径发现过期账号时，交给后台刷新而不是阻塞当前请求"""
+        if self.refresher:
+            self.refresher.trigger(account)
     
-    def _get_least_used(self):
-        with self.lock:
-            account = min(self.accounts, key=lambda a: a.request_count)
-        # 检查并刷新 token
-        account.check_and_refresh()
+    def _checkout(self, account):
+        """记录一次请求并返回账号；仅在没有新鲜账号可选时同步刷新（single-flight）"""
+        if account.is_stale():
+            account.check_and_refresh()
         account.record_request()
         return account
     
@@ -281,6 +743,14 @@ class AccountPool:
             "authenticated": a.authenticated,
             "request_count": a.request_count,
             "last_request": a.last_request_time,
+            "token_expires_in": max(0, int(a.token_expires_at - time.time())),
+            "latency_ms": round(a.latency_ewma * 1000, 1) if a.latency_ewma is not None else None,
+            "error_rate": round(a.error_rate_ewma, 3),
+            "weight": a.weight,
+            "inflight": a.inflight,
+            "max_inflight": a.max_inflight,
+            "cooldown": max(0, int(a.cooldown_until - time.time())),
+            "cooldown_reason": a.cooldown_reason if a.in_cooldown() else None,
             "has_credentials": bool(a.username)
         } for a in self.accounts]
     
@@ -289,36 +759,38 @@ class AccountPool:
         for acc in self.accounts:
             if acc.name == name:
                 if acc.refresh():
-                    # 刷新成功后更新配置文件
-                    config.add_account(acc.name, acc.refresh_token, acc.username)
+                    # 刷新成功后更新配置文件（多进程时只由租约持有者写入）
+                    if self.shared is None or self.shared.is_owner(acc.name):
+                        config.add_account(acc.name, acc.refresh_token, acc.username)
                     return True
         return False
     
     def refresh_all(self):
-        """刷新所有账号的 token"""
-        success = 0
-        for acc in self.accounts:
-            if acc.refresh():
+        """并行刷新所有账号的 token"""
+        accounts = list(self.accounts)
+        with self._executor("pool-refresh") as executor:
+            results = list(executor.map(lambda acc: acc.refresh(), accounts))
+        refreshed = [acc for acc, ok in zip(accounts, results) if ok]
+        for acc in refreshed:
+            if self.shared is None or self.shared.is_owner(acc.name):
                 config.add_account(acc.name, acc.refresh_token, acc.username)
-                success += 1
-        print(f"[Pool] Refreshed {success}/{len(self.accounts)} accounts")
-        return success
+        print(f"[Pool] Refreshed {len(refreshed)}/{len(accounts)} accounts")
+        return len(refreshed)
     
-    def start_auto_refresh(self, interval=3000):
+    def start_auto_refresh(self):
         """
-        启动自动刷新任务
-        interval: 刷新间隔（秒），默认50分钟
+        启动后台 token 刷新调度器
+        每个账号在自身 token 过期前（提前量 + 随机抖动）单独刷新，
+        请求路径不再等待刷新
         """
-        import threading
-        
-        def refresh_loop():
-            while True:
-                time.sleep(interval)
-                print(f"[Pool] Auto refresh triggered")
-                self.refresh_all()
-        
-        thread = threading.Thread(target=refresh_loop, daemon=True)
-        thread.start()
-        print(f"[Pool] Auto refresh started, interval: {interval}s")
+        if self.refresher is None:
+            refresh_cfg = config.token_refresh
+            self.refresher = TokenRefresher(
+                self,
+                lead_time=refresh_cfg.get("lead_time", 300),
+                jitter=refresh_cfg.get("jitter", 120),
+                retry_interval=refresh_cfg.get("retry_interval", 60),
+            )
+        self.refresher.start()
 
 pool = AccountPool()
@@ -0,0 +1,116 @@
+"""
+分页预取 - 返回一页后在后台获取下一页，客户端随后请求下一页时直接命中
+
+预取结果只保存很短时间并且只使用一次；同时进行的预取数受全局与单个 API Key 的预算限制，
+账号池繁忙（有请求排队或并发过高）时不预取
+"""
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+
+from pixivpy3 import AppPixivAPI
+
+from app.config import config
+from app.pool import pool
+from app import upstream, response_cache
+from app.response_cache import ResponseCache, HIT
+
+# X-Cache 响应头取值：结果来自预取
+PREFETCHED = "PREFETCH"
+
+
+class Prefetcher:
+    """下一页预取器（线程安全）"""
+
+    def __init__(self, max_entries: int = 1000):
+        self._store = ResponseCache(max_entries)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._active = 0
+        self._active_by_owner = {}  # API Key -> 正在进行的预取数
+        self.issued = 0  # 完成并保存的预取数
+        self.used = 0  # 被客户端用到的预取数
+        self.skipped_budget = 0
+        self.skipped_busy = 0
+
+    def take(self, key: str):
+        """取出预取结果（只能使用一次），没有时返回 None"""
+        value, status = self._store.get(key)
+        if status != HIT:
+            return None
+        self._store.purge(key=key)
+        with self._lock:
+            self.used += 1
+        return value
+
+    def _pool_busy(self, prefetch_cfg) -> bool:
+        inflight, usable, waiting = pool.load()
+        return waiting > 0 or inflight >= usable * prefetch_cfg.get("busy_inflight_per_account", 2)
+
+    def schedule(self, method: str, args, kwargs, scope: upstream.AccountScope, owner: str, result):
+        """
+        在返回 result 之后调用：若还有下一页则在后台获取
+        下一页参数取自 next_url 的 offset，其余参数与本页相同，保证与客户端下一次请求的缓存键一致
+        """
+        prefetch_cfg = config.prefetch
+        if not prefetch_cfg.get("enabled", False):
+            return
+        if method not in prefetch_cfg.get("methods", ["search_illust", "user_illusts"]):
+            return
+        next_qs = AppPixivAPI.parse_qs(result.get("next_url")) if isinstance(result, Mapping) else None
+        if not next_qs or "offset" not in next_qs:
+            return
+        next_kwargs = dict(kwargs, offset=int(next_qs["offset"]))
+        key = response_cache.make_key(method, args, next_kwargs, scope)
+
+        if self._pool_busy(prefetch_cfg):
+            with self._lock:
+                self.skipped_busy += 1
+            return
+        with self._lock:
+            if (self._active >= prefetch_cfg.get("max_concurrent", 4)
+                    or self._active_by_owner.get(owner, 0) >= prefetch_cfg.get("max_per_key", 1)):
+                self.skipped_budget += 1
+                return
+            self._active += 1
+            self._active_by_owner[owner] = self._active_by_owner.get(owner, 0) + 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=prefetch_cfg.get("max_concurrent", 4), thread_name_prefix="prefetch")
+
+        def run():
+            try:
+                # 与客户端的同一请求共用 single-flight，客户端提前到达时直接等待预取结果
+                page = response_cache.inflight.do(
+                    key, lambda: upstream.call(method, *args, scope=scope, **next_kwargs)[0])
+                if not upstream.error_message(page):
+                    self._store.set(key, page, prefetch_cfg.get("ttl", 60))
+                    with self._lock:
+                        self.issued += 1
+            except Exception as e:
+                print(f"[Prefetch] {key} failed: {e}")
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    remaining = self._active_by_owner.get(owner, 0) - 1
+                    if remaining > 0:
+                        self._active_by_owner[owner] = remaining
+                    else:
+                        self._active_by_owner.pop(owner, None)
+
+        self._executor.submit(run)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": bool(config.prefetch.get("enabled", False)),
+                "active": self._active,
+                "issued": self.issued,
+                "used": self.used,
+                "skipped_budget": self.skipped_budget,
+                "skipped_busy": self.skipped_busy,
+                "hit_rate": round(self.used / self.issued, 4) if self.issued else 0.0,
+            }
+
+
+prefetcher = Prefetcher()
@@ -0,0 +1,78 @@
+"""
+响应字段投影 - ?fields=id,title,image_urls.medium 只保留指定字段
+
+路径相对于响应中的作品 / 用户对象：
+列表响应（illusts）作用于每个作品，next_url 保留；作品详情作用于 illust；其余响应作用于整个对象
+列表字段中的每个元素按同一子路径投影；不存在的字段忽略
+同一个 fields 字符串只编译一次
+"""
+from collections.abc import Mapping
+from functools import lru_cache
+
+# 单个 fields 参数允许的最大路径数
+MAX_PATHS = 64
+
+
+class InvalidFields(ValueError):
+    """fields 参数格式错误"""
+
+
+class Projection:
+    """编译后的投影：字段名 -> 子投影（None 表示保留整个字段）"""
+
+    __slots__ = ("tree",)
+
+    def __init__(self, tree: dict):
+        self.tree = tree
+
+    def apply(self, obj):
+        return _apply(self.tree, obj)
+
+    def apply_response(self, result):
+        """按响应类型确定投影对象，其余顶层字段（next_url 等）原样保留"""
+        if not isinstance(result, Mapping):
+            return result
+        if "illusts" in result:
+            projected = dict(result)
+            projected["illusts"] = [self.apply(illust) for illust in result.get("illusts") or []]
+            return projected
+        if "illust" in result:
+            projected = dict(result)
+            projected["illust"] = self.apply(result["illust"])
+            return projected
+        return self.apply(result)
+
+
+def _apply(tree, obj):
+    if tree is None:
+        return obj
+    if isinstance(obj, list):
+        return [_apply(tree, item) for item in obj]
+    if not isinstance(obj, Mapping):
+        return obj
+    return {name: _apply(sub, obj[name]) for name, sub in tree.items() if name in obj}
+
+
+@lru_cache(maxsize=256)
+def compile_fields(spec: str) -> Projection:
+    """把逗号分隔的点路径编译为 Projection，格式错误时抛出 InvalidFields"""
+    paths = [p.strip() for p in spec.split(",") if p.strip()]
+    if not paths:
+        raise InvalidFields("fields is empty")
+    if len(paths) > MAX_PATHS:
+        raise InvalidFields(f"Too many fields (max {MAX_PATHS})")
+    tree = {}
+    for path in paths:
+        names = path.split(".")
+        if not all(names):
+            raise InvalidFields(f"Invalid field path: {path}")
+        node = tree
+        for i, name in enumerate(names):
+            last = i == len(names) - 1
+            if name in node and node[name] is None:
+                break  # 已保留整个字段，更深的路径无意义
+            if last:
+                node[name] = None
+            else:
+                node = node.setdefault(name, {})
+    return Projection(tree)
@@ -0,0 +1,104 @@
+"""
+Token 后台刷新调度器
+按每个账号的 token 过期时间提前刷新，并加入随机抖动，避免所有账号在同一时刻刷新
+"""
+import heapq
+import itertools
+import random
+import threading
+import time
+
+
+class TokenRefresher:
+    """基于最小堆的刷新调度器，单线程按到期时间依次刷新账号"""
+
+    def __init__(self, pool, lead_time=300, jitter=120, retry_interval=60):
+        """
+        pool: AccountPool 实例
+        lead_time: 在 token 过期前多少秒开始刷新
+        jitter: 每个账号额外随机提前的最大秒数
+        retry_interval: 刷新失败后的重试间隔（秒）
+        """
+        self.pool = pool
+        self.lead_time = lead_time
+        self.jitter = jitter
+        self.retry_interval = retry_interval
+        self._heap = []
+        self._seq = itertools.count()
+        self._due = {}  # account -> 当前有效的计划时间，堆中其余条目视为过期
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _next_due(self, account):
+        """计算账号下一次刷新时间：过期时间 - 提前量 - 随机抖动"""
+        due = account.token_expires_at - self.lead_time - random.uniform(0, self.jitter)
+        return max(due, time.time())
+
+    def _push_locked(self, account, due):
+        """记录计划时间并入堆；计划未变时不重复入堆，过期条目过多时重建堆"""
+        if self._due.get(account) == due:
+            return
+        self._due[account] = due
+        heapq.heappush(self._heap, (due, next(self._seq), account))
+        if len(self._heap) > 2 * len(self._due) + 16:
+            self._heap = [entry for entry in self._heap if self._due.get(entry[2]) == entry[0]]
+            heapq.heapify(self._heap)
+        self._cond.notify()
+
+    def schedule(self, account, due=None):
+        """安排账号的下一次刷新（重复调用以最新的时间为准）"""
+        due = self._next_due(account) if due is None else due
+        with self._cond:
+            self._push_locked(account, due)
+
+    def trigger(self, account):
+        """尽快在后台刷新账号（请求路径发现 token 过期时调用，不阻塞请求；已到期待刷新时不重复入堆）"""
+        with self._cond:
+            now = time.time()
+            if self._due.get(account, float("inf")) <= now:
+                return
+            self._push_locked(account, now)
+
+    def unschedule(self, account):
+        """取消账号的刷新计划（账号被移除时调用）"""
+        with self._cond:
+            self._due.pop(account, None)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        for account in list(self.pool.accounts):
+            self.schedule(account)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        print(f"[Refresher] Started, lead time: {self.lead_time}s, jitter: {self.jitter}s")
+
+    def _pop_due(self):
+        """阻塞直到有账号到期，返回该账号"""
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, account = self._heap[0]
+                if self._due.get(account) != due:
+                    heapq.heappop(self._heap)  # 已被重新安排或取消
+                    continue
+                delay = due - time.time()
+                if delay > 0:
+                    self._cond.wait(timeout=delay)
+                    continue
+                heapq.heappop(self._heap)
+                del self._due[account]
+                return account
+
+    def _run(self):
+        while True:
+            account = self._pop_due()
+            if account not in self.pool.accounts:
+                continue
+            if self.pool.refresh_account(account.name):
+                self.schedule(account)
+            else:
+                print(f"[Refresher] Account [{account.name}] refresh failed, retry in {self.retry_interval}s")
+                self.schedule(account, due=time.time() + self.retry_interval)
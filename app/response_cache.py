@@ -0,0 +1,178 @@
+"""
+上游 JSON 响应缓存 - 按方法配置 TTL 的有界 LRU
+
+过期后的 stale_while_revalidate 秒内仍返回旧结果，同时在后台刷新；
+作品 / 用户不存在的错误结果按 negative_ttl 短暂缓存
+无论是否缓存，相同 (方法, 参数, 账号范围) 的并发上游调用都只执行一次（single-flight）
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from app.config import config
+from app import upstream
+from app.singleflight import SingleFlight
+
+# X-Cache 响应头取值
+HIT = "HIT"
+MISS = "MISS"
+STALE = "STALE"
+
+# 表示作品 / 用户不存在的错误信息片段（pixivpy3 返回的错误 JSON，英文或日文）
+NOT_FOUND_MARKERS = ("not found", "does not exist", "has been deleted", "存在しない", "削除")
+
+
+def is_not_found(result) -> bool:
+    text = upstream.error_message(result).lower()
+    return bool(text) and any(marker in text for marker in NOT_FOUND_MARKERS)
+
+
+def make_key(method: str, args=(), kwargs=None, scope: upstream.AccountScope = upstream.AccountScope()) -> str:
+    """
+    缓存键：method:位置参数&排序后的关键字参数，例如 illust_detail:123、illust_ranking:mode=day&offset=0
+    Key 限定了账号（specific）时追加 @账号列表，避免不同账号视角的结果（收藏状态等）互相串用
+    """
+    parts = [str(a) for a in args]
+    parts.extend(f"{k}={v}" for k, v in sorted((kwargs or {}).items()))
+    key = f"{method}:{'&'.join(parts)}"
+    if scope.pool_mode == "specific":
+        key += "@" + ",".join(sorted(scope.allowed_accounts))
+    return key
+
+
+class _Entry(NamedTuple):
+    value: object
+    expires_at: float
+    stale_until: float
+
+
+class ResponseCache:
+    """线程安全的 TTL + LRU 缓存"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> _Entry，按最近使用排序
+        self._refreshing = set()  # 正在后台刷新的 key
+        self._executor = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        """返回 (value, 状态)；没有可用结果时返回 (None, MISS)"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now >= entry.stale_until:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None, MISS
+            self._entries.move_to_end(key)
+            if now < entry.expires_at:
+                self.hits += 1
+                return entry.value, HIT
+            self.stale_hits += 1
+            return entry.value, STALE
+
+    def set(self, key: str, value, ttl: float, stale_ttl: float = 0):
+        if ttl <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            self._entries[key] = _Entry(value, now + ttl, now + ttl + stale_ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def purge(self, key: str = None, prefix: str = None) -> int:
+        """删除指定 key，或所有以 prefix 开头的 key，返回删除数量"""
+        with self._lock:
+            if key is not None:
+                return 1 if self._entries.pop(key, None) is not None else 0
+            if prefix is None:
+                return 0
+            keys = [k for k in self._entries if k.startswith(prefix)]
+            for k in keys:
+                del self._entries[k]
+            return len(keys)
+
+    def revalidate(self, key: str, loader):
+        """在后台调用 loader() 刷新 key（同一 key 同时只刷新一次）"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="revalidate")
+
+        def run():
+            try:
+                loader()
+            except Exception as e:
+                print(f"[ResponseCache] Revalidate {key} failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(run)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+response_cache = ResponseCache(config.response_cache.get("max_entries", 10000))
+inflight = SingleFlight()
+
+
+def ttl_for(method: str) -> float:
+    """方法的缓存时间（秒），未配置或缓存关闭时为 0"""
+    cache_cfg = config.response_cache
+    if not cache_cfg.get("enabled", True):
+        return 0
+    return (cache_cfg.get("ttl", {}) or {}).get(method, 0)
+
+
+def call(method: str, *args, scope: upstream.AccountScope = upstream.AccountScope(), **kwargs):
+    """
+    带缓存的 upstream.call，返回 (result, X-Cache 状态)
+    未配置 TTL 的方法不缓存（状态为 None），但同样合并并发的相同调用；
+    合并的调用共享同一个结果对象，调用方不应修改它
+    """
+    ttl = ttl_for(method)
+    key = make_key(method, args, kwargs, scope)
+    if not ttl:
+        return inflight.do(key, lambda: upstream.call(method, *args, scope=scope, **kwargs)[0]), None
+
+    cache_cfg = config.response_cache
+
+    def fetch():
+        result, _ = upstream.call(method, *args, scope=scope, **kwargs)
+        if not upstream.error_message(result):
+            response_cache.set(key, result, ttl, cache_cfg.get("stale_while_revalidate", 300))
+        elif is_not_found(result):
+            response_cache.set(key, result, cache_cfg.get("negative_ttl", 60))
+        return result
+
+    def load():
+        return inflight.do(key, fetch)
+
+    value, status = response_cache.get(key)
+    if status == HIT:
+        return value, HIT
+    if status == STALE:
+        response_cache.revalidate(key, load)
+        return value, STALE
+    return load(), MISS
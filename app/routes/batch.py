@@ -0,0 +1,83 @@
+"""
+批量接口 - 一次请求获取多个作品 / 用户详情，在账号池上并发执行
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import request, jsonify, g
+
+from app.routes import api_bp
+from app.routes.common import current_scope, error_body, json_response
+from app.auth import require_api_key
+from app.config import config
+from app.key_manager import key_manager
+from app import upstream, response_cache
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """所有批量请求共享的线程池，batch.max_workers 限制同时进行的上游调用数"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = config.batch.get("max_workers", 8)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+    return _executor
+
+
+def _fetch_item(method, item_id, scope):
+    """获取单个条目，错误只影响该条目"""
+    try:
+        result, _ = response_cache.call(method, item_id, scope=scope)
+    except Exception as e:
+        body, status = error_body(e)
+        return {"id": item_id, "status": status, **body}
+    message = upstream.error_message(result)
+    if message:
+        status = 404 if response_cache.is_not_found(result) else 502
+        return {"id": item_id, "status": status, "error": message}
+    return {"id": item_id, "status": 200, "data": result}
+
+
+def _run_batch(method, item_endpoint):
+    """
+    解析 {"ids": [...]}，按顺序返回每个 ID 的结果
+    item_endpoint 为单条接口的路由规则，Key 对它的访问规则同样适用于批量接口
+    """
+    allowed, error = key_manager.check_access(g.api_key_value, item_endpoint)
+    if not allowed:
+        return jsonify({"error": error}), 403
+
+    data = request.get_json(silent=True) or {}
+    ids = data.get("ids")
+    if not isinstance(ids, list) or not ids:
+        return jsonify({"error": "ids must be a non-empty list"}), 400
+    max_items = config.batch.get("max_items", 100)
+    if len(ids) > max_items:
+        return jsonify({"error": f"Too many ids (max {max_items})"}), 400
+    # 只接受 JSON 整数；bool 是 int 的子类，浮点和数字字符串也不做转换
+    if not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        return jsonify({"error": "ids must be integers"}), 400
+
+    # 请求上下文不会传入工作线程，账号范围在这里确定后显式传递
+    scope = current_scope()
+    executor = _get_executor()
+    futures = [executor.submit(_fetch_item, method, item_id, scope) for item_id in ids]
+    return json_response({"results": [f.result() for f in futures]})
+
+
+@api_bp.route("/illusts/batch", methods=["POST"])
+@require_api_key
+def batch_illusts():
+    """批量获取插画详情"""
+    return _run_batch("illust_detail", "/api/illust/<int:illust_id>")
+
+
+@api_bp.route("/users/batch", methods=["POST"])
+@require_api_key
+def batch_users():
+    """批量获取用户详情"""
+    return _run_batch("user_detail", "/api/user/<int:user_id>")
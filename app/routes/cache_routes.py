@@ -0,0 +1,36 @@
+from flask import request, jsonify
+from app.routes import api_bp
+from app.auth import require_auth
+from app.image_cache import get_image_cache
+from app.response_cache import response_cache, inflight
+from app.prefetch import prefetcher
+
+
+@api_bp.route("/cache/stats", methods=["GET"])
+@require_auth
+def cache_stats():
+    """查看缓存命中统计"""
+    cache = get_image_cache()
+    image = None
+    if cache is not None:
+        image = {
+            "memory": cache.hot_tier.stats() if cache.hot_tier is not None else None,
+            "disk": cache.stats(),
+        }
+    return jsonify({
+        "image": image,
+        "response": response_cache.stats(),
+        "singleflight": inflight.stats(),
+        "prefetch": prefetcher.stats(),
+    })
+
+
+@api_bp.route("/cache/purge", methods=["POST"])
+@require_auth
+def cache_purge():
+    """按 key 或前缀清除响应缓存，如 {"key": "illust_detail:123"} 或 {"prefix": "illust_ranking:"}"""
+    data = request.get_json(silent=True) or {}
+    key, prefix = data.get("key"), data.get("prefix")
+    if not key and not prefix:
+        return jsonify({"error": "key or prefix required"}), 400
+    return jsonify({"purged": response_cache.purge(key=key, prefix=prefix)})
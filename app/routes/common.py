@@ -0,0 +1,178 @@
+"""
+路由公共工具 - 解析当前 API Key 的账号范围，统一调用上游并构造响应
+"""
+import gzip
+
+from flask import request, jsonify, g, Response
+from pixivpy3 import AppPixivAPI
+
+from app import upstream, response_cache, json_codec, timing
+from app.config import config
+from app.key_manager import key_manager
+from app.pool import PoolBusy
+from app.projection import compile_fields, InvalidFields
+from app.prefetch import prefetcher, PREFETCHED
+
+
+def current_scope():
+    """根据当前请求的 API Key 池限制和 ?lb= 参数构造账号范围"""
+    return scope_for_key(getattr(g, "api_key_value", None), request.args.get("lb"))
+
+
+def scope_for_key(key_value, strategy=None):
+    """API Key 对应的账号范围"""
+    if key_value:
+        pool_mode, allowed_accounts = key_manager.get_pool_scope(key_value)
+        if pool_mode:
+            return upstream.AccountScope(pool_mode, allowed_accounts, strategy)
+    # 没有 API Key 上下文或 Key 不存在，使用默认行为
+    return upstream.AccountScope(strategy=strategy)
+
+
+def call_api(method, *args, **kwargs):
+    """
+    调用 AppPixivAPI 方法并返回 JSON 响应（限流 / 失效账号自动换账号重试）
+    response_cache.ttl 中配置了的方法经缓存返回，并带 X-Cache 头
+    """
+    try:
+        projection = requested_projection()
+    except InvalidFields as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        result, cache_status = response_cache.call(method, *args, scope=current_scope(), **kwargs)
+    except Exception as e:
+        body, status = error_body(e)
+        return jsonify(body), status
+    return _json_response(result, cache_status, projection)
+
+
+def requested_projection():
+    """解析 ?fields= 参数，没有时返回 None"""
+    spec = request.args.get("fields", "").strip()
+    return compile_fields(spec) if spec else None
+
+
+def _json_response(result, cache_status, projection=None):
+    # 投影会解析上游结果，错误响应不投影
+    if projection is not None and not upstream.error_message(result):
+        result = projection.apply_response(result)
+    response = json_response(result)
+    if cache_status:
+        response.headers["X-Cache"] = cache_status
+    return response
+
+
+def json_response(obj, status=200):
+    """
+    用 json_codec 序列化响应（未解析的上游结果直接发送原始字节）
+    json_response.compress 开启且客户端接受 gzip 时压缩较大的响应体
+    """
+    body, encoding = encode_json(obj, request.headers.get("Accept-Encoding", ""))
+    response = Response(body, status=status, mimetype="application/json")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+def encode_json(obj, accept_encoding=""):
+    """序列化并按配置压缩，返回 (响应体, Content-Encoding 或 None)"""
+    with timing.phase("serialize"):
+        body = json_codec.dumps(obj)
+        response_cfg = config.json_response
+        if (response_cfg.get("compress", False)
+                and len(body) >= response_cfg.get("compress_min_bytes", 1024)
+                and "gzip" in accept_encoding):
+            return gzip.compress(body, compresslevel=response_cfg.get("compress_level", 5)), "gzip"
+        return body, None
+
+
+def call_page(method, *args, **kwargs):
+    """
+    获取一页结果，优先使用预取的结果；返回后按 prefetch 配置在后台预取下一页
+    """
+    try:
+        projection = requested_projection()
+    except InvalidFields as e:
+        return jsonify({"error": str(e)}), 400
+    scope = current_scope()
+    try:
+        result = prefetcher.take(response_cache.make_key(method, args, kwargs, scope))
+        cache_status = PREFETCHED
+        if result is None:
+            result, cache_status = response_cache.call(method, *args, scope=scope, **kwargs)
+    except Exception as e:
+        body, status = error_body(e)
+        return jsonify(body), status
+    prefetcher.schedule(method, args, kwargs, scope, getattr(g, "api_key_value", "") or "", result)
+    return _json_response(result, cache_status, projection)
+
+
+def error_body(e):
+    """把上游调用抛出的异常转换为 (错误 JSON, 状态码)"""
+    if isinstance(e, upstream.NoAvailableAccount):
+        return {"error": "No available account"}, 503
+    if isinstance(e, PoolBusy):
+        return {"error": str(e)}, 503
+    if isinstance(e, upstream.UpstreamFailed):
+        return {"error": str(e), "reason": e.kind}, e.status_code
+    return {"error": str(e)}, 500
+
+
+def paginate_api(method, *args, **kwargs):
+    """
+    分页接口：带 ?pages=N 或 ?all=true 时在服务端跟随 next_url 翻页，
+    把每个作品作为一行 JSON（NDJSON）流式返回；否则同 call_page 只返回一页
+    每页取到即输出、输出后即丢弃，总条数受 pagination.max_items 限制
+    ?fields= 的投影作用于每个作品
+    """
+    pages = request.args.get("pages", type=int)
+    fetch_all = request.args.get("all", "").lower() in ("1", "true", "yes")
+    if not pages and not fetch_all:
+        return call_page(method, *args, **kwargs)
+
+    pagination_cfg = config.pagination
+    max_items = pagination_cfg.get("max_items", 3000)
+    max_pages = pagination_cfg.get("max_pages", 100)
+    pages = min(pages, max_pages) if pages and not fetch_all else max_pages
+    try:
+        projection = requested_projection()
+    except InvalidFields as e:
+        return jsonify({"error": str(e)}), 400
+
+    # 生成器在视图返回后执行，账号范围在这里确定
+    scope = current_scope()
+    # 先同步获取第一页，出错时仍能返回正常的错误状态码
+    try:
+        first, _ = response_cache.call(method, *args, scope=scope, **kwargs)
+    except Exception as e:
+        body, status = error_body(e)
+        return jsonify(body), status
+    message = upstream.error_message(first)
+    if message:
+        return json_response(first, 404 if response_cache.is_not_found(first) else 502)
+
+    def generate():
+        result, page, emitted = first, 1, 0
+        while True:
+            for illust in result.get("illusts") or []:
+                if projection is not None:
+                    illust = projection.apply(illust)
+                yield json_codec.dumps(illust) + b"\n"
+                emitted += 1
+                if emitted >= max_items:
+                    return
+            next_qs = AppPixivAPI.parse_qs(result.get("next_url"))
+            if not next_qs or page >= pages:
+                return
+            try:
+                result, _ = response_cache.call(method, scope=scope, **next_qs)
+            except Exception as e:
+                yield json_codec.dumps(error_body(e)[0]) + b"\n"
+                return
+            if upstream.error_message(result):
+                yield json_codec.dumps({"error": upstream.error_message(result)}) + b"\n"
+                return
+            page += 1
+
+    return Response(generate(), mimetype="application/x-ndjson")
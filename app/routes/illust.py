@@ -1,124 +1,148 @@
-from flask import request, jsonify, send_file, g
+from flask import request, jsonify, Response, send_file
 from app.routes import api_bp
+from app.routes.common import call_api, paginate_api, current_scope
+from app import upstream
+from app.config import config
+from app.image_cache import get_image_cache, normalize_url, FetchError
+from app.pool import PoolBusy
 from app.auth import require_api_key
-from app.pool import pool
-from app.key_manager import key_manager
-import tempfile
+from urllib.parse import urlsplit
 import os
 
-def get_api():
-    """根据 API Key 的池限制获取账号"""
-    strategy = request.args.get("lb")
-    
-    # 获取当前请求的 API Key 值
-    key_value = getattr(g, 'api_key_value', None)
-    
-    if key_value:
-        # 获取该 Key 的池限制配置
-        pool_mode, allowed_accounts = key_manager.get_allowed_accounts(key_value)
-        if pool_mode:
-            account = pool.get_account_for_key(pool_mode, allowed_accounts, strategy)
-        else:
-            # Key 不存在，使用默认行为
-            account = pool.get_account(strategy)
-    else:
-        # 没有 API Key 上下文，使用默认行为
-        account = pool.get_account(strategy)
-    
-    if not account:
-        return None, None
-    return account.api, account.name
+# 下载时转发给 i.pximg.net 的请求头，以及原样返回给客户端的响应头
+FORWARDED_REQUEST_HEADERS = ("Range", "If-Range")
+FORWARDED_RESPONSE_HEADERS = (
+    "Content-Type", "Content-Length", "Content-Range", "Content-Encoding",
+    "Accept-Ranges", "Last-Modified",
+)
 
 @api_bp.route("/illust/<int:illust_id>", methods=["GET"])
 @require_api_key
 def get_illust(illust_id):
     """获取插画详情"""
-    api, name = get_api()
-    if not api:
-        return jsonify({"error": "No available account"}), 503
-    try:
-        result = api.illust_detail(illust_id)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return call_api("illust_detail", illust_id)
 
 @api_bp.route("/search", methods=["GET"])
 @require_api_key
 def search_illust():
     """搜索插画"""
-    api, name = get_api()
-    if not api:
-        return jsonify({"error": "No available account"}), 503
     word = request.args.get("word", "")
     offset = request.args.get("offset", 0, type=int)
-    try:
-        result = api.search_illust(word, offset=offset)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return paginate_api("search_illust", word, offset=offset)
 
 
 @api_bp.route("/ranking", methods=["GET"])
 @require_api_key
 def get_ranking():
     """获取排行榜"""
-    api, name = get_api()
-    if not api:
-        return jsonify({"error": "No available account"}), 503
     mode = request.args.get("mode", "day")
     offset = request.args.get("offset", 0, type=int)
-    try:
-        result = api.illust_ranking(mode=mode, offset=offset)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return paginate_api("illust_ranking", mode=mode, offset=offset)
 
 @api_bp.route("/recommended", methods=["GET"])
 @require_api_key
 def get_recommended():
     """获取推荐插画"""
-    api, name = get_api()
-    if not api:
-        return jsonify({"error": "No available account"}), 503
     offset = request.args.get("offset", 0, type=int)
-    try:
-        result = api.illust_recommended(offset=offset)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return paginate_api("illust_recommended", offset=offset)
 
 @api_bp.route("/download", methods=["GET"])
 @require_api_key
 def download_image():
-    """下载图片"""
-    api, _ = get_api()
-    if not api:
-        return jsonify({"error": "No available account"}), 503
+    """
+    下载图片：pximg 图片经磁盘缓存返回（带 ETag，支持 If-None-Match / Range），
+    其余 URL 或缓存关闭时把上游响应分块流式转发，不落盘、不整体读入内存
+    """
     url = request.args.get("url", "")
     if not url:
         return jsonify({"error": "url required"}), 400
+    scope = current_scope()
     try:
-        # 创建临时目录，不使用 with 语句以避免文件锁定问题
-        tmpdir = tempfile.mkdtemp()
-        api.download(url, path=tmpdir)
-        filename = os.path.basename(url)
-        filepath = os.path.join(tmpdir, filename)
-        
-        # 读取文件内容到内存，然后删除临时文件
-        with open(filepath, 'rb') as f:
-            file_data = f.read()
-        
-        # 清理临时文件
-        import shutil
-        shutil.rmtree(tmpdir, ignore_errors=True)
-        
-        # 从内存返回文件
-        from io import BytesIO
-        return send_file(
-            BytesIO(file_data),
-            mimetype="image/jpeg",
-            as_attachment=False,
-            download_name=filename
-        )
+        cache = get_image_cache()
+        normalized = normalize_url(url) if cache is not None else None
+        if normalized is None:
+            return _stream_download(url, scope)
+        entry = cache.fetch(normalized, lambda f: _download_to(f, normalized, scope))
+        try:
+            return _send_cached(entry, url)
+        except FileNotFoundError:
+            # 条目刚好被淘汰，直接转发上游
+            return _stream_download(url, scope)
+    except FetchError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except (upstream.NoAvailableAccount, PoolBusy) as e:
+        return jsonify({"error": str(e)}), 503
+    except upstream.UpstreamFailed as e:
+        return jsonify({"error": str(e), "reason": e.kind}), e.status_code
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+
+def _download_filename(url):
+    return os.path.basename(urlsplit(url).path)
+
+
+def _download_to(fileobj, url, scope):
+    """把完整图片写入 fileobj（缓存未命中时调用），返回 Content-Type"""
+    response = upstream.open_download(url, scope=scope)
+    try:
+        if response.status_code != 200:
+            raise FetchError(response.status_code, f"Upstream returned HTTP {response.status_code}")
+        for chunk in response.raw.stream(upstream.CHUNK_SIZE, decode_content=True):
+            fileobj.write(chunk)
+        return response.headers.get("Content-Type")
+    finally:
+        response.close()
+
+
+def _send_cached(entry, url):
+    """从内存或缓存文件返回，处理 ETag 条件请求（304）与 Range（206）"""
+    max_age = config.image_cache.get("cache_control_max_age", 31536000)
+    if entry.data is not None:
+        out = Response(entry.data, mimetype=entry.content_type)
+        out.headers["Content-Disposition"] = f'inline; filename="{_download_filename(url)}"'
+        out.set_etag(entry.etag)
+        out.cache_control.public = True
+        out.cache_control.max_age = max_age
+        out.make_conditional(request, accept_ranges=True, complete_length=entry.size)
+    else:
+        out = send_file(
+            entry.path,
+            mimetype=entry.content_type,
+            as_attachment=False,
+            download_name=_download_filename(url),
+            conditional=True,
+            etag=entry.etag,
+            max_age=max_age,
+        )
+    # pximg 图片 URL 带时间戳，内容不会变化
+    out.cache_control.immutable = True
+    return out
+
+
+def _stream_download(url, scope):
+    """透传 Content-Type / Content-Length，支持 Range / If-Range 断点续传"""
+    headers = {name: request.headers[name] for name in FORWARDED_REQUEST_HEADERS if name in request.headers}
+    response = upstream.open_download(url, headers=headers, scope=scope)
+
+    status = response.status_code
+    if status >= 400 and status != 416:
+        response.close()
+        return jsonify({"error": f"Upstream returned HTTP {status}"}), status
+
+    def generate():
+        try:
+            # 不解压，保证与透传的 Content-Length / Content-Encoding 一致
+            for chunk in response.raw.stream(upstream.CHUNK_SIZE, decode_content=False):
+                yield chunk
+        finally:
+            # 客户端断开时 WSGI 服务器会关闭生成器，同样释放连接
+            response.close()
+
+    out = Response(generate(), status=status, direct_passthrough=True)
+    for name in FORWARDED_RESPONSE_HEADERS:
+        if name in response.headers:
+            out.headers[name] = response.headers[name]
+    out.headers.setdefault("Content-Type", "application/octet-stream")
+    out.headers["Content-Disposition"] = f'inline; filename="{_download_filename(url)}"'
+    return out
@@ -0,0 +1,197 @@
+"""
+共享状态 - 多个 worker 进程（如 gunicorn -w N）或多台主机上的实例共享账号池与 API Key
+
+存储后端见 app.state_store（同一主机用 SQLite，多台主机用 Redis 等 RESP 服务），保存：
+- 各账号的 token：只由持有刷新租约的 worker 认证 / 刷新并发布，其余 worker 直接使用发布的 token；
+  refresh_owner 为 account 时每个账号单独租约，为 leader 时由选出的一个 leader 负责所有账号
+- 租约由持有者在每次同步时续期，持有者退出后过期，由其他 worker 接手
+- 请求计数在本地累加，同步时合并到共享计数；冷却与 token 失效立即写入
+- 轮询游标按块（cursor_block 个位置）从存储原子领取，块内在本地递增：各 worker 共同推进同一个加权序列，
+  每 cursor_block 次选择才访问一次存储
+- API Key 列表：任一实例修改后写入存储，其他实例同步后更新并写入各自的 config.yaml
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+
+from app.config import config
+from app.state_store import create_store
+
+# refresh_owner 为 leader 时使用的租约名
+LEADER_LEASE = "__leader__"
+
+class SharedState:
+    """把账号池接入共享状态存储：token 租约、计数与冷却同步、共享轮询游标"""
+
+    def __init__(self, store, pool, worker_id=None, sync_interval=1.0, lease_ttl=60, token_wait=10,
+                 refresh_owner="account", key_manager=None, cursor_block=64):
+        """
+        store: 共享状态存储（StateStore）
+        pool: AccountPool 实例
+        sync_interval: 与存储同步的间隔（秒）
+        lease_ttl: 刷新租约的有效期（秒），持有者每次同步时续期
+        token_wait: 非租约持有者等待持有者发布 token 的最长时间（秒）
+        refresh_owner: account（每个账号单独租约）| leader（由一个 leader 刷新所有账号）
+        key_manager: 需要同步 API Key 时传入 KeyManager 实例
+        cursor_block: 每次从存储领取的轮询游标位置数（1 表示每次选择都访问存储）
+        """
+        self.store = store
+        self.pool = pool
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.sync_interval = sync_interval
+        self.lease_ttl = lease_ttl
+        self.token_wait = token_wait
+        self.leader_mode = refresh_owner == "leader"
+        self.key_manager = key_manager
+        self._owned = set()  # 本 worker 持有的租约
+        self.cursor_block = max(1, int(cursor_block))
+        self._cursors = {}  # 游标名 -> [下一个位置, 本块结束位置]
+        self._cursor_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, pool, key_manager=None):
+        state_cfg = config.shared_state
+        return cls(
+            create_store(state_cfg),
+            pool,
+            sync_interval=state_cfg.get("sync_interval", 1),
+            lease_ttl=state_cfg.get("lease_ttl", 60),
+            token_wait=state_cfg.get("token_wait", 10),
+            refresh_owner=state_cfg.get("refresh_owner", "account"),
+            key_manager=key_manager,
+            cursor_block=state_cfg.get("cursor_block", 64),
+        )
+
+    def _lease_name(self, name: str) -> str:
+        return LEADER_LEASE if self.leader_mode else name
+
+    def owns(self, name: str) -> bool:
+        """获取（或续期）账号的刷新租约（leader 模式下为 leader 租约）"""
+        lease = self._lease_name(name)
+        if self.store.acquire_lease(lease, self.worker_id, self.lease_ttl):
+            if lease == LEADER_LEASE and lease not in self._owned:
+                print(f"[SharedState] Worker {self.worker_id} elected as refresh leader")
+            self._owned.add(lease)
+            return True
+        self._owned.discard(lease)
+        return False
+
+    def is_owner(self, name: str) -> bool:
+        return self._lease_name(name) in self._owned
+
+    @property
+    def is_leader(self) -> bool:
+        return LEADER_LEASE in self._owned
+
+    def _apply(self, account, row) -> bool:
+        """共享 token 比本地新时采用，返回是否采用"""
+        if not row or not row.get("access_token") or row["token_version"] <= account.token_version:
+            return False
+        account.api.access_token = row["access_token"]
+        account.api.refresh_token = row["refresh_token"]
+        account.api.user_id = row["user_id"]
+        account.refresh_token = row["refresh_token"] or account.refresh_token
+        account.token_expires_at = row["token_expires_at"]
+        account.token_version = row["token_version"]
+        account.last_refresh_time = time.time()
+        account.authenticated = True
+        return True
+
+    def adopt(self, account) -> bool:
+        return self._apply(account, self.store.get_account(account.name))
+
+    def authenticate(self, account, authenticate) -> bool:
+        """
+        认证 / 刷新账号：已有新鲜的共享 token 时直接采用；
+        持有租约时调用 authenticate() 访问 Pixiv 并发布结果，否则等待持有者发布
+        """
+        self.adopt(account)
+        deadline = time.monotonic() + self.token_wait
+        while True:
+            if account.authenticated and not account.is_stale():
+                return True
+            if self.owns(account.name):
+                if not authenticate():
+                    return False
+                account.token_version = self.store.publish_token(
+                    account.name, account.api.access_token, account.refresh_token,
+                    account.api.user_id, account.token_expires_at)
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(min(0.2, self.sync_interval))
+            self.adopt(account)
+
+    def report_cooldown(self, account):
+        """冷却立即写入共享状态；token 失效时同时使共享 token 失效，由租约持有者刷新"""
+        self.store.set_cooldown(account.name, account.cooldown_until, account.cooldown_reason)
+        if account.cooldown_reason == "invalid_grant" and account.api.access_token:
+            self.store.invalidate_token(account.name, account.api.access_token)
+
+    def next_index(self, key: str) -> int:
+        """共享的轮询游标：本地块用完时从存储领取下一块"""
+        with self._cursor_lock:
+            cursor = self._cursors.get(key)
+            if cursor is None or cursor[0] >= cursor[1]:
+                start = self.store.incr(f"rr:{key}", self.cursor_block)
+                cursor = self._cursors[key] = [start, start + self.cursor_block]
+            position = cursor[0]
+            cursor[0] += 1
+            return position
+
+    def sync(self):
+        """推送本地请求计数，拉取 token / 冷却 / 总计数与 API Key，并续期持有的租约"""
+        if self.leader_mode:
+            self.owns(LEADER_LEASE)  # 参与 / 保持 leader 选举
+        rows = self.store.get_accounts()
+        for account in list(self.pool.accounts):
+            row = rows.get(account.name)
+            with account.lock:
+                delta, account.unsynced_requests = account.unsynced_requests, 0
+                last_request_time = account.last_request_time
+            if delta:
+                total = self.store.add_requests(account.name, delta, last_request_time)
+            else:
+                total = row["request_count"] if row else None
+            if total is not None:
+                with account.lock:
+                    account.request_count = total + account.unsynced_requests
+
+            if not row:
+                continue
+            with account.lock:
+                if row["cooldown_until"] > account.cooldown_until:
+                    account.cooldown_until = row["cooldown_until"]
+                    account.cooldown_reason = row["cooldown_reason"]
+            # 其他 worker 标记 token 失效后，由租约持有者（或无人持有时由本 worker 接手）立即刷新
+            if self._apply(account, row) and account.is_stale() and self.owns(account.name):
+                self.pool._schedule_refresh(account)
+        if self._owned:
+            self.store.renew_leases(self.worker_id, self.lease_ttl)
+        if self.key_manager is not None:
+            self.key_manager.sync_from_store()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        mode = "leader" if self.leader_mode else "per-account"
+        print(f"[SharedState] Worker {self.worker_id} syncing every {self.sync_interval}s via {self.store.path} "
+              f"({mode} refresh)")
+
+    def stop(self):
+        self._stop.set()
+        self.store.release_leases(self.worker_id)
+        self._owned.clear()
+
+    def _run(self):
+        while not self._stop.wait(self.sync_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"[SharedState] Sync failed: {e}")
@@ -0,0 +1,610 @@
+"""
+共享状态存储 - SharedState 使用的可插拔后端
+
+StateStore 定义账号状态（token、冷却、请求计数）、计数器、租约与 API Key 列表的存取接口：
+- MemoryStateStore: 进程内存储（单进程部署与测试）
+- SQLiteStateStore: 同一主机的多个 worker 进程共享
+- RespStateStore: 通过 RESP 协议（Redis 及兼容服务）在多台主机之间共享
+"""
+import json
+import os
+from abc import ABC, abstractmethod
+import socket
+import sqlite3
+import threading
+import time
+
+from app.config import config
+
+# get_account / get_accounts 返回的字段及默认值
+ACCOUNT_FIELDS = {
+    "access_token": None,
+    "refresh_token": None,
+    "user_id": None,
+    "token_expires_at": 0.0,
+    "token_version": 0,
+    "cooldown_until": 0.0,
+    "cooldown_reason": None,
+    "request_count": 0,
+    "last_request_time": 0.0,
+}
+
+
+class StateStore(ABC):
+    """共享状态存储接口，所有方法都必须线程安全；缺少任一方法的后端在构造时即报错"""
+
+    @abstractmethod
+    def get_accounts(self) -> dict:
+        """所有账号的共享状态：name -> dict（字段见 ACCOUNT_FIELDS）"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_account(self, name: str):
+        """单个账号的共享状态，不存在时返回 None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def publish_token(self, name, access_token, refresh_token, user_id, expires_at) -> int:
+        """发布新 token，返回新的 token 版本号"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def invalidate_token(self, name, access_token):
+        """标记 token 失效（仅当共享的仍是这个 token，避免覆盖其他节点刚发布的新 token）"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_cooldown(self, name, until, reason):
+        """设置冷却（结束时间取较晚者）"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_requests(self, name, delta, last_request_time) -> int:
+        """累加请求数，返回共享总数"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def incr(self, name: str, amount: int = 1) -> int:
+        """原子地把计数器增加 amount 并返回增加前的值"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def acquire_lease(self, name, owner, ttl) -> bool:
+        """获取或续期租约；租约被其他持有者占用且未过期时返回 False"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def renew_leases(self, owner, ttl):
+        """续期 owner 持有的所有租约"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def release_leases(self, owner):
+        """释放 owner 持有的所有租约"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def lease_owner(self, name):
+        """租约当前的持有者，无人持有时返回 None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_api_keys(self):
+        """返回 (版本号, API Key 字典列表)，尚未保存过时为 (0, None)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_api_keys(self, keys: list) -> int:
+        """保存 API Key 列表，返回新的版本号"""
+        raise NotImplementedError
+
+
+class MemoryStateStore(StateStore):
+    """进程内存储"""
+
+    def __init__(self):
+        self.path = "memory"
+        self._lock = threading.Lock()
+        self._accounts = {}
+        self._counters = {}
+        self._leases = {}  # name -> (owner, expires_at)
+        self._api_keys = (0, None)
+
+    def _row(self, name):
+        row = self._accounts.get(name)
+        if row is None:
+            row = self._accounts[name] = dict(ACCOUNT_FIELDS, name=name)
+        return row
+
+    def get_accounts(self):
+        with self._lock:
+            return {name: dict(row) for name, row in self._accounts.items()}
+
+    def get_account(self, name):
+        with self._lock:
+            row = self._accounts.get(name)
+            return dict(row) if row else None
+
+    def publish_token(self, name, access_token, refresh_token, user_id, expires_at):
+        with self._lock:
+            row = self._row(name)
+            row.update(access_token=access_token, refresh_token=refresh_token, user_id=str(user_id or ""),
+                       token_expires_at=expires_at, token_version=row["token_version"] + 1)
+            return row["token_version"]
+
+    def invalidate_token(self, name, access_token):
+        with self._lock:
+            row = self._accounts.get(name)
+            if row and row["access_token"] == access_token:
+                row["token_expires_at"] = 0.0
+                row["token_version"] += 1
+
+    def set_cooldown(self, name, until, reason):
+        with self._lock:
+            row = self._row(name)
+            row["cooldown_until"] = max(row["cooldown_until"], until)
+            row["cooldown_reason"] = reason
+
+    def add_requests(self, name, delta, last_request_time):
+        with self._lock:
+            row = self._row(name)
+            row["request_count"] += delta
+            row["last_request_time"] = max(row["last_request_time"], last_request_time)
+            return row["request_count"]
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            value = self._counters.get(name, 0)
+            self._counters[name] = value + amount
+            return value
+
+    def acquire_lease(self, name, owner, ttl):
+        now = time.time()
+        with self._lock:
+            current = self._leases.get(name)
+            if current and current[0] != owner and current[1] >= now:
+                return False
+            self._leases[name] = (owner, now + ttl)
+            return True
+
+    def renew_leases(self, owner, ttl):
+        expires_at = time.time() + ttl
+        with self._lock:
+            for name, (lease_owner, _) in list(self._leases.items()):
+                if lease_owner == owner:
+                    self._leases[name] = (owner, expires_at)
+
+    def release_leases(self, owner):
+        with self._lock:
+            for name in [n for n, (o, _) in self._leases.items() if o == owner]:
+                del self._leases[name]
+
+    def lease_owner(self, name):
+        with self._lock:
+            current = self._leases.get(name)
+            return current[0] if current and current[1] >= time.time() else None
+
+    def get_api_keys(self):
+        with self._lock:
+            version, keys = self._api_keys
+            return version, json.loads(json.dumps(keys)) if keys is not None else None
+
+    def put_api_keys(self, keys):
+        with self._lock:
+            version = self._api_keys[0] + 1
+            self._api_keys = (version, json.loads(json.dumps(keys)))
+            return version
+
+
+SQLITE_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS accounts (
+        name TEXT PRIMARY KEY,
+        access_token TEXT,
+        refresh_token TEXT,
+        user_id TEXT,
+        token_expires_at REAL NOT NULL DEFAULT 0,
+        token_version INTEGER NOT NULL DEFAULT 0,
+        cooldown_until REAL NOT NULL DEFAULT 0,
+        cooldown_reason TEXT,
+        request_count INTEGER NOT NULL DEFAULT 0,
+        last_request_time REAL NOT NULL DEFAULT 0
+    )""",
+    "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS documents (name TEXT PRIMARY KEY, value TEXT NOT NULL, version INTEGER NOT NULL)",
+)
+
+
+class SQLiteStateStore(StateStore):
+    """SQLite 存储（WAL 模式，每个线程一个连接，自动提交），供同一主机的多个进程共享"""
+
+    def __init__(self, path: str, timeout: float = 5):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in SQLITE_SCHEMA:
+            conn.execute(statement)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_accounts(self):
+        rows = self._conn().execute("SELECT * FROM accounts").fetchall()
+        return {row["name"]: dict(row) for row in rows}
+
+    def get_account(self, name):
+        row = self._conn().execute("SELECT * FROM accounts WHERE name = ?", (name,)).fetchone()
+        return dict(row) if row else None
+
+    def publish_token(self, name, access_token, refresh_token, user_id, expires_at):
+        row = self._conn().execute(
+            """INSERT INTO accounts (name, access_token, refresh_token, user_id, token_expires_at, token_version)
+               VALUES (?, ?, ?, ?, ?, 1)
+               ON CONFLICT(name) DO UPDATE SET
+                   access_token = excluded.access_token, refresh_token = excluded.refresh_token,
+                   user_id = excluded.user_id, token_expires_at = excluded.token_expires_at,
+                   token_version = accounts.token_version + 1
+               RETURNING token_version""",
+            (name, access_token, refresh_token, str(user_id or ""), expires_at)).fetchone()
+        return row[0]
+
+    def invalidate_token(self, name, access_token):
+        self._conn().execute(
+            """UPDATE accounts SET token_expires_at = 0, token_version = token_version + 1
+               WHERE name = ? AND access_token = ?""", (name, access_token))
+
+    def set_cooldown(self, name, until, reason):
+        self._conn().execute(
+            """INSERT INTO accounts (name, cooldown_until, cooldown_reason) VALUES (?, ?, ?)
+               ON CONFLICT(name) DO UPDATE SET
+                   cooldown_until = MAX(accounts.cooldown_until, excluded.cooldown_until),
+                   cooldown_reason = excluded.cooldown_reason""", (name, until, reason))
+
+    def add_requests(self, name, delta, last_request_time):
+        row = self._conn().execute(
+            """INSERT INTO accounts (name, request_count, last_request_time) VALUES (?, ?, ?)
+               ON CONFLICT(name) DO UPDATE SET
+                   request_count = accounts.request_count + excluded.request_count,
+                   last_request_time = MAX(accounts.last_request_time, excluded.last_request_time)
+               RETURNING request_count""", (name, delta, last_request_time)).fetchone()
+        return row[0]
+
+    def incr(self, name, amount=1):
+        row = self._conn().execute(
+            """INSERT INTO counters (name, value) VALUES (?, ?)
+               ON CONFLICT(name) DO UPDATE SET value = counters.value + excluded.value
+               RETURNING value""", (name, amount)).fetchone()
+        return row[0] - amount
+
+    def acquire_lease(self, name, owner, ttl):
+        now = time.time()
+        row = self._conn().execute(
+            """INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+               ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+               WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+               RETURNING owner""", (name, owner, now + ttl, now)).fetchone()
+        return row is not None
+
+    def renew_leases(self, owner, ttl):
+        self._conn().execute("UPDATE leases SET expires_at = ? WHERE owner = ?", (time.time() + ttl, owner))
+
+    def release_leases(self, owner):
+        self._conn().execute("DELETE FROM leases WHERE owner = ?", (owner,))
+
+    def lease_owner(self, name):
+        row = self._conn().execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+        return row["owner"] if row and row["expires_at"] >= time.time() else None
+
+    def get_api_keys(self):
+        row = self._conn().execute("SELECT value, version FROM documents WHERE name = 'api_keys'").fetchone()
+        return (row["version"], json.loads(row["value"])) if row else (0, None)
+
+    def put_api_keys(self, keys):
+        row = self._conn().execute(
+            """INSERT INTO documents (name, value, version) VALUES ('api_keys', ?, 1)
+               ON CONFLICT(name) DO UPDATE SET value = excluded.value, version = documents.version + 1
+               RETURNING version""", (json.dumps(keys, ensure_ascii=False),)).fetchone()
+        return row[0]
+
+
+class RespError(Exception):
+    """服务端返回的错误回复"""
+
+
+class _NotSent(ConnectionError):
+    """连接在发出任何数据之前就已失效，命令可以安全地在新连接上重发"""
+
+
+# 重复执行会改变结果的命令：连接在发出后断开时不重放
+NON_IDEMPOTENT = frozenset({"INCR", "INCRBY", "HINCRBY"})
+
+
+class RespClient:
+    """
+    最小的 RESP2 客户端（每个线程一个连接），支持流水线
+    复用连接前检查服务端是否已关闭；请求发出后连接断开时，只有不含非幂等命令的批次在新连接上重发一次
+    """
+
+    def __init__(self, host="127.0.0.1", port=6379, password=None, db=0, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.db = db
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile("rb"))
+        self._local.conn = conn
+        if self.password:
+            self._roundtrip(conn, [("AUTH", self.password)])
+        if self.db:
+            self._roundtrip(conn, [("SELECT", self.db)])
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn[1].close()
+            conn[0].close()
+            self._local.conn = None
+
+    @staticmethod
+    def _encode(command):
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def _read(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            raise RespError(rest.decode("utf-8"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [self._read(reader) for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply: {line!r}")
+
+    @staticmethod
+    def _alive(sock) -> bool:
+        """连接是否仍可用：服务端已关闭（可读到 EOF）或套接字已关闭时返回 False"""
+        try:
+            timeout = sock.gettimeout()
+            sock.settimeout(0)
+            try:
+                return sock.recv(1, socket.MSG_PEEK) != b""
+            finally:
+                sock.settimeout(timeout)
+        except BlockingIOError:
+            return True  # 没有待读数据，连接正常
+        except OSError:
+            return False
+
+    def _roundtrip(self, conn, commands):
+        sock, reader = conn
+        data = b"".join(self._encode(c) for c in commands)
+        sent = 0
+        try:
+            while sent < len(data):
+                sent += sock.send(data[sent:])
+        except OSError as e:
+            if sent == 0:
+                raise _NotSent(str(e)) from e
+            raise
+        replies, error = [], None
+        for _ in commands:
+            try:
+                replies.append(self._read(reader))
+            except RespError as e:
+                error = error or e  # 读完所有回复再抛出，保持连接可用
+                replies.append(None)
+        if error is not None:
+            raise error
+        return replies
+
+    def pipeline(self, commands):
+        """按顺序执行多条命令，返回回复列表"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and not self._alive(conn[0]):
+            self.close()  # 服务端已关闭空闲连接
+            conn = None
+        if conn is None:
+            return self._roundtrip(self._connect(), commands)
+        try:
+            return self._roundtrip(conn, commands)
+        except OSError as e:
+            self.close()
+            # 命令已发出时服务端可能已经执行，INCR 等重放会重复计数
+            if not isinstance(e, _NotSent) and any(str(c[0]).upper() in NON_IDEMPOTENT for c in commands):
+                raise
+        return self._roundtrip(self._connect(), commands)
+
+    def execute(self, *command):
+        return self.pipeline([command])[0]
+
+
+# 仍由 ARGV[1] 持有时续期 / 删除租约，返回 1，否则返回 0
+RENEW_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RespStateStore(StateStore):
+    """
+    RESP（Redis 及兼容服务）存储，供多台主机共享
+    租约的续期与释放用 Lua 脚本原子地比较持有者，避免延长或删除其他节点刚获取的租约；
+    同一账号的 token 只由租约持有者写入，其余条件更新（失效、冷却取较晚者）在读与写之间的竞争
+    只会导致一次多余的刷新或冷却时间略短
+    """
+
+    def __init__(self, client: RespClient, prefix: str = "pixiv:"):
+        self.client = client
+        self.prefix = prefix
+        self.path = f"resp://{client.host}:{client.port}/{client.db}"
+        self._leases_lock = threading.Lock()
+        self._leases = {}  # owner -> 本实例获取过的租约名
+
+    @classmethod
+    def from_config(cls, resp_cfg: dict):
+        client = RespClient(
+            host=resp_cfg.get("host", "127.0.0.1"),
+            port=resp_cfg.get("port", 6379),
+            password=resp_cfg.get("password") or None,
+            db=resp_cfg.get("db", 0),
+            timeout=resp_cfg.get("timeout", 5),
+        )
+        return cls(client, resp_cfg.get("prefix", "pixiv:"))
+
+    def _account_key(self, name):
+        return f"{self.prefix}account:{name}"
+
+    def _lease_key(self, name):
+        return f"{self.prefix}lease:{name}"
+
+    @staticmethod
+    def _decode(name, fields):
+        row = dict(ACCOUNT_FIELDS, name=name)
+        pairs = dict(zip(fields[::2], fields[1::2]))
+        for field, default in ACCOUNT_FIELDS.items():
+            value = pairs.get(field)
+            if value is None or value == "":
+                continue
+            row[field] = type(default)(float(value)) if isinstance(default, (int, float)) else value
+        return row
+
+    def get_accounts(self):
+        names = self.client.execute("SMEMBERS", f"{self.prefix}accounts") or []
+        if not names:
+            return {}
+        replies = self.client.pipeline([("HGETALL", self._account_key(n)) for n in names])
+        return {name: self._decode(name, fields) for name, fields in zip(names, replies) if fields}
+
+    def get_account(self, name):
+        fields = self.client.execute("HGETALL", self._account_key(name))
+        return self._decode(name, fields) if fields else None
+
+    def publish_token(self, name, access_token, refresh_token, user_id, expires_at):
+        key = self._account_key(name)
+        # 先写 token 再递增版本号：读到新版本号时一定能读到新 token
+        replies = self.client.pipeline([
+            ("HSET", key, "access_token", access_token or "", "refresh_token", refresh_token or "",
+             "user_id", user_id or "", "token_expires_at", repr(float(expires_at))),
+            ("SADD", f"{self.prefix}accounts", name),
+            ("HINCRBY", key, "token_version", 1),
+        ])
+        return replies[-1]
+
+    def invalidate_token(self, name, access_token):
+        key = self._account_key(name)
+        if self.client.execute("HGET", key, "access_token") == access_token:
+            self.client.pipeline([("HSET", key, "token_expires_at", "0"), ("HINCRBY", key, "token_version", 1)])
+
+    def set_cooldown(self, name, until, reason):
+        key = self._account_key(name)
+        current = float(self.client.execute("HGET", key, "cooldown_until") or 0)
+        self.client.pipeline([
+            ("HSET", key, "cooldown_until", repr(max(current, float(until))), "cooldown_reason", reason or ""),
+            ("SADD", f"{self.prefix}accounts", name),
+        ])
+
+    def add_requests(self, name, delta, last_request_time):
+        key = self._account_key(name)
+        total, last = self.client.pipeline([
+            ("HINCRBY", key, "request_count", int(delta)),
+            ("HGET", key, "last_request_time"),
+            ("SADD", f"{self.prefix}accounts", name),
+        ])[:2]
+        if last_request_time > float(last or 0):
+            self.client.execute("HSET", key, "last_request_time", repr(float(last_request_time)))
+        return total
+
+    def incr(self, name, amount=1):
+        return self.client.execute("INCRBY", f"{self.prefix}counter:{name}", amount) - amount
+
+    def acquire_lease(self, name, owner, ttl):
+        key = self._lease_key(name)
+        ttl_ms = max(1, int(ttl * 1000))
+        acquired = self.client.execute("SET", key, owner, "NX", "PX", ttl_ms) == "OK"
+        if not acquired:
+            acquired = self.client.execute("EVAL", RENEW_LEASE_SCRIPT, 1, key, owner, ttl_ms) == 1
+        if acquired:
+            with self._leases_lock:
+                self._leases.setdefault(owner, set()).add(name)
+        return acquired
+
+    def renew_leases(self, owner, ttl):
+        with self._leases_lock:
+            names = list(self._leases.get(owner, ()))
+        for name in names:
+            if not self.acquire_lease(name, owner, ttl):
+                with self._leases_lock:
+                    self._leases.get(owner, set()).discard(name)
+
+    def release_leases(self, owner):
+        with self._leases_lock:
+            names = self._leases.pop(owner, set())
+        if names:
+            self.client.pipeline([("EVAL", RELEASE_LEASE_SCRIPT, 1, self._lease_key(name), owner) for name in names])
+
+    def lease_owner(self, name):
+        return self.client.execute("GET", self._lease_key(name))
+
+    def get_api_keys(self):
+        version, data = self.client.execute("MGET", f"{self.prefix}api_keys:version", f"{self.prefix}api_keys")
+        return (int(version), json.loads(data)) if data is not None and version is not None else (0, None)
+
+    def put_api_keys(self, keys):
+        replies = self.client.pipeline([
+            ("SET", f"{self.prefix}api_keys", json.dumps(keys, ensure_ascii=False)),
+            ("INCR", f"{self.prefix}api_keys:version"),
+        ])
+        return replies[-1]
+
+
+def create_store(state_cfg: dict = None) -> StateStore:
+    """按 shared_state.backend 创建存储：sqlite（默认）| memory | redis"""
+    state_cfg = config.shared_state if state_cfg is None else state_cfg
+    backend = state_cfg.get("backend", "sqlite")
+    if backend == "memory":
+        return MemoryStateStore()
+    if backend == "redis":
+        return RespStateStore.from_config(state_cfg.get("redis", {}) or {})
+    if backend == "sqlite":
+        return SQLiteStateStore(state_cfg.get("path", "./data/state.db"))
+    raise ValueError(f"Unknown shared_state backend: {backend}")
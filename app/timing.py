@@ -0,0 +1,154 @@
+"""
+请求分阶段计时 - 记录一次请求在鉴权、Key 权限检查、选择账号、刷新 token、上游请求、序列化与发送上的耗时，
+通过 Server-Timing 响应头返回，并输出一行 JSON 访问日志
+
+按 timing.sample_rate 抽样，未抽中的请求中 phase() 只是一次 ContextVar 读取
+阶段可以嵌套（如选择账号时同步刷新 token），各阶段只计自身耗时，不含嵌套阶段
+send 在响应头发出之后才结束，只出现在访问日志中；以未处理异常结束的请求没有响应头，只输出访问日志
+"""
+import contextvars
+import json
+import random
+import time
+from contextlib import nullcontext
+from typing import Optional
+
+from app.config import config
+
+_current = contextvars.ContextVar("request_timing", default=None)
+_NOOP = nullcontext()
+
+
+class RequestTiming:
+    """一次请求的各阶段耗时（秒）"""
+
+    __slots__ = ("start", "phases", "notes", "_nested")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}  # 阶段名 -> 累计自身耗时，按首次出现的顺序
+        self.notes = {}  # 写入访问日志的附加字段（使用的账号、缓存状态等）
+        self._nested = []  # 进行中的各层阶段已计入的嵌套阶段耗时
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+
+class _Phase:
+    __slots__ = ("timing", "name", "start")
+
+    def __init__(self, timing: RequestTiming, name: str):
+        self.timing = timing
+        self.name = name
+
+    def __enter__(self):
+        self.timing._nested.append(0.0)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        nested = self.timing._nested
+        self.timing.add(self.name, elapsed - nested.pop())
+        if nested:
+            nested[-1] += elapsed
+
+
+def phase(name: str):
+    """计时上下文：with timing.phase("upstream"): ...；当前请求未抽中时不做任何事"""
+    timing = _current.get()
+    return _NOOP if timing is None else _Phase(timing, name)
+
+
+def note(key: str, value):
+    """为当前请求的访问日志附加字段"""
+    timing = _current.get()
+    if timing is not None:
+        timing.notes[key] = value
+
+
+def begin() -> Optional[RequestTiming]:
+    """请求开始时调用：按 timing.sample_rate 抽样，抽中时返回并设为当前请求的计时"""
+    rate = config.timing.get("sample_rate", 0.01)
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return None
+    timing = RequestTiming()
+    _current.set(timing)
+    return timing
+
+
+def end():
+    """请求结束时调用，避免线程池中的下一个请求沿用"""
+    _current.set(None)
+
+
+def server_timing_header() -> Optional[str]:
+    """当前请求的 Server-Timing 头（毫秒），未抽中或 timing.server_timing 关闭时返回 None"""
+    timing = _current.get()
+    if timing is None or not config.timing.get("server_timing", True):
+        return None
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timing.phases.items()]
+    parts.append(f"total;dur={timing.elapsed() * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def log(timing: RequestTiming, method: str, path: str, route: str, status: int):
+    """输出一行 JSON 访问日志（timing.access_log 关闭时不输出）"""
+    if not config.timing.get("access_log", True):
+        return
+    record = {
+        "ts": round(time.time(), 3),
+        "method": method,
+        "path": path,
+        "route": route,
+        "status": status,
+        "ms": round(timing.elapsed() * 1000, 2),
+        "phases": {name: round(seconds * 1000, 2) for name, seconds in timing.phases.items()},
+    }
+    record.update(timing.notes)
+    print(f"[Access] {json.dumps(record, ensure_ascii=False)}")
+
+
+def instrument(app):
+    """为 Flask 应用的抽中请求添加 Server-Timing 头与访问日志"""
+    from flask import g, request
+
+    @app.before_request
+    def start_timing():
+        g.request_timing = begin()
+
+    @app.after_request
+    def finish_timing(response):
+        timing = g.pop("request_timing", None)
+        if timing is None:
+            return response
+        header = server_timing_header()
+        if header:
+            response.headers["Server-Timing"] = header
+        if response.headers.get("X-Cache"):
+            timing.notes.setdefault("cache", response.headers["X-Cache"])
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        method, path, status = request.method, request.path, response.status_code
+        sent_at = time.perf_counter()
+
+        def on_close():
+            # WSGI 服务器发送完响应体（或客户端断开）后调用
+            timing.add("send", time.perf_counter() - sent_at)
+            log(timing, method, path, route, status)
+
+        response.call_on_close(on_close)
+        return response
+
+    @app.teardown_request
+    def reset_timing(exc=None):
+        # 未处理的异常向外传播时不经过 after_request，仍按 500 输出访问日志
+        timing = g.pop("request_timing", None)
+        if timing is not None:
+            if exc is not None:
+                timing.notes.setdefault("error", type(exc).__name__)
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            log(timing, request.method, request.path, route, 500)
+        end()
@@ -0,0 +1,119 @@
+"""
+共享 HTTP 传输层 - 所有账号复用同一个 cloudscraper 会话与连接池
+
+认证头由 AppPixivAPI 在每次请求的 headers 中按账号设置，会话本身不保存账号状态，
+因此多个账号可以共享到 app-api.pixiv.net / i.pximg.net 的 TCP/TLS 连接
+"""
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cloudscraper
+from cloudscraper import CipherSuiteAdapter
+
+from app.config import config
+
+# 启动预热时建立连接的 Pixiv 主机
+WARM_UP_HOSTS = ("app-api.pixiv.net", "oauth.secure.pixiv.net", "i.pximg.net")
+
+
+class PooledAdapter(CipherSuiteAdapter):
+    """保留 cloudscraper 的 TLS 指纹设置，额外为连接开启 TCP keep-alive"""
+
+    def __init__(self, *args, socket_options=None, **kwargs):
+        self.socket_options = socket_options
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.socket_options:
+            kwargs["socket_options"] = self.socket_options
+        return super().init_poolmanager(*args, **kwargs)
+
+    def proxy_manager_for(self, *args, **kwargs):
+        if self.socket_options:
+            kwargs["socket_options"] = self.socket_options
+        return super().proxy_manager_for(*args, **kwargs)
+
+
+def _socket_options():
+    from urllib3.connection import HTTPConnection
+    options = list(HTTPConnection.default_socket_options)
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    # 空闲 60 秒后开始探测，避免代理 / NAT 静默断开长连接
+    for name, value in (("TCP_KEEPIDLE", 60), ("TCP_KEEPINTVL", 20), ("TCP_KEEPCNT", 3)):
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
+
+
+def create_session():
+    """按 http 配置创建带连接池的 cloudscraper 会话"""
+    http_cfg = config.http
+    session = cloudscraper.create_scraper()
+    keep_alive = http_cfg.get("keep_alive", True)
+    base = session.adapters["https://"]
+    pool_kwargs = {
+        "pool_connections": http_cfg.get("pool_connections", 10),
+        "pool_maxsize": http_cfg.get("pool_maxsize", 32),
+        "pool_block": http_cfg.get("pool_block", False),
+        "max_retries": http_cfg.get("max_retries", 0),
+        "socket_options": _socket_options() if keep_alive else None,
+    }
+    for prefix in ("https://", "http://"):
+        session.mount(prefix, PooledAdapter(
+            cipherSuite=base.cipherSuite,
+            ecdhCurve=base.ecdhCurve,
+            server_hostname=base.server_hostname,
+            source_address=base.source_address,
+            ssl_context=base.ssl_context,
+            **pool_kwargs,
+        ))
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+    return session
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """获取进程内共享的会话（首次调用时创建）"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def default_timeout():
+    """账号未单独设置超时时使用的 (connect, read) 超时"""
+    http_cfg = config.http
+    return (http_cfg.get("connect_timeout", 5), http_cfg.get("read_timeout", 30))
+
+
+def warm_up(proxies=None, hosts=WARM_UP_HOSTS):
+    """
+    预先建立到 Pixiv 主机的连接并放回连接池，首批请求无需再做 TCP/TLS 握手
+    每个主机并发 http.warm_up_connections 个 HEAD 请求，失败只记录日志
+    """
+    http_cfg = config.http
+    per_host = max(1, http_cfg.get("warm_up_connections", 2))
+    session = get_session()
+    timeout = default_timeout()
+
+    def open_connection(host):
+        try:
+            response = session.head(f"https://{host}/", proxies=proxies, timeout=timeout, allow_redirects=False)
+            response.close()
+            return True
+        except Exception as e:
+            print(f"[Transport] Warm-up {host} failed: {e}")
+            return False
+
+    targets = [host for host in hosts for _ in range(per_host)]
+    with ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix="warm-up") as executor:
+        opened = sum(executor.map(open_connection, targets))
+    print(f"[Transport] Warmed up {opened}/{len(targets)} connections")
+    return opened
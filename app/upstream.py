@@ -0,0 +1,208 @@
+"""
+上游调用封装 - 选择账号、识别限流 / 失效错误，并在其他账号上自动重试
+"""
+import time
+from collections.abc import Mapping
+from contextlib import contextmanager
+from typing import List, NamedTuple, Optional
+
+from pixivpy3 import PixivError
+
+from app import metrics, timing
+from app.config import config
+from app.pool import pool
+from app.json_codec import RawJson
+
+# 图片下载：i.pximg.net 要求 Referer；每次读取的块大小（单个下载请求的内存占用上限）
+DOWNLOAD_REFERER = "https://app-api.pixiv.net/"
+CHUNK_SIZE = 64 * 1024
+
+# 错误分类
+RATE_LIMIT = "rate_limit"
+INVALID_GRANT = "invalid_grant"
+NETWORK = "network"
+
+
+class AccountScope(NamedTuple):
+    """一次请求可用的账号范围（来自 API Key 的池限制）"""
+    pool_mode: Optional[str] = None  # None 表示没有 Key 上下文，使用全部账号
+    allowed_accounts: frozenset = frozenset()
+    strategy: Optional[str] = None
+
+
+class NoAvailableAccount(Exception):
+    """没有可用账号（全部未认证、冷却中或已尝试过）"""
+
+
+class UpstreamFailed(Exception):
+    """所有重试都因可重试错误失败"""
+
+    def __init__(self, kind: str, message: str):
+        super().__init__(message)
+        self.kind = kind
+        self.status_code = 429 if kind == RATE_LIMIT else 502
+
+
+def error_message(result) -> str:
+    """提取 Pixiv 错误 JSON 中的错误信息，没有错误时返回空字符串"""
+    if isinstance(result, RawJson) and not result.maybe_error():
+        return ""  # 正常响应无需解析
+    error = result.get("error") if isinstance(result, Mapping) else None
+    if not error:
+        return ""
+    if isinstance(error, dict):
+        parts = (str(error.get(k) or "") for k in ("message", "user_message", "reason"))
+        return " ".join(p for p in parts if p) or "Unknown error"
+    return str(error)
+
+
+def classify_error(result=None, exc: Optional[BaseException] = None) -> Optional[str]:
+    """
+    识别需要换账号重试的上游错误，返回错误类型；其余情况（成功、作品不存在等）返回 None
+    pixivpy3 不会因 API 错误抛异常，而是返回带 error 字段的 JSON
+    """
+    if exc is not None:
+        if not isinstance(exc, PixivError):
+            return None  # 非上游错误（程序错误等）不重试
+        if "invalid_grant" in str(exc).lower():
+            return INVALID_GRANT
+        return NETWORK
+    text = error_message(result).lower()
+    if not text:
+        return None
+    if "rate limit" in text:
+        return RATE_LIMIT
+    if "invalid_grant" in text or "oauth" in text:
+        return INVALID_GRANT
+    return None
+
+
+def result_label(kind: Optional[str], exc: Optional[BaseException] = None) -> str:
+    """上游调用结果在指标中的标签：ok、错误类型或 error（其他异常）"""
+    return kind or ("error" if exc is not None else "ok")
+
+
+def select_account(scope: AccountScope, exclude=None):
+    """按范围和策略选择一个账号，排除 exclude 中已尝试过的账号"""
+    with metrics.ACCOUNT_SELECT.time(), timing.phase("select"):
+        if scope.pool_mode:
+            return pool.get_account_for_key(scope.pool_mode, scope.allowed_accounts, scope.strategy, exclude=exclude)
+        return pool.get_account(scope.strategy, exclude=exclude)
+
+
+@contextmanager
+def lease(scope: AccountScope = AccountScope()):
+    """
+    占用一个账号直到 with 块结束（不做失败转移，用于下载等直接使用 account.api 的场景）
+    没有可用账号时抛出 NoAvailableAccount
+    """
+    account = select_account(scope)
+    if account is None:
+        raise NoAvailableAccount("No available account")
+    try:
+        yield account
+    finally:
+        pool.release(account)
+
+
+def _cooldown_for(kind: str) -> float:
+    failover_cfg = config.failover
+    if kind == RATE_LIMIT:
+        return failover_cfg.get("rate_limit_cooldown", 300)
+    if kind == INVALID_GRANT:
+        return failover_cfg.get("invalid_grant_cooldown", 60)
+    return 0
+
+
+def call(method: str, *args, scope: AccountScope = AccountScope(), **kwargs):
+    """
+    在账号池上调用 AppPixivAPI 方法，返回 (result, account)
+    限流 / token 失效的账号进入冷却并换账号重试，网络错误直接换账号重试；
+    重试次数受 failover.max_attempts 与 failover.deadline（秒）限制；
+    所有账号并发满载且排队超时时抛出 PoolBusy
+    """
+    failover_cfg = config.failover
+    deadline = time.monotonic() + failover_cfg.get("deadline", 20)
+    max_attempts = failover_cfg.get("max_attempts", 3)
+    tried: List = []
+    last_kind, last_message = None, ""
+
+    while len(tried) < max_attempts and time.monotonic() < deadline:
+        account = select_account(scope, exclude=tried)
+        if account is None:
+            break
+        tried.append(account)
+        start = time.perf_counter()
+        try:
+            with timing.phase("upstream"):
+                result, exc = getattr(account.api, method)(*args, **kwargs), None
+        except Exception as e:
+            result, exc = None, e
+        finally:
+            pool.release(account)
+        timing.note("account", account.name)
+
+        kind = classify_error(result, exc)
+        metrics.UPSTREAM_DURATION.observe(time.perf_counter() - start, account.name, method, result_label(kind, exc))
+        if kind is None:
+            if exc is not None:
+                raise exc
+            return result, account
+
+        last_kind, last_message = kind, str(exc) if exc is not None else error_message(result)
+        cooldown = _cooldown_for(kind)
+        if cooldown:
+            pool.quarantine(account, cooldown, kind)
+        print(f"[Upstream] {method} failed on [{account.name}] ({kind}), attempt {len(tried)}/{max_attempts}")
+
+    if last_kind is None:
+        raise NoAvailableAccount("No available account")
+    raise UpstreamFailed(last_kind, last_message)
+
+
+def open_download(url: str, headers=None, scope: AccountScope = AccountScope()):
+    """
+    以流方式请求图片，返回响应，响应体尚未读取；调用方读完或放弃后必须 response.close() 释放连接
+    账号的并发名额在响应头返回后即释放：上游请求已完成，读取响应体的快慢取决于客户端，
+    慢速客户端不会长期占用账号名额而让 API 请求排队
+    连接失败与 5xx 换账号重试，其余状态码（200/206/304/404/416 等）原样返回
+    """
+    request_headers = {"Referer": DOWNLOAD_REFERER}
+    request_headers.update(headers or {})
+    failover_cfg = config.failover
+    deadline = time.monotonic() + failover_cfg.get("deadline", 20)
+    max_attempts = failover_cfg.get("max_attempts", 3)
+    tried: List = []
+    last_message = ""
+
+    while len(tried) < max_attempts and time.monotonic() < deadline:
+        account = select_account(scope, exclude=tried)
+        if account is None:
+            break
+        tried.append(account)
+        start = time.perf_counter()
+        try:
+            with timing.phase("upstream"):
+                response = account.api.requests_call("GET", url, headers=request_headers, stream=True)
+        except PixivError as e:
+            pool.release(account)
+            metrics.UPSTREAM_DURATION.observe(time.perf_counter() - start, account.name, "download", NETWORK)
+            last_message = str(e)
+        except BaseException:
+            pool.release(account)
+            raise
+        else:
+            pool.release(account)
+            ok = response.status_code < 500
+            # 流式下载只计到响应头返回
+            metrics.UPSTREAM_DURATION.observe(time.perf_counter() - start, account.name, "download",
+                                              "ok" if ok else NETWORK)
+            if ok:
+                return response
+            response.close()
+            last_message = f"Upstream returned HTTP {response.status_code}"
+        print(f"[Upstream] download failed on [{account.name}] ({last_message}), attempt {len(tried)}/{max_attempts}")
+
+    if not tried:
+        raise NoAvailableAccount("No available account")
+    raise UpstreamFailed(NETWORK, last_message)
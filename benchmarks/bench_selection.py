@@ -0,0 +1,63 @@
+"""
+账号选择微基准：比较不同账号池规模、相同权重与不同权重（1~10）下单次选择与视图重建的耗时
+用法: python benchmarks/bench_selection.py
+"""
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.pool import AccountPool, PixivAccount
+
+SIZES = [10, 100, 500, 1000, 2000]
+STRATEGIES = ["round_robin", "least_used", "least_latency"]
+CALLS = 20000
+
+
+def build_pool(size, weighted=False):
+    """构造 size 个已认证账号（不访问 Pixiv），weighted 时权重为 1~10"""
+    AccountPool._instance = None
+    pool = AccountPool()
+    accounts = []
+    for i in range(size):
+        account = PixivAccount(f"acc{i}")
+        account.authenticated = True
+        account.token_expires_at = time.time() + 3600
+        account.record_upstream(0.1 + (i % 7) * 0.01, True)
+        if weighted:
+            account.weight = 1 + i % 10
+        accounts.append(account)
+    pool.accounts = accounts
+    return pool
+
+
+def main():
+    print(f"{'accounts':>8}  {'weights':>8}  {'scope':>8}  " + "  ".join(f"{s:>14}" for s in STRATEGIES)
+          + f"  {'rebuild (ms)':>14}   (us/selection)")
+    for size in SIZES:
+        for weighted in (False, True):
+            pool = build_pool(size, weighted)
+            allowed = frozenset(f"acc{i}" for i in range(0, size, 2))
+            for scope in ("all", "specific"):
+                row = []
+                for strategy in STRATEGIES:
+                    if scope == "all":
+                        select = lambda: pool.get_account(strategy)
+                    else:
+                        select = lambda: pool.get_account_for_key("specific", allowed, strategy)
+                    select()  # 预热：构建视图
+                    elapsed = timeit.timeit(select, number=CALLS)
+                    row.append(f"{elapsed / CALLS * 1e6:>14.2f}")
+
+                def rebuild():
+                    pool.accounts = pool.accounts  # 账号列表变化后的首次选择重建视图
+                    select()
+                rebuild_ms = timeit.timeit(rebuild, number=20) / 20 * 1000
+                print(f"{size:>8}  {'1-10' if weighted else '1':>8}  {scope:>8}  " + "  ".join(row)
+                      + f"  {rebuild_ms:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
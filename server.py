@@ -1,8 +1,11 @@
 import os
-from flask import Flask, jsonify, redirect
+import threading
+from flask import Flask, Response, jsonify, redirect
 from werkzeug.middleware.proxy_fix import ProxyFix
 from app.config import config
-from app.pool import pool
+from app.pool import pool, get_proxy_settings
+from app import transport, metrics, timing
+from app.auth import require_auth
 from app.key_manager import key_manager
 from app.routes import api_bp
 from app.routes.ui import ui_bp
@@ -23,6 +26,31 @@ def create_app():
     def health():
         return jsonify({"status": "ok", "accounts": len(pool.accounts)})
     
+    # 就绪检查：可用账号数达到 startup.min_ready_accounts 后才返回 200
+    @app.route("/ready", methods=["GET"])
+    def ready():
+        body = {
+            "ready": pool.is_ready(),
+            "accounts": len(pool.get_available_account_names()),
+            "min_ready_accounts": pool.min_ready_accounts,
+            "pending": pool.pending_auth,
+        }
+        return jsonify(body), 200 if body["ready"] else 503
+    
+    # 抽样请求的分阶段计时（Server-Timing 头与访问日志）
+    timing.instrument(app)
+    
+    # Prometheus 指标
+    if config.metrics.get("enabled", True):
+        metrics.instrument(app)
+        
+        def metrics_view():
+            return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+        
+        if config.metrics.get("require_auth", True):
+            metrics_view = require_auth(metrics_view)
+        app.add_url_rule("/metrics", "metrics", metrics_view, methods=["GET"])
+    
     # 根路径重定向到 UI
     @app.route("/")
     def index():
@@ -30,15 +58,50 @@ def create_app():
     
     return app
 
-def main():
-    # 加载账号池
+def bootstrap():
+    """初始化账号池、API Keys 与后台任务（每个进程执行一次）"""
+    # 预热到 Pixiv 主机的共享连接（后台进行，与账号认证并行）
+    if config.http.get("warm_up", True):
+        threading.Thread(target=transport.warm_up, args=(get_proxy_settings(),), daemon=True).start()
+    
+    # 多进程 / 多节点部署时接入共享状态：token 只由持有租约的 worker 刷新，
+    # 计数、冷却、轮询游标与 API Key 跨进程 / 节点共享
+    shared = None
+    if config.shared_state.get("enabled", False):
+        from app.shared_state import SharedState
+        shared = SharedState.from_config(pool, key_manager)
+        pool.enable_shared_state(shared)
+    
+    # 加载账号池（并行认证，达到 min_ready_accounts 后即开始监听，其余账号后台继续认证）
     pool.load_from_config()
     
     # 加载 API Keys
     key_manager.load_from_config(config.api_keys)
+    if shared is not None:
+        key_manager.use_state_store(shared.store)
     
-    # 启动自动刷新（每50分钟刷新一次，Pixiv token 有效期约1小时）
-    pool.start_auto_refresh(interval=3000)
+    # 监视 config.yaml，外部修改约 1 秒内生效（不再每次请求都重新解析 YAML）
+    key_manager.watch_config()
+    config.start_watcher()
+    
+    # 启动后台 token 刷新（按各账号过期时间提前刷新，带随机抖动）
+    pool.start_auto_refresh()
+    if shared is not None:
+        shared.start()
+
+
+def create_worker_app():
+    """
+    供 pre-fork WSGI 服务器在每个 worker 中调用的应用工厂，例如：
+    gunicorn -w 4 -b [::]:6523 'server:create_worker_app()'
+    多 worker 时应同时开启 shared_state
+    """
+    bootstrap()
+    return create_app()
+
+
+def main():
+    bootstrap()
     
     # 创建应用
     app = create_app()
@@ -52,6 +115,7 @@ def main():
     print(f"API Keys: {len(key_manager.list_keys())}")
     print(f"Strategy: {config.lb_strategy}")
     print(f"Accounts: {len(pool.accounts)}")
+    print(f"Mode: {config.server.get('mode', 'wsgi')}")
     print("=" * 50)
     
     host = config.server.get("host", "0.0.0.0")
@@ -63,6 +127,12 @@ def main():
     if host == "0.0.0.0" and config.server.get("ipv6", False):
         host = "::"
     
+    # server.mode: asgi 时用 uvicorn 运行，热点接口的上游请求异步发送；缺少依赖时回退到 Flask 开发服务器
+    if config.server.get("mode", "wsgi") == "asgi":
+        from app import asgi
+        if asgi.serve(app, host, port):
+            return
+    
     app.run(host=host, port=port, debug=debug)
 
 if __name__ == "__main__":
@@ -0,0 +1,91 @@
+"""
+测试公共配置：使用临时配置文件，避免导入 app.config 时在工作目录生成 config.yaml 和图片缓存；
+以及各测试共用的账号池、API 桩与账号构造
+"""
+import os
+import sys
+import tempfile
+import time
+
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if "CONFIG_PATH" not in os.environ:
+    # 图片缓存目录同样放到临时目录，避免未指定目录的测试写入 ./cache/images
+    _config_dir = tempfile.mkdtemp()
+    with open(os.path.join(ROOT, "config.yaml.example"), "r", encoding="utf-8") as f:
+        _config = yaml.safe_load(f)
+    _config["image_cache"]["dir"] = os.path.join(_config_dir, "images")
+    _config_path = os.path.join(_config_dir, "config.yaml")
+    with open(_config_path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(_config, f, allow_unicode=True)
+    os.environ["CONFIG_PATH"] = _config_path
+
+sys.path.insert(0, ROOT)
+
+import pytest
+from flask import Flask
+
+from app import upstream
+from app.key_manager import key_manager
+from app.pool import AccountPool, PixivAccount
+from app.routes import api_bp
+
+
+class StubAPI:
+    """
+    按方法名返回预设结果的 API 桩，例如 StubAPI(illust_detail={"illust": {...}})
+    结果为异常时抛出，为可调用对象时以调用参数计算；calls 记录每次调用的 (方法名, args, kwargs)
+    """
+
+    def __init__(self, **results):
+        self.results = results
+        self.calls = []
+
+    def __getattr__(self, method):
+        if method.startswith("_") or method not in self.results:
+            raise AttributeError(method)
+
+        def call(*args, **kwargs):
+            self.calls.append((method, args, kwargs))
+            result = self.results[method]
+            if callable(result):
+                result = result(*args, **kwargs)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return call
+
+
+def make_account(name, api=None, fresh=True, **results):
+    """
+    构造一个已认证的账号，fresh=False 时 token 已过期
+    传入 api 时替换上游 API；传入 方法名=结果 时使用 StubAPI(**results)
+    """
+    account = PixivAccount(name)
+    account.authenticated = True
+    account.token_expires_at = time.time() + (3600 if fresh else -1)
+    if results:
+        api = StubAPI(**results)
+    if api is not None:
+        account.api = api
+    return account
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """空的账号池，并替换 upstream 使用的单例"""
+    AccountPool._instance = None
+    p = AccountPool()
+    monkeypatch.setattr(upstream, "pool", p)
+    return p
+
+
+@pytest.fixture
+def api_app(pool):
+    """注册了 /api 蓝图的 Flask 应用，API Key 为 pk_test"""
+    key_manager.load_from_config([{"name": "test", "key": "pk_test"}])
+    app = Flask(__name__)
+    app.register_blueprint(api_bp)
+    return app
@@ -0,0 +1,216 @@
+"""
+ASGI 模式单元测试（异步 HTTP 客户端使用桩对象，不访问 Pixiv）
+"""
+import asyncio
+import json
+import pytest
+import sys
+import os
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, request as flask_request, jsonify
+
+from app import response_cache
+from app.asgi import AsgiApp
+from app.async_upstream import AsyncUpstream, build_request
+from app.config import config
+from app.key_manager import key_manager
+
+from conftest import make_account
+
+RATE_LIMIT = b'{"error": {"message": "Rate Limit"}}'
+
+
+class FakeResponse:
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+
+class FakeClient:
+    """按 Authorization 头区分账号；token_b 以外的账号可配置为返回限流错误"""
+
+    def __init__(self):
+        self.requests = []
+        self.rate_limited = set()
+        self.closed = False
+
+    async def request(self, method, url, headers=None, params=None, data=None):
+        self.requests.append((method, url, headers, params))
+        await asyncio.sleep(0.05)
+        token = headers["Authorization"].split()[-1]
+        if token in self.rate_limited:
+            return FakeResponse(RATE_LIMIT, 403)
+        body = {"illusts": [{"id": 1, "title": "t", "caption": "c"}], "next_url": None, "token": token}
+        return FakeResponse(json.dumps(body).encode("utf-8"))
+
+    async def aclose(self):
+        self.closed = True
+
+
+@pytest.fixture
+def accounts(pool, monkeypatch):
+    pool.accounts = [make_account(name) for name in ("a", "b")]
+    for account in pool.accounts:
+        account.api.access_token = f"token_{account.name}"
+    monkeypatch.setattr("app.async_upstream.pool", pool)
+    monkeypatch.setitem(config._data, "response_cache", {"enabled": True, "ttl": {"illust_ranking": 60}})
+    monkeypatch.setitem(config._data, "load_balance", {"strategy": "round_robin"})
+    response_cache.response_cache.purge(prefix="")
+    key_manager.load_from_config([
+        {"name": "test", "key": "pk_test"},
+        {"name": "only_b", "key": "pk_b", "pool_restriction": {"mode": "specific", "allowed_accounts": ["b"]}},
+    ])
+    return pool.accounts
+
+
+@pytest.fixture
+def client():
+    return FakeClient()
+
+
+@pytest.fixture
+def app(accounts, client):
+    wsgi = Flask(__name__)
+
+    @wsgi.route("/ui/echo", methods=["POST"])
+    def echo():
+        return jsonify({"body": flask_request.get_json(), "header": flask_request.headers.get("X-Test")})
+
+    @wsgi.route("/api/ranking")
+    def ranking():
+        return "flask", 200
+
+    return AsgiApp(wsgi, AsyncUpstream(client_factory=lambda proxy: client, select_workers=2), wsgi_workers=2)
+
+
+async def call(app, path, query="", headers=None, method="GET", body=b""):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http", "method": method, "path": path, "query_string": query.encode("utf-8"),
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in (headers or {}).items()],
+        "http_version": "1.1", "scheme": "http", "server": ("testserver", 80), "client": ("127.0.0.1", 1),
+    }
+    await app(scope, receive, send)
+    start = messages[0]
+    return start["status"], dict(start["headers"]), b"".join(m.get("body", b"") for m in messages[1:])
+
+
+def get(app, path, query="", key="pk_test"):
+    return asyncio.run(call(app, path, query, {"Authorization": f"Bearer {key}"}))
+
+
+class TestBuildRequest:
+    """测试由 pixivpy3 方法生成请求"""
+
+    def test_ranking(self, accounts):
+        """测试 URL、参数与鉴权头"""
+        request = build_request(accounts[0].api, "illust_ranking", mode="week", offset=30)
+        assert request.method == "GET"
+        assert request.url == "https://app-api.pixiv.net/v1/illust/ranking"
+        assert request.params == {"mode": "week", "filter": "for_ios", "offset": 30}
+        assert request.headers["Authorization"] == "Bearer token_a"
+
+
+class TestNativeRoutes:
+    """测试事件循环中处理的接口"""
+
+    def test_ranking_and_cache(self, app, client):
+        """测试异步获取、原样返回上游响应并写入共享的响应缓存"""
+        status, headers, body = get(app, "/api/ranking", "mode=day")
+        assert status == 200
+        assert headers[b"x-cache"] == b"MISS"
+        assert json.loads(body)["illusts"][0]["id"] == 1
+        assert client.requests[0][3] == {"mode": "day", "filter": "for_ios"}
+        status, headers, _ = get(app, "/api/ranking", "mode=day")
+        assert headers[b"x-cache"] == b"HIT"
+        assert len(client.requests) == 1
+
+    def test_auth(self, app, client):
+        """测试 API Key 校验"""
+        assert get(app, "/api/ranking", key="pk_wrong")[0] == 401
+        assert not client.requests
+
+    def test_failover_and_scope(self, app, client, accounts):
+        """测试限流时换账号重试，Key 的账号限制同样适用"""
+        client.rate_limited.add("token_a")
+        for _ in range(2):
+            response_cache.response_cache.purge(prefix="")
+            status, _, body = get(app, "/api/ranking")
+            assert status == 200 and json.loads(body)["token"] == "token_b"
+        status, _, body = get(app, "/api/illust/5", key="pk_b")
+        assert json.loads(body)["token"] == "token_b"
+
+    def test_concurrent_calls_coalesced(self, app, client, monkeypatch):
+        """测试相同的并发请求只发送一次上游请求，不同请求并发执行"""
+        monkeypatch.setitem(config._data, "response_cache", {"enabled": False})
+
+        async def run():
+            paths = ["/api/illust/1"] * 20 + [f"/api/user/{i}" for i in range(20)]
+            return await asyncio.gather(*(call(app, p, headers={"Authorization": "Bearer pk_test"}) for p in paths))
+
+        start = time.time()
+        results = asyncio.run(run())
+        assert all(status == 200 for status, _, _ in results)
+        assert len(client.requests) == 21
+        assert time.time() - start < 0.05 * 21 / 2
+
+    def test_fields(self, app):
+        """测试 ?fields= 投影"""
+        _, _, body = get(app, "/api/ranking", "fields=id,title")
+        assert json.loads(body)["illusts"] == [{"id": 1, "title": "t"}]
+
+    def test_server_timing(self, app, monkeypatch, capsys):
+        """测试抽中的请求带 Server-Timing 头并输出访问日志"""
+        monkeypatch.setitem(config._data, "timing", {"sample_rate": 1})
+        _, headers, _ = get(app, "/api/ranking")
+        names = [part.split(";")[0] for part in headers[b"server-timing"].decode().split(", ")]
+        assert names == ["auth", "key", "upstream", "serialize", "total"]
+        line = [l for l in capsys.readouterr().out.splitlines() if l.startswith("[Access] ")][-1]
+        record = json.loads(line[len("[Access] "):])
+        assert record["route"] == "/api/ranking" and record["cache"] == "MISS"
+        assert "send" in record["phases"]
+
+
+class TestWsgiFallback:
+    """测试转交 Flask 处理的请求"""
+
+    def test_other_routes(self, app):
+        """测试请求体与请求头传给 WSGI 应用"""
+        status, headers, body = asyncio.run(call(
+            app, "/ui/echo", method="POST", body=b'{"x": 1}',
+            headers={"Content-Type": "application/json", "X-Test": "yes"}))
+        assert status == 200
+        assert json.loads(body) == {"body": {"x": 1}, "header": "yes"}
+
+    def test_ndjson_pagination(self, app, client):
+        """测试 ?pages= 的流式翻页交给 Flask"""
+        status, _, body = get(app, "/api/ranking", "pages=2")
+        assert (status, body) == (200, b"flask")
+        assert not client.requests
+
+    def test_lifespan_closes_client(self, app, client):
+        """测试关闭时释放异步客户端"""
+        get(app, "/api/ranking")
+        messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message["type"])
+
+        asyncio.run(app({"type": "lifespan"}, receive, send))
+        assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+        assert client.closed
@@ -0,0 +1,138 @@
+"""
+批量接口单元测试（账号 API 使用桩对象，不访问 Pixiv）
+"""
+import pytest
+import sys
+import os
+import threading
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import config
+from app.key_manager import key_manager
+
+from conftest import make_account
+
+NOT_FOUND = {"error": {"message": "", "user_message": "Work has been deleted or the ID does not exist.", "reason": ""}}
+
+
+class Concurrency:
+    """记录同时进行的上游调用数及其峰值"""
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def __exit__(self, *exc):
+        with self.lock:
+            self.active -= 1
+
+
+def illust_detail(name, concurrency):
+    """ID 为 0 时返回不存在，ID 为 -1 时抛出异常"""
+    def call(illust_id):
+        with concurrency:
+            time.sleep(0.05)
+            if illust_id == 0:
+                return NOT_FOUND
+            if illust_id == -1:
+                raise ValueError("bug")
+            return {"illust": {"id": illust_id, "account": name}}
+    return call
+
+
+@pytest.fixture
+def concurrency():
+    return Concurrency()
+
+
+@pytest.fixture
+def accounts(pool, monkeypatch, concurrency):
+    pool.accounts = [
+        make_account(name, illust_detail=illust_detail(name, concurrency),
+                     user_detail=lambda user_id: {"user": {"id": user_id}})
+        for name in ("a", "b")
+    ]
+    monkeypatch.setitem(config._data, "response_cache", {"enabled": False})
+    monkeypatch.setitem(config._data, "batch", {"max_items": 20, "max_workers": 4})
+    return pool.accounts
+
+
+@pytest.fixture
+def client(api_app, accounts):
+    key_manager.load_from_config([
+        {"name": "all", "key": "pk_all"},
+        {"name": "only_a", "key": "pk_a", "pool_restriction": {"mode": "specific", "allowed_accounts": ["a"]}},
+        {"name": "batch_only", "key": "pk_batch", "access_mode": "whitelist",
+         "allowed_endpoints": ["/api/illusts/batch"]},
+    ])
+    return api_app.test_client()
+
+
+def post(client, path, ids, key="pk_all"):
+    return client.post(path, json={"ids": ids}, headers={"Authorization": f"Bearer {key}"})
+
+
+class TestBatch:
+    """测试批量获取"""
+
+    def test_ordered_results_and_errors(self, client):
+        """测试结果按请求顺序返回，单条错误不影响其他条目"""
+        ids = [5, 0, 3, -1, 1]
+        response = post(client, "/api/illusts/batch", ids)
+        assert response.status_code == 200
+        results = response.get_json()["results"]
+        assert [r["id"] for r in results] == ids
+        assert [r["status"] for r in results] == [200, 404, 200, 500, 200]
+        assert results[0]["data"]["illust"]["id"] == 5
+        assert "error" in results[1] and "error" in results[3]
+
+    def test_bounded_parallel(self, client, accounts, concurrency):
+        """测试并发执行、分散到多个账号且不超过 max_workers"""
+        start = time.time()
+        response = post(client, "/api/illusts/batch", list(range(1, 17)))
+        assert response.status_code == 200
+        assert time.time() - start < 0.05 * 16 / 2
+        assert 1 < concurrency.peak <= 4
+        assert accounts[0].api.calls and accounts[1].api.calls
+
+    def test_pool_restriction(self, client, accounts):
+        """测试 Key 的账号限制同样适用"""
+        results = post(client, "/api/illusts/batch", [1, 2, 3], key="pk_a").get_json()["results"]
+        assert {r["data"]["illust"]["account"] for r in results} == {"a"}
+        assert not accounts[1].api.calls
+
+    def test_item_endpoint_access(self, client):
+        """测试不能访问单条接口的 Key 也不能批量获取"""
+        assert post(client, "/api/illusts/batch", [1], key="pk_batch").status_code == 403
+
+    def test_validation(self, client):
+        """测试参数校验与数量上限"""
+        assert post(client, "/api/illusts/batch", []).status_code == 400
+        assert post(client, "/api/illusts/batch", ["x"]).status_code == 400
+        assert post(client, "/api/illusts/batch", list(range(21))).status_code == 400
+
+    @pytest.mark.parametrize("bad", [True, 1.9, 2.0, "12", None, [1]])
+    def test_non_integer_ids_rejected(self, client, accounts, bad):
+        """测试布尔、浮点和数字字符串都不会被当作 ID 转换"""
+        response = post(client, "/api/illusts/batch", [1, bad])
+        assert response.status_code == 400
+        assert response.get_json()["error"] == "ids must be integers"
+        assert not any(a.api.calls for a in accounts)
+
+    def test_users(self, client):
+        """测试批量获取用户"""
+        results = post(client, "/api/users/batch", [7, 8]).get_json()["results"]
+        assert [r["data"]["user"]["id"] for r in results] == [7, 8]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
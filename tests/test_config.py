@@ -0,0 +1,164 @@
+"""
+Config 持久化单元测试
+"""
+import pytest
+import sys
+import os
+import shutil
+import threading
+import yaml
+
+# 添加项目根目录到路径
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.config import Config
+
+
+@pytest.fixture
+def cfg(tmp_path, monkeypatch):
+    """创建指向临时文件的 Config 实例"""
+    path = tmp_path / "config.yaml"
+    shutil.copy(os.path.join(ROOT, "config.yaml.example"), path)
+    monkeypatch.setenv("CONFIG_PATH", str(path))
+    monkeypatch.setattr(Config, "_instance", None)
+    c = Config()
+    writes = []
+    original_replace = os.replace
+    monkeypatch.setattr(os, "replace", lambda src, dst: (writes.append(dst), original_replace(src, dst)))
+    c.writes = writes
+    yield c
+    c.flush()
+
+
+def read_file(c):
+    with open(c._config_path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+
+class TestSave:
+    """测试合并写入与原子替换"""
+
+    def test_save_is_deferred(self, cfg):
+        """测试 save 不立即写文件，flush 后写入"""
+        cfg.add_account("a", "token_a")
+        assert cfg.writes == []
+        cfg.flush()
+        assert len(cfg.writes) == 1
+        assert read_file(cfg)["pixiv_accounts"][0]["name"] == "a"
+
+    def test_saves_are_coalesced(self, cfg):
+        """测试窗口内多次修改只写一次"""
+        for i in range(20):
+            cfg.add_account(f"acc{i}", f"token{i}")
+        cfg.set_proxy(True, "http://127.0.0.1:7890")
+        cfg.flush()
+        assert len(cfg.writes) == 1
+        data = read_file(cfg)
+        assert len(data["pixiv_accounts"]) == 20
+        assert data["proxy"]["enabled"] is True
+
+    def test_timer_flushes(self, cfg, monkeypatch):
+        """测试不调用 flush 时也会在延迟后写入"""
+        done = threading.Event()
+        original_flush = cfg.flush
+        monkeypatch.setattr(cfg, "flush", lambda: (original_flush(), done.set()))
+        cfg.add_api_key({"name": "k", "key": "pk_x"})
+        assert done.wait(timeout=Config.SAVE_DELAY + 2)
+        assert read_file(cfg)["api_keys"][0]["name"] == "k"
+
+    def test_flush_without_changes(self, cfg):
+        """测试没有修改时 flush 不写文件"""
+        cfg.flush()
+        assert cfg.writes == []
+
+    def test_no_temp_files_left(self, cfg):
+        """测试写入后不残留临时文件"""
+        cfg.add_account("a", "token_a")
+        cfg.flush()
+        directory = os.path.dirname(cfg._config_path)
+        assert os.listdir(directory) == ["config.yaml"]
+
+    def test_concurrent_writers(self, cfg):
+        """测试并发修改全部保留，文件始终是合法 YAML"""
+        def worker(n):
+            for i in range(10):
+                cfg.add_account(f"w{n}_{i}", "t")
+                cfg.flush()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(read_file(cfg)["pixiv_accounts"]) == 40
+
+    def test_reload_keeps_pending_changes(self, cfg):
+        """测试 reload 前先写入待保存的修改"""
+        cfg.add_account("a", "token_a")
+        cfg.reload()
+        assert [acc["name"] for acc in cfg.pixiv_accounts] == ["a"]
+
+
+def edit_file(c, **sections):
+    """模拟外部编辑配置文件"""
+    data = read_file(c)
+    data.update(sections)
+    with open(c._config_path, "w", encoding="utf-8") as f:
+        yaml.dump(data, f, allow_unicode=True, sort_keys=False)
+
+
+class TestExternalEdit:
+    """测试修改待写入期间文件被外部编辑"""
+
+    def test_merged_with_pending_save(self, cfg):
+        """测试外部修改与本地修改位于不同配置项时都保留，并通知重载"""
+        reloaded = []
+        cfg.add_reload_listener(lambda: reloaded.append(True))
+        cfg.add_account("a", "token_a")
+        edit_file(cfg, server={"host": "0.0.0.0", "port": 9000})
+        cfg.flush()
+        data = read_file(cfg)
+        assert data["server"]["port"] == 9000
+        assert [acc["name"] for acc in data["pixiv_accounts"]] == ["a"]
+        assert cfg.server["port"] == 9000
+        assert reloaded == [True]
+
+    def test_accounts_merged_per_entry(self, cfg):
+        """测试本地与外部各自添加的账号、API Key 都保留"""
+        cfg.add_account("a", "token_a")
+        cfg.add_api_key({"name": "mine", "key": "pk_mine"})
+        edit_file(cfg, pixiv_accounts=[{"name": "external", "refresh_token": "t"}],
+                  api_keys=[{"name": "theirs", "key": "pk_theirs"}])
+        cfg.reload()
+        data = read_file(cfg)
+        assert [acc["name"] for acc in data["pixiv_accounts"]] == ["external", "a"]
+        assert [k["key"] for k in data["api_keys"]] == ["pk_theirs", "pk_mine"]
+        assert not cfg._dirty
+
+    def test_conflict_keeps_local(self, cfg, capsys):
+        """测试双方修改同一账号的同一字段时保留本进程的值（刷新后的 token）并输出冲突日志"""
+        cfg.add_account("a", "token_old")
+        cfg.flush()
+        cfg.add_account("a", "token_rotated")
+        edit_file(cfg, pixiv_accounts=[{"name": "a", "refresh_token": "token_edited", "enabled": False}])
+        cfg.flush()
+        account, = read_file(cfg)["pixiv_accounts"]
+        assert account == {"name": "a", "refresh_token": "token_rotated", "enabled": False}
+        assert "pixiv_accounts[a].refresh_token" in capsys.readouterr().out
+
+    def test_local_removal_merged(self, cfg):
+        """测试本地删除的账号不会被外部对其他配置项的修改恢复"""
+        cfg.add_account("a", "token_a")
+        cfg.add_account("b", "token_b")
+        cfg.flush()
+        cfg.remove_account("a")
+        edit_file(cfg, server={"host": "0.0.0.0", "port": 9000})
+        cfg.flush()
+        data = read_file(cfg)
+        assert [acc["name"] for acc in data["pixiv_accounts"]] == ["b"]
+        assert data["server"]["port"] == 9000
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
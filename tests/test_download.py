@@ -0,0 +1,203 @@
+"""
+/api/download 流式转发单元测试（上游响应使用内存数据构造，不访问 Pixiv）
+"""
+import pytest
+import sys
+import os
+import io
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from urllib3.response import HTTPResponse
+
+from app import upstream, image_cache
+from app.config import config
+
+from conftest import make_account
+
+IMAGE = bytes(range(256)) * 1024  # 256 KB
+URL = "https://i.pximg.net/img-original/img/2024/01/01/00/00/00/123_p0.png"
+AUTH = {"Authorization": "Bearer pk_test"}
+
+
+def make_response(status, body, headers):
+    response = requests.Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response.raw = HTTPResponse(body=io.BytesIO(body), headers=headers, status=status, preload_content=False)
+    return response
+
+
+class StubImageAPI:
+    """按 Range 请求头返回完整或部分图片的上游桩"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.requests = []
+
+    def requests_call(self, method, url, headers=None, params=None, data=None, stream=False):
+        self.requests.append(dict(headers or {}))
+        if self.error is not None:
+            raise self.error
+        if url.endswith("missing.png"):
+            return make_response(404, b"", {})
+        range_header = (headers or {}).get("Range")
+        if range_header:
+            start, end = range_header[len("bytes="):].split("-")
+            body = IMAGE[int(start):int(end) + 1]
+            return make_response(206, body, {
+                "Content-Type": "image/png", "Content-Length": str(len(body)),
+                "Content-Range": f"bytes {start}-{end}/{len(IMAGE)}",
+            })
+        return make_response(200, IMAGE, {"Content-Type": "image/png", "Content-Length": str(len(IMAGE))})
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """默认关闭磁盘缓存；需要缓存的测试请求 cache_dir 后使用临时目录"""
+    monkeypatch.setattr(image_cache, "_cache", None)
+    monkeypatch.setitem(config._data, "image_cache", {"enabled": True, "dir": str(tmp_path / "images")})
+    return tmp_path / "images"
+
+
+@pytest.fixture(autouse=True)
+def no_cache(monkeypatch):
+    monkeypatch.setattr(image_cache, "_cache", None)
+    monkeypatch.setitem(config._data, "image_cache", {"enabled": False})
+
+
+@pytest.fixture
+def client(api_app):
+    return api_app.test_client()
+
+
+class TestDownload:
+    """测试下载流式转发"""
+
+    def test_stream_passthrough(self, pool, client):
+        """测试透传内容与 Content-Type / Content-Length，读完后释放账号"""
+        account = make_account("a", StubImageAPI())
+        account.max_inflight = 1
+        pool.accounts = [account]
+        response = client.get("/api/download", query_string={"url": URL}, headers=AUTH)
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == "image/png"
+        assert response.headers["Content-Length"] == str(len(IMAGE))
+        assert response.data == IMAGE
+        assert account.api.requests[0]["Referer"] == upstream.DOWNLOAD_REFERER
+        assert account.inflight == 0
+
+    def test_range(self, pool, client):
+        """测试 Range 请求转发给上游并返回 206"""
+        pool.accounts = [make_account("a", StubImageAPI())]
+        response = client.get("/api/download", query_string={"url": URL},
+                              headers={**AUTH, "Range": "bytes=100-199"})
+        assert response.status_code == 206
+        assert response.headers["Content-Range"] == f"bytes 100-199/{len(IMAGE)}"
+        assert response.data == IMAGE[100:200]
+
+    def test_chunked(self, pool, client):
+        """测试响应按固定大小分块产生，而非一次性读入内存"""
+        pool.accounts = [make_account("a", StubImageAPI())]
+        response = client.get("/api/download", query_string={"url": URL}, headers=AUTH, buffered=False)
+        chunks = list(response.response)
+        response.close()
+        assert len(chunks) == len(IMAGE) // upstream.CHUNK_SIZE
+        assert max(len(c) for c in chunks) <= upstream.CHUNK_SIZE
+
+    def test_slot_released_before_body(self, pool, client):
+        """测试响应头返回后即释放账号并发名额，客户端未读完时账号仍可用于其他请求"""
+        account = make_account("a", StubImageAPI())
+        account.max_inflight = 1
+        pool.accounts = [account]
+        response = client.get("/api/download", query_string={"url": URL}, headers=AUTH, buffered=False)
+        assert response.status_code == 200
+        assert account.inflight == 0
+        assert pool.get_account() is account
+        pool.release(account)
+        response.close()
+
+    def test_upstream_not_found(self, pool, client):
+        """测试上游 404 返回 JSON 错误并释放账号"""
+        account = make_account("a", StubImageAPI())
+        pool.accounts = [account]
+        response = client.get("/api/download", query_string={"url": URL.replace("123_p0", "missing")}, headers=AUTH)
+        assert response.status_code == 404
+        assert "error" in response.get_json()
+        assert account.inflight == 0
+
+    def test_network_error_failover(self, pool, client):
+        """测试连接失败时换账号重试"""
+        from pixivpy3 import PixivError
+        broken = make_account("broken", StubImageAPI(PixivError("requests GET error: timeout")))
+        healthy = make_account("healthy", StubImageAPI())
+        pool.accounts = [broken, healthy]
+        response = client.get("/api/download", query_string={"url": URL, "lb": "round_robin"}, headers=AUTH)
+        assert response.status_code == 200
+        assert len(healthy.api.requests) == 1
+
+
+class TestCachedDownload:
+    """测试经磁盘缓存的下载"""
+
+    def test_hit_after_miss(self, pool, client, cache_dir):
+        """测试第二次请求不再访问上游，并返回强 ETag 与长期缓存头"""
+        account = make_account("a", StubImageAPI())
+        pool.accounts = [account]
+        first = client.get("/api/download", query_string={"url": URL}, headers=AUTH)
+        second = client.get("/api/download", query_string={"url": URL.replace("i.pximg.net", "i-f.pximg.net")},
+                            headers=AUTH)
+        assert first.data == second.data == IMAGE
+        assert len(account.api.requests) == 1
+        assert second.headers["Content-Type"] == "image/png"
+        assert not second.headers["ETag"].startswith("W/")
+        assert "max-age=31536000" in second.headers["Cache-Control"]
+        cache = image_cache.get_image_cache()
+        assert cache.stats()["misses"] == 1
+        assert cache.stats()["hits"] + cache.hot_tier.stats()["hits"] == 1
+
+    def test_if_none_match(self, pool, client, cache_dir):
+        """测试 If-None-Match 命中时返回 304"""
+        pool.accounts = [make_account("a", StubImageAPI())]
+        etag = client.get("/api/download", query_string={"url": URL}, headers=AUTH).headers["ETag"]
+        response = client.get("/api/download", query_string={"url": URL}, headers={**AUTH, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.data == b""
+
+    def test_range_from_cache(self, pool, client, cache_dir, monkeypatch):
+        """测试缓存文件与内存热点层都支持 Range"""
+        for memory in (False, True):
+            monkeypatch.setattr(image_cache, "_cache", None)
+            config._data["image_cache"]["memory"] = {"enabled": memory}
+            pool.accounts = [make_account("a", StubImageAPI())]
+            response = client.get("/api/download", query_string={"url": URL}, headers={**AUTH, "Range": "bytes=0-9"})
+            assert response.status_code == 206
+            assert response.data == IMAGE[:10]
+            assert (image_cache.get_image_cache().hot_tier is not None) == memory
+
+    def test_memory_tier_serves(self, pool, client, cache_dir):
+        """测试小图从内存层返回，304 同样生效"""
+        pool.accounts = [make_account("a", StubImageAPI())]
+        etag = client.get("/api/download", query_string={"url": URL}, headers=AUTH).headers["ETag"]
+        cache = image_cache.get_image_cache()
+        for entry in list(cache._entries.values()):
+            os.remove(entry.path)  # 删除磁盘文件，确认由内存层返回
+        response = client.get("/api/download", query_string={"url": URL}, headers=AUTH)
+        assert response.data == IMAGE
+        assert response.headers["ETag"] == etag
+        response = client.get("/api/download", query_string={"url": URL}, headers={**AUTH, "If-None-Match": etag})
+        assert response.status_code == 304
+
+    def test_not_found_not_cached(self, pool, client, cache_dir):
+        """测试上游错误不写入缓存"""
+        pool.accounts = [make_account("a", StubImageAPI())]
+        url = URL.replace("123_p0", "missing")
+        assert client.get("/api/download", query_string={"url": url}, headers=AUTH).status_code == 404
+        assert image_cache.get_image_cache().stats()["entries"] == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,89 @@
+"""
+内存热点层（TinyLFU 准入）单元测试
+"""
+import pytest
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.hot_tier import FrequencySketch, HotTier
+
+
+class TestFrequencySketch:
+    """测试频率估算"""
+
+    def test_estimate(self):
+        """测试计数不低于真实访问次数且有上限"""
+        sketch = FrequencySketch(1024)
+        for _ in range(5):
+            sketch.increment("hot")
+        sketch.increment("cold")
+        assert sketch.estimate("hot") >= 5
+        assert sketch.estimate("hot") > sketch.estimate("cold")
+        for _ in range(100):
+            sketch.increment("hot")
+        assert sketch.estimate("hot") <= FrequencySketch.MAX_COUNT
+
+    def test_aging(self):
+        """测试达到采样数后计数减半"""
+        sketch = FrequencySketch(16)
+        for _ in range(8):
+            sketch.increment("a")
+        before = sketch.estimate("a")
+        for i in range(sketch.sample_size):
+            sketch.increment(f"k{i}")
+        assert sketch.estimate("a") < before
+
+
+class TestHotTier:
+    """测试字节预算与准入"""
+
+    def test_budget(self):
+        """测试总字节数不超过预算，超大对象直接跳过"""
+        tier = HotTier(max_bytes=100, max_object_size=60)
+        assert not tier.put("big", b"x", 61)
+        for i in range(5):
+            tier.get(f"k{i}")
+            tier.get(f"k{i}")
+            tier.put(f"k{i}", b"x", 40)
+        assert tier.size <= 100
+
+    def test_one_off_does_not_evict_hot(self):
+        """测试只访问一次的对象无法挤掉高频对象"""
+        tier = HotTier(max_bytes=100, max_object_size=100)
+        for _ in range(5):
+            tier.get("thumb")
+        assert tier.put("thumb", b"t", 80)
+        tier.get("original")
+        assert not tier.put("original", b"o", 80)
+        assert tier.get("thumb") == b"t"
+        assert tier.stats()["rejected"] == 1
+
+    def test_frequent_newcomer_admitted(self):
+        """测试访问频率更高的新对象替换冷对象"""
+        tier = HotTier(max_bytes=100, max_object_size=100)
+        tier.get("cold")
+        assert tier.put("cold", b"c", 80)
+        for _ in range(3):
+            tier.get("hot")
+        assert tier.put("hot", b"h", 80)
+        assert tier.get("cold") is None
+        assert tier.stats()["evictions"] == 1
+
+    def test_would_admit(self):
+        """测试准入预判与写入结果一致且不修改缓存"""
+        tier = HotTier(max_bytes=100, max_object_size=100)
+        for _ in range(5):
+            tier.get("thumb")
+        tier.put("thumb", b"t", 80)
+        tier.get("original")
+        assert not tier.would_admit("original", 80)
+        assert tier.would_admit("original", 20)
+        assert not tier.would_admit("huge", 101)
+        assert tier.stats()["rejected"] == 0 and tier.size == 80
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,221 @@
+"""
+图片磁盘缓存单元测试
+"""
+import pytest
+import sys
+import os
+import threading
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import image_cache
+from app.hot_tier import HotTier
+from app.image_cache import ImageCache, FetchError, normalize_url
+
+URL = "https://i.pximg.net/img-original/img/2024/01/01/00/00/00/{}_p0.png"
+
+
+def writer(data, content_type="image/png"):
+    def download(f):
+        f.write(data)
+        return content_type
+    return download
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ImageCache(str(tmp_path), max_size=1000, max_age=0)
+
+
+class TestNormalize:
+    """测试 URL 规范化"""
+
+    def test_mirror_hosts(self):
+        """测试镜像域名、http 与查询参数规范化为同一 URL"""
+        expected = URL.format(1)
+        assert normalize_url(expected) == expected
+        assert normalize_url(URL.format(1).replace("https://i.pximg.net", "http://i-cf.pximg.net") + "?x=1") == expected
+
+    def test_non_pximg(self):
+        """测试非 pximg URL 不缓存"""
+        assert normalize_url("https://example.com/a.png") is None
+        assert normalize_url("ftp://i.pximg.net/a.png") is None
+
+
+class TestImageCache:
+    """测试缓存读写与淘汰"""
+
+    def test_store_and_hit(self, cache):
+        """测试写入后命中，ETag 为内容哈希"""
+        entry = cache.fetch(URL.format(1), writer(b"x" * 100))
+        assert cache.fetch(URL.format(1), lambda f: pytest.fail("should hit")) == entry
+        assert entry.size == 100
+        assert len(entry.etag) == 64
+        with open(entry.path, "rb") as f:
+            assert f.read() == b"x" * 100
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_lru_eviction(self, cache):
+        """测试超过总大小时淘汰最久未使用的条目"""
+        for i in range(3):
+            cache.fetch(URL.format(i), writer(b"x" * 400))
+        assert cache.get(cache_key_for(0)) is None
+        assert cache.total_size == 800
+        # 访问 1 后再写入，应淘汰 2
+        cache.get(cache_key_for(1))
+        cache.fetch(URL.format(3), writer(b"x" * 400))
+        assert cache.get(cache_key_for(2)) is None
+        assert cache.get(cache_key_for(1)) is not None
+        assert cache.evictions == 2
+
+    def test_max_age(self, tmp_path):
+        """测试过期条目重新下载"""
+        cache = ImageCache(str(tmp_path), max_size=1000, max_age=0.05)
+        cache.fetch(URL.format(1), writer(b"old"))
+        time.sleep(0.1)
+        entry = cache.fetch(URL.format(1), writer(b"new!"))
+        assert entry.size == 4
+        assert cache.misses == 2
+
+    def test_expired_removed_on_scan(self, tmp_path):
+        """测试重启时过期条目连同文件一起删除，不计入索引"""
+        cache = ImageCache(str(tmp_path), max_size=1000, max_age=0)
+        cache.fetch(URL.format(1), writer(b"old"))
+        time.sleep(0.1)
+        cache.fetch(URL.format(2), writer(b"new"))
+        restored = ImageCache(str(tmp_path), max_size=1000, max_age=0.05)
+        assert list(restored._entries) == [cache_key_for(2)]
+        assert restored.total_size == 3
+        assert not any(os.path.exists(path) for path in restored._paths(cache_key_for(1)))
+
+    def test_expired_swept_on_store(self, tmp_path, monkeypatch):
+        """测试写入时清理从未再被访问的过期条目"""
+        monkeypatch.setattr(image_cache, "SWEEP_INTERVAL", 0)
+        cache = ImageCache(str(tmp_path), max_size=1000, max_age=0.05)
+        cache.fetch(URL.format(1), writer(b"old"))
+        time.sleep(0.1)
+        cache.fetch(URL.format(2), writer(b"new"))
+        assert list(cache._entries) == [cache_key_for(2)]
+        assert cache.total_size == 3
+        assert not os.path.exists(cache._paths(cache_key_for(1))[0])
+
+    def test_expired_dropped_before_lru_eviction(self, tmp_path):
+        """测试超出上限时先删除过期条目，而不是淘汰未过期的条目"""
+        cache = ImageCache(str(tmp_path), max_size=1000, max_age=0.2)
+        cache.fetch(URL.format(1), writer(b"x" * 400))
+        time.sleep(0.15)
+        cache.fetch(URL.format(2), writer(b"x" * 400))
+        cache.get(cache_key_for(1))  # 条目 1 最近被访问，但即将过期
+        time.sleep(0.1)
+        cache.fetch(URL.format(3), writer(b"x" * 400))
+        assert list(cache._entries) == [cache_key_for(2), cache_key_for(3)]
+        assert cache.evictions == 0
+
+    def test_concurrent_fetches_deduplicated(self, cache):
+        """测试并发未命中只下载一次"""
+        calls = []
+        release = threading.Event()
+
+        def slow_download(f):
+            calls.append(1)
+            release.wait()
+            f.write(b"data")
+            return "image/png"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.fetch(URL.format(1), slow_download)))
+                   for _ in range(5)]
+        for t in threads:
+            t.start()
+        time.sleep(0.1)
+        release.set()
+        for t in threads:
+            t.join()
+        assert calls == [1]
+        assert len({r.etag for r in results}) == 1
+        assert cache.stats()["coalesced"] == 4
+
+    def test_failure_not_cached(self, cache, tmp_path):
+        """测试下载失败时不留下文件，错误传给等待者"""
+        def failing(f):
+            f.write(b"partial")
+            raise FetchError(404, "not found")
+
+        with pytest.raises(FetchError):
+            cache.fetch(URL.format(1), failing)
+        assert cache.stats()["entries"] == 0
+        assert all(not files for _, _, files in os.walk(tmp_path))
+
+    def test_rebuild_index(self, cache, tmp_path):
+        """测试重启后从磁盘恢复索引"""
+        entry = cache.fetch(URL.format(1), writer(b"abc"))
+        restored = ImageCache(str(tmp_path), max_size=1000, max_age=0)
+        assert restored.get(entry.key) == entry
+        assert restored.total_size == 3
+
+
+class TestHotTierIntegration:
+    """测试磁盘缓存与内存热点层的配合"""
+
+    @pytest.fixture
+    def hot_cache(self, tmp_path):
+        return ImageCache(str(tmp_path), max_size=1000, max_age=0,
+                          hot_tier=HotTier(max_bytes=500, max_object_size=500))
+
+    def test_rejected_not_read(self, hot_cache, monkeypatch):
+        """测试热点层不会接纳的对象不从磁盘读出"""
+        for _ in range(5):
+            hot_cache.fetch(URL.format(1), writer(b"t" * 400))
+        assert cache_key_for(1) in hot_cache.hot_tier._items
+        reads = []
+        real_open = open
+
+        def counting_open(path, mode="r", *args, **kwargs):
+            if mode == "rb":
+                reads.append(path)
+            return real_open(path, mode, *args, **kwargs)
+
+        monkeypatch.setattr(image_cache, "open", counting_open, raising=False)
+        entry = hot_cache.fetch(URL.format(2), writer(b"o" * 400))
+        assert entry.data is None
+        assert reads == []
+
+    def test_disk_eviction_invalidates(self, hot_cache):
+        """测试磁盘淘汰的条目同时移出热点层"""
+        hot_cache.fetch(URL.format(1), writer(b"a" * 400))
+        assert cache_key_for(1) in hot_cache.hot_tier._items
+        hot_cache.fetch(URL.format(2), writer(b"b" * 400))
+        hot_cache.fetch(URL.format(3), writer(b"c" * 400))
+        assert hot_cache.get(cache_key_for(1)) is None
+        assert cache_key_for(1) not in hot_cache.hot_tier._items
+
+    def test_hot_hits_survive_disk_eviction(self, hot_cache):
+        """测试只在热点层命中的条目仍计入磁盘 LRU，不会被淘汰"""
+        hot_cache.fetch(URL.format(1), writer(b"a" * 300))
+        hot_cache.fetch(URL.format(2), writer(b"b" * 300))
+        assert hot_cache.fetch(URL.format(1), lambda f: pytest.fail("should hit")).data is not None
+        hot_cache.fetch(URL.format(3), writer(b"c" * 500))
+        assert hot_cache.get(cache_key_for(1)) is not None
+        assert hot_cache.get(cache_key_for(2)) is None
+        assert hot_cache.fetch(URL.format(1), lambda f: pytest.fail("should hit")).data == b"a" * 300
+
+    def test_expiry_invalidates(self, tmp_path):
+        """测试磁盘过期的条目同时移出热点层"""
+        cache = ImageCache(str(tmp_path), max_size=1000, max_age=0.05,
+                           hot_tier=HotTier(max_bytes=500, max_object_size=500))
+        cache.fetch(URL.format(1), writer(b"old"))
+        assert cache_key_for(1) in cache.hot_tier._items
+        time.sleep(0.1)
+        assert cache.get(cache_key_for(1)) is None
+        assert cache_key_for(1) not in cache.hot_tier._items
+
+
+def cache_key_for(i):
+    from app.image_cache import cache_key
+    return cache_key(URL.format(i))
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
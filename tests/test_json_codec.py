@@ -0,0 +1,135 @@
+"""
+JSON 透传与序列化单元测试（不访问 Pixiv）
+"""
+import gzip
+import json
+import pytest
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from pixivpy3 import PixivError
+
+from app import upstream, json_codec
+from app.config import config
+from app.json_codec import RawJson
+from app.pool import ProxiedAppPixivAPI
+
+from conftest import make_account
+
+# 故意保留非紧凑格式，透传时应原样返回
+RAW_ILLUST = '{"illust": {"id": 1, "title": "テスト"},   "padding": "%s"}' % ("x" * 2000)
+
+
+def make_response(body: bytes):
+    res = requests.Response()
+    res.status_code = 200
+    res._content = body
+    res.encoding = "utf-8"
+    return res
+
+
+class TestRawJson:
+    """测试延迟解析"""
+
+    def test_lazy_parse(self):
+        """测试只有访问字段时才解析，未解析时 dumps 返回原始字节"""
+        raw = RAW_ILLUST.encode("utf-8")
+        result = RawJson(raw)
+        assert not result.is_parsed
+        assert json_codec.dumps(result) is raw
+        assert result["illust"]["title"] == "テスト"
+        assert result.is_parsed
+        assert json_codec.dumps(result) is raw  # 解析过仍原样返回
+
+    def test_mapping_and_attribute_access(self):
+        """测试作为 Mapping 使用并兼容 JsonDict 的属性访问"""
+        result = RawJson(b'{"next_url": null, "illusts": []}')
+        assert dict(result) == {"next_url": None, "illusts": []}
+        assert result.illusts == []
+        assert result == {"next_url": None, "illusts": []}
+
+    def test_maybe_error(self):
+        """测试根据前缀判断错误响应"""
+        assert RawJson(b' {"error": {"message": "x"}}').maybe_error()
+        assert RawJson(b'{\n  "error" : {"message": "x"}}').maybe_error()
+        assert RawJson(b'{"status": 403, "error": {"message": "x"}}').maybe_error()
+        assert not RawJson(b'{"illust": {}}').maybe_error()
+
+    def test_error_with_whitespace(self):
+        """测试带空白 / 键顺序不同的错误响应仍能识别并触发换账号"""
+        result = RawJson(b'{ "error" : { "message" : "Rate Limit" } }')
+        assert upstream.error_message(result) == "Rate Limit"
+        assert upstream.classify_error(result) == upstream.RATE_LIMIT
+
+    def test_error_message_skips_parse(self):
+        """测试正常响应提取错误信息时不解析"""
+        result = RawJson(b'{"illust": {"id": 1}}')
+        assert upstream.error_message(result) == ""
+        assert not result.is_parsed
+        error = RawJson(b'{"error": {"user_message": "Work has been deleted"}}')
+        assert upstream.error_message(error) == "Work has been deleted"
+
+    def test_dumps_nested(self):
+        """测试嵌套在普通对象中的 RawJson 也能序列化"""
+        data = {"results": [{"id": 1, "data": RawJson(b'{"a": "\xe4\xb8\xad"}')}]}
+        assert json.loads(json_codec.dumps(data)) == {"results": [{"id": 1, "data": {"a": "中"}}]}
+
+
+class TestParseResult:
+    """测试 ProxiedAppPixivAPI 的响应解析"""
+
+    def test_json_body(self):
+        """测试 JSON 响应保留原始字节"""
+        api = ProxiedAppPixivAPI()
+        result = api.parse_result(make_response(b'{"illust": {"id": 1}}'))
+        assert isinstance(result, RawJson)
+        assert result.raw == b'{"illust": {"id": 1}}'
+
+    def test_html_body_raises(self):
+        """测试非 JSON 响应（如 Cloudflare 页面）仍抛出 PixivError 以便换账号"""
+        api = ProxiedAppPixivAPI()
+        with pytest.raises(PixivError):
+            api.parse_result(make_response(b"<html>Just a moment...</html>"))
+
+    def test_passthrough_disabled(self, monkeypatch):
+        """测试关闭透传后使用 pixivpy3 的解析"""
+        monkeypatch.setitem(config._data, "json_response", {"passthrough": False})
+        api = ProxiedAppPixivAPI()
+        result = api.parse_result(make_response(b'{"illust": {"id": 1}}'))
+        assert not isinstance(result, RawJson)
+        assert result.illust.id == 1
+
+
+@pytest.fixture
+def client(api_app, pool, monkeypatch):
+    pool.accounts = [make_account("a", illust_detail=lambda illust_id: RawJson(RAW_ILLUST.encode("utf-8")))]
+    monkeypatch.setitem(config._data, "response_cache", {"enabled": False})
+    return api_app.test_client()
+
+
+class TestRoutes:
+    """测试路由响应"""
+
+    def test_raw_passthrough(self, client):
+        """测试上游响应体原样返回"""
+        response = client.get("/api/illust/1", headers={"Authorization": "Bearer pk_test"})
+        assert response.status_code == 200
+        assert response.mimetype == "application/json"
+        assert response.get_data() == RAW_ILLUST.encode("utf-8")
+
+    def test_gzip(self, client, monkeypatch):
+        """测试开启压缩后按 Accept-Encoding 压缩较大的响应"""
+        monkeypatch.setitem(config._data, "json_response", {"compress": True, "compress_min_bytes": 1024})
+        headers = {"Authorization": "Bearer pk_test", "Accept-Encoding": "gzip"}
+        response = client.get("/api/illust/1", headers=headers)
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "Accept-Encoding" in response.headers["Vary"]
+        assert gzip.decompress(response.get_data()) == RAW_ILLUST.encode("utf-8")
+
+        plain = client.get("/api/illust/1", headers={"Authorization": "Bearer pk_test"})
+        assert "Content-Encoding" not in plain.headers
+        assert plain.get_data() == RAW_ILLUST.encode("utf-8")
@@ -145,6 +145,22 @@ class TestKeyManager:
         key = manager.get_key_by_name("test_key")
         assert key.allowed_endpoints == ["/api/search"]
 
+    def test_update_key_invalid_keeps_original(self, manager):
+        """测试校验失败的更新不会部分生效"""
+        manager.create_key("test_key", access_mode="blacklist")
+        result, _ = manager.update_key("test_key", access_mode="whitelist", pool_mode="invalid")
+        assert result is False
+        assert manager.get_key_by_name("test_key").access_mode == "blacklist"
+
+    def test_load_from_config_rebuilds_index(self, manager):
+        """测试重新加载后按 key 值和名称的索引同步更新"""
+        old, _ = manager.create_key("old_key")
+        manager.load_from_config([{"name": "new_key", "key": "pk_new"}])
+        assert manager.get_key(old.key) is None
+        assert manager.get_key_by_name("old_key") is None
+        assert manager.get_key("pk_new").name == "new_key"
+        assert manager.get_key_by_name("new_key").key == "pk_new"
+
 
 class TestAccessControl:
     """测试访问控制逻辑"""
@@ -236,6 +252,35 @@ class TestAccessControl:
         allowed, error = manager.check_access(key.key, "/api/illust/12345")
         assert allowed is True
 
+    def test_normalize_url_rule(self, manager):
+        """测试 Flask URL 规则规范化为相同的端点"""
+        key, _ = manager.create_key(
+            "test",
+            access_mode="whitelist",
+            allowed_endpoints=["/api/user/<id>/illusts"]
+        )
+        allowed, _ = manager.check_access(key.key, "/api/user/<int:user_id>/illusts")
+        assert allowed is True
+
+    def test_wildcard_requires_prefix(self, manager):
+        """测试通配符只匹配前缀下的路径"""
+        key, _ = manager.create_key(
+            "test",
+            access_mode="blacklist",
+            denied_endpoints=["/api/proxy/*", "/api/pool/status"]
+        )
+        assert manager.check_access(key.key, "/api/proxy")[0] is True
+        assert manager.check_access(key.key, "/api/proxyx/status")[0] is True
+        assert manager.check_access(key.key, "/api/proxy/")[0] is False
+        assert manager.check_access(key.key, "/api/pool/status")[0] is False
+
+    def test_update_recompiles_rules(self, manager):
+        """测试更新端点规则后立即生效"""
+        key, _ = manager.create_key("test", access_mode="blacklist")
+        assert manager.check_access(key.key, "/api/download")[0] is True
+        manager.update_key("test", denied_endpoints=["/api/download"])
+        assert manager.check_access(key.key, "/api/download")[0] is False
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -0,0 +1,154 @@
+"""
+Prometheus 指标单元测试（账号 API 使用桩对象，不访问 Pixiv）
+"""
+import pytest
+import sys
+import os
+import threading
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import metrics, upstream
+from app.config import config
+from app.pool import PixivAccount, PoolBusy
+
+from conftest import make_account
+
+
+def count(histogram, *labels):
+    """直方图某个标签组合的观测次数"""
+    cell = metrics.registry.snapshot().get((histogram, labels))
+    return sum(cell[:-1]) if cell else 0
+
+
+class TestRegistry:
+    """测试计数分片与文本输出"""
+
+    def test_threads_merged(self):
+        """测试多个线程（含已退出的线程）的计数合并后不丢失"""
+        registry = metrics.Registry()
+        counter = metrics.Counter(registry, "test_total", "test", ("kind",))
+
+        def worker():
+            for _ in range(1000):
+                counter.inc("a")
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        counter.inc("b", amount=2)
+        assert registry.snapshot()[(counter, ("a",))] == [4000]
+        assert len(registry._shards) == 1  # 已退出线程的分片并入累计值
+        assert registry.snapshot()[(counter, ("a",))] == [4000]
+
+    def test_histogram_text(self):
+        """测试累计分桶、_sum / _count 与标签转义"""
+        registry = metrics.Registry()
+        histogram = metrics.Histogram(registry, "test_seconds", "test", ("route",), buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, 'a"b')
+        text = registry.render()
+        assert "# TYPE test_seconds histogram" in text
+        assert 'test_seconds_bucket{route="a\\"b",le="0.1"} 2' in text
+        assert 'test_seconds_bucket{route="a\\"b",le="1"} 3' in text
+        assert 'test_seconds_bucket{route="a\\"b",le="+Inf"} 4' in text
+        assert 'test_seconds_sum{route="a\\"b"} 3.65' in text
+        assert 'test_seconds_count{route="a\\"b"} 4' in text
+
+    def test_collected(self):
+        """测试输出时读取的指标，读取失败不影响其他指标"""
+        registry = metrics.Registry()
+        metrics.Collected(registry, "broken", "test", callback=lambda: 1 / 0)
+        metrics.Collected(registry, "test_gauge", "test", ("x",), lambda: [(("1",), 2.5)])
+        assert 'test_gauge{x="1"} 2.5' in registry.render()
+
+
+class TestInstrumentation:
+    """测试请求路径上的记录"""
+
+    def test_request_and_upstream(self, api_app, pool, monkeypatch):
+        """测试按路由模板记录请求，按账号与方法记录上游调用"""
+        monkeypatch.setitem(config._data, "response_cache", {"enabled": False})
+        pool.accounts = [make_account("m1", illust_detail={"illust": {"id": 1}})]
+        metrics.instrument(api_app)
+        route = "/api/illust/<int:illust_id>"
+        before = count(metrics.REQUEST_DURATION, route, "GET", 200)
+        upstream_before = count(metrics.UPSTREAM_DURATION, "m1", "illust_detail", "ok")
+        select_before = count(metrics.ACCOUNT_SELECT)
+
+        response = api_app.test_client().get("/api/illust/1", headers={"Authorization": "Bearer pk_test"})
+        assert response.status_code == 200
+        assert count(metrics.REQUEST_DURATION, route, "GET", 200) == before + 1
+        assert count(metrics.UPSTREAM_DURATION, "m1", "illust_detail", "ok") == upstream_before + 1
+        assert count(metrics.ACCOUNT_SELECT) == select_before + 1
+
+        before = count(metrics.REQUEST_DURATION, route, "GET", 401)
+        api_app.test_client().get("/api/illust/1")
+        assert count(metrics.REQUEST_DURATION, route, "GET", 401) == before + 1
+
+    def test_unhandled_exception_counted(self):
+        """测试抛出未处理异常（异常继续向外传播，不经过 after_request）的请求按 500 记录"""
+        from flask import Flask
+        app = Flask(__name__)
+        app.config["PROPAGATE_EXCEPTIONS"] = True
+
+        @app.route("/boom")
+        def boom():
+            raise RuntimeError("boom")
+
+        metrics.instrument(app)
+        before = count(metrics.REQUEST_DURATION, "/boom", "GET", 500)
+        with pytest.raises(RuntimeError):
+            app.test_client().get("/boom")
+        assert count(metrics.REQUEST_DURATION, "/boom", "GET", 500) == before + 1
+
+    def test_upstream_failure_label(self, pool):
+        """测试限流结果单独计数"""
+        pool.accounts = [make_account("m2", illust_detail={"error": {"message": "Rate Limit"}})]
+        before = count(metrics.UPSTREAM_DURATION, "m2", "illust_detail", upstream.RATE_LIMIT)
+        with pytest.raises(upstream.UpstreamFailed):
+            upstream.call("illust_detail", 1)
+        assert count(metrics.UPSTREAM_DURATION, "m2", "illust_detail", upstream.RATE_LIMIT) == before + 1
+
+    def test_queue_wait(self, pool, monkeypatch):
+        """测试满载排队超时记录等待时间"""
+        monkeypatch.setitem(config._data, "load_balance", {"queue_timeout": 0.05})
+        account = make_account("m3")
+        account.max_inflight = 1
+        pool.accounts = [account]
+        held = pool.get_account()
+        before = count(metrics.QUEUE_WAIT, "timeout")
+        with pytest.raises(PoolBusy):
+            pool.get_account()
+        pool.release(held)
+        assert count(metrics.QUEUE_WAIT, "timeout") == before + 1
+
+    def test_refresh(self, monkeypatch):
+        """测试 token 刷新按结果记录"""
+        account = PixivAccount("m4")
+        monkeypatch.setattr(account, "_refresh", lambda: False)
+        before = count(metrics.TOKEN_REFRESH, "m4", "failed")
+        assert not account.refresh()
+        assert count(metrics.TOKEN_REFRESH, "m4", "failed") == before + 1
+
+    def test_cache_stats_once_per_scrape(self, monkeypatch):
+        """测试一次输出只读取一次缓存统计，且不创建图片缓存"""
+        from app import image_cache
+        from app.response_cache import response_cache
+        calls = []
+        original = response_cache.stats
+        monkeypatch.setattr(response_cache, "stats", lambda: (calls.append(1), original())[1])
+        monkeypatch.setattr(image_cache, "_cache", None)
+        monkeypatch.setattr(image_cache.ImageCache, "from_config", classmethod(lambda cls: pytest.fail("created")))
+        text = metrics.registry.render()
+        assert len(calls) == 1
+        assert 'pixiv_cache_hits_total{cache="image_disk"}' not in text
+
+    def test_render_defaults(self):
+        """测试默认注册表输出缓存命中率与账号指标"""
+        text = metrics.registry.render()
+        assert 'pixiv_cache_hit_ratio{cache="response"}' in text
+        assert "# TYPE pixiv_pool_waiting gauge" in text
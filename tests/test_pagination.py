@@ -0,0 +1,106 @@
+"""
+自动翻页（NDJSON）单元测试（账号 API 使用桩对象，不访问 Pixiv）
+"""
+import pytest
+import sys
+import os
+import json
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import config
+
+from conftest import make_account
+
+PAGE_SIZE = 30
+TOTAL = 100
+
+
+def next_url(word, offset):
+    return f"https://app-api.pixiv.net/v1/search/illust?word={word}&search_target=partial_match_for_tags&offset={offset}"
+
+
+def search_illust(word, offset=0, **kwargs):
+    """按 offset 返回 30 条一页的结果，共 TOTAL 条；word 为 error 时第二页起返回错误"""
+    offset = int(offset)
+    if word == "error":
+        return {"error": {"message": "Rate Limit"}} if offset else {"illusts": [{"id": 0}],
+                                                                     "next_url": next_url(word, PAGE_SIZE)}
+    end = min(offset + PAGE_SIZE, TOTAL)
+    return {
+        "illusts": [{"id": i} for i in range(offset, end)],
+        "next_url": next_url(word, end) if end < TOTAL else None,
+    }
+
+
+def offsets(api):
+    """按调用顺序返回请求过的 offset"""
+    return [int(kwargs.get("offset", args[1] if len(args) > 1 else 0)) for _, args, kwargs in api.calls]
+
+
+@pytest.fixture
+def api(pool, monkeypatch):
+    pool.accounts = [make_account("a", search_illust=search_illust)]
+    monkeypatch.setitem(config._data, "pagination", {"max_pages": 100, "max_items": 1000})
+    monkeypatch.setitem(config._data, "failover", {"max_attempts": 1})
+    return pool.accounts[0].api
+
+
+@pytest.fixture
+def client(api_app, api):
+    return api_app.test_client()
+
+
+def search(client, **params):
+    return client.get("/api/search", query_string={"word": "x", **params},
+                      headers={"Authorization": "Bearer pk_test"}, buffered=False)
+
+
+def lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+class TestPagination:
+    """测试跟随 next_url 翻页"""
+
+    def test_single_page_unchanged(self, client):
+        """测试不带参数时仍返回单页 JSON"""
+        response = search(client)
+        assert response.mimetype == "application/json"
+        assert len(response.get_json()["illusts"]) == PAGE_SIZE
+
+    def test_all_pages(self, client, api):
+        """测试 all=true 时按顺序返回全部作品"""
+        response = search(client, all="true")
+        assert response.mimetype == "application/x-ndjson"
+        assert [item["id"] for item in lines(response)] == list(range(TOTAL))
+        assert offsets(api) == [0, 30, 60, 90]
+
+    def test_pages_limit(self, client, api):
+        """测试 pages=N 只获取 N 页"""
+        assert len(lines(search(client, pages=2))) == 2 * PAGE_SIZE
+        assert offsets(api) == [0, 30]
+
+    def test_item_cap(self, client, monkeypatch):
+        """测试总条数上限"""
+        monkeypatch.setitem(config._data, "pagination", {"max_items": 45})
+        assert len(lines(search(client, all="true"))) == 45
+
+    def test_streams_before_last_page(self, client, api):
+        """测试第一页在后续页面获取之前就已输出"""
+        response = search(client, all="true")
+        first = next(response.response)
+        assert json.loads(first)["id"] == 0
+        assert offsets(api) == [0]
+        response.close()
+
+    def test_error_mid_stream(self, client):
+        """测试翻页中途出错时输出错误行并结束"""
+        items = lines(search(client, word="error", all="true"))
+        assert items[0] == {"id": 0}
+        assert "error" in items[-1]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,359 @@
+"""
+AccountPool 单元测试（不访问 Pixiv，账号状态直接构造）
+"""
+import pytest
+import sys
+import os
+import threading
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import config
+from app.pool import PixivAccount, PoolBusy
+from app.refresher import TokenRefresher
+
+from conftest import make_account
+
+
+class StubRefresher:
+    """记录被触发后台刷新的账号"""
+
+    def __init__(self):
+        self.triggered = []
+
+    def trigger(self, account):
+        self.triggered.append(account.name)
+
+    def schedule(self, account, due=None):
+        pass
+
+
+@pytest.fixture
+def pool(pool):
+    """使用记录后台刷新的调度器"""
+    pool.refresher = StubRefresher()
+    return pool
+
+
+class TestTokenRefresh:
+    """测试 token 刷新不阻塞请求"""
+
+    def test_round_robin_skips_stale(self, pool):
+        """测试轮询跳过过期账号并交给后台刷新"""
+        pool.accounts = [make_account("a", fresh=False), make_account("b")]
+        pool.accounts[0].check_and_refresh = lambda: pytest.fail("should not refresh inline")
+        assert pool.get_account("round_robin").name == "b"
+        assert pool.refresher.triggered == ["a"]
+
+    def test_least_used_prefers_fresh(self, pool):
+        """测试最少使用策略优先选择新鲜账号"""
+        pool.accounts = [make_account("a", fresh=False), make_account("b")]
+        pool.accounts[1].request_count = 10
+        assert pool.get_account("least_used").name == "b"
+
+    def test_all_stale_refreshes_inline(self, pool):
+        """测试没有新鲜账号时同步刷新"""
+        account = make_account("a", fresh=False)
+        calls = []
+        account.check_and_refresh = lambda: calls.append(1)
+        pool.accounts = [account]
+        assert pool.get_account("round_robin") is account
+        assert calls == [1]
+
+    def test_refresh_single_flight(self):
+        """测试并发刷新同一账号只发起一次认证"""
+        account = make_account("a", fresh=False)
+        calls = []
+        started = threading.Event()
+
+        def slow_refresh():
+            calls.append(1)
+            started.set()
+            time.sleep(0.1)
+            return True
+
+        account._refresh = slow_refresh
+        threads = [threading.Thread(target=account.refresh) for _ in range(5)]
+        threads[0].start()
+        started.wait()
+        for t in threads[1:]:
+            t.start()
+        for t in threads:
+            t.join()
+        assert calls == [1]
+
+
+class TestAccountViews:
+    """测试预计算的账号视图"""
+
+    def test_least_used_heap(self, pool):
+        """测试最少使用策略在计数被其他视图修改后仍选出最小值"""
+        accounts = [make_account(f"acc{i}") for i in range(5)]
+        pool.accounts = accounts
+        picks = [pool.get_account("least_used").name for _ in range(10)]
+        assert sorted(picks) == sorted([a.name for a in accounts] * 2)
+        # 通过 specific 视图增加 acc0 的计数，all 视图应惰性修正
+        for _ in range(5):
+            pool.get_account_for_key("specific", frozenset({"acc0"}), "least_used")
+        assert "acc0" not in [pool.get_account("least_used").name for _ in range(4)]
+
+    def test_specific_view(self, pool):
+        """测试 specific 视图只包含允许的账号"""
+        pool.accounts = [make_account(f"acc{i}") for i in range(5)]
+        allowed = frozenset({"acc1", "acc3"})
+        names = {pool.get_account_for_key("specific", allowed, "round_robin").name for _ in range(10)}
+        assert names == {"acc1", "acc3"}
+
+    def test_views_invalidated(self, pool):
+        """测试账号列表变化后视图重建"""
+        pool.accounts = [make_account("a")]
+        assert pool.get_account().name == "a"
+        pool.accounts = [make_account("b")]
+        assert pool.get_account().name == "b"
+
+    def test_exclude(self, pool):
+        """测试排除已尝试的账号"""
+        a, b = make_account("a"), make_account("b")
+        pool.accounts = [a, b]
+        for strategy in ("round_robin", "least_used", "least_latency"):
+            assert pool.get_account(strategy, exclude=[a]) is b
+            assert pool.get_account(strategy, exclude=[a, b]) is None
+
+
+class TestLeastLatency:
+    """测试基于 EWMA 的 least_latency 策略"""
+
+    def test_ewma_update(self):
+        """测试延迟与错误率 EWMA"""
+        account = make_account("a")
+        account.record_upstream(1.0, True)
+        assert account.latency_ewma == 1.0
+        account.record_upstream(2.0, False)
+        assert 1.0 < account.latency_ewma < 2.0
+        assert 0.0 < account.error_rate_ewma < 1.0
+
+    def test_prefers_fast_account(self, pool):
+        """测试两个账号时总是选择评分较低的"""
+        fast, slow = make_account("fast"), make_account("slow")
+        fast.record_upstream(0.1, True)
+        slow.record_upstream(2.0, True)
+        pool.accounts = [fast, slow]
+        picks = set()
+        for _ in range(20):
+            account = pool.get_account("least_latency")
+            picks.add(account.name)
+            pool.release(account)
+        assert picks == {"fast"}
+
+    def test_errors_penalized(self, pool):
+        """测试出错的账号即使延迟更低也会被降权"""
+        flaky, steady = make_account("flaky"), make_account("steady")
+        for _ in range(5):
+            flaky.record_upstream(0.1, False)
+        steady.record_upstream(0.5, True)
+        assert flaky.load_score() > steady.load_score()
+
+    def test_status_reports_stats(self, pool):
+        """测试 status 输出延迟与错误率"""
+        account = make_account("a")
+        account.record_upstream(0.25, True)
+        pool.accounts = [account]
+        status = pool.status()[0]
+        assert status["latency_ms"] == 250.0
+        assert status["error_rate"] == 0.0
+
+
+class TestWeightsAndInflight:
+    """测试加权轮询与并发上限"""
+
+    def test_weighted_round_robin(self, pool):
+        """测试选择次数与权重成正比，且高权重账号不连续扎堆"""
+        heavy, light = make_account("heavy"), make_account("light")
+        heavy.weight = 3
+        pool.accounts = [heavy, light]
+        picks = [pool.get_account("round_robin").name for _ in range(8)]
+        assert picks.count("heavy") == 6
+        assert picks.count("light") == 2
+        view = pool._view()
+        assert view.total_weight == 4
+        assert [view.accounts[view.at(k)].name for k in range(4)] == ["heavy", "light", "heavy", "heavy"]
+
+    def test_weighted_ring_spread(self, pool):
+        """测试大量账号、不同权重时每圈选择次数等于权重，且同一账号的选择间隔分散"""
+        accounts = [make_account(f"w{i}") for i in range(200)]
+        for i, account in enumerate(accounts):
+            account.weight = 1 + i % 10
+        pool.accounts = accounts
+        view = pool._view()
+        picks = [view.at(k) for k in range(view.total_weight)]
+        assert all(picks.count(i) == a.weight for i, a in enumerate(accounts))
+        heaviest = [k for k, i in enumerate(picks) if i == 9]
+        assert max(b - a for a, b in zip(heaviest, heaviest[1:])) < 2 * view.total_weight / 10
+
+    def test_weighted_least_used(self, pool):
+        """测试最少使用策略按 请求数 / 权重 选择"""
+        heavy, light = make_account("heavy"), make_account("light")
+        heavy.weight = 2
+        pool.accounts = [heavy, light]
+        picks = [pool.get_account("least_used").name for _ in range(9)]
+        assert picks.count("heavy") == 6
+
+    def test_skip_saturated(self, pool):
+        """测试跳过并发已满的账号，释放后重新可选"""
+        a, b = make_account("a"), make_account("b")
+        a.max_inflight = 1
+        pool.accounts = [a, b]
+        for strategy in ("round_robin", "least_used", "least_latency"):
+            assert pool.get_account(strategy, exclude=[b]) is a
+            assert a.saturated()
+            assert pool.get_account(strategy) is b
+            pool.release(a)
+            pool.release(b)
+            assert a.inflight == 0
+
+    def test_queue_waits_for_release(self, pool, monkeypatch):
+        """测试全部满载时排队，直到有账号释放名额"""
+        monkeypatch.setitem(config._data, "load_balance", {"queue_timeout": 5})
+        account = make_account("a")
+        account.max_inflight = 1
+        pool.accounts = [account]
+        assert pool.get_account() is account
+        threading.Timer(0.1, pool.release, args=(account,)).start()
+        start = time.time()
+        assert pool.get_account() is account
+        assert 0.05 < time.time() - start < 2
+
+    def test_queue_timeout(self, pool, monkeypatch):
+        """测试排队超时与队列已满时抛出 PoolBusy"""
+        monkeypatch.setitem(config._data, "load_balance", {"queue_timeout": 0.1})
+        account = make_account("a")
+        account.max_inflight = 1
+        pool.accounts = [account]
+        pool.get_account()
+        with pytest.raises(PoolBusy):
+            pool.get_account()
+        monkeypatch.setitem(config._data, "load_balance", {"queue_size": 0})
+        with pytest.raises(PoolBusy):
+            pool.get_account()
+
+    def test_cooldown_not_queued(self, pool):
+        """测试账号都不可用（而非满载）时不排队，直接返回 None"""
+        account = make_account("a")
+        pool.accounts = [account]
+        pool.quarantine(account, 60, "rate_limit")
+        assert pool.get_account() is None
+
+
+class TestParallelStartup:
+    """测试启动时并行认证"""
+
+    @pytest.fixture
+    def slow_auth(self, monkeypatch):
+        """每个账号认证耗时 0.2 秒，名称以 bad 开头的认证失败"""
+        def fake_auth(account, auto_gppt=False):
+            time.sleep(0.2)
+            account.authenticated = not account.name.startswith("bad")
+            account.token_expires_at = time.time() + 3600
+            return account.authenticated
+
+        monkeypatch.setattr(PixivAccount, "auth", fake_auth)
+        monkeypatch.setitem(config._data, "startup", {"auth_workers": 8, "min_ready_accounts": 2})
+
+    def test_load_in_parallel(self, pool, slow_auth, monkeypatch):
+        """测试 8 个账号并行认证，总耗时接近单个账号"""
+        monkeypatch.setitem(config._data, "pixiv_accounts", [{"name": f"acc{i}"} for i in range(8)])
+        start = time.time()
+        pool.load_from_config(wait_ready=True)
+        assert time.time() - start < 1.0
+        assert pool.is_ready()
+
+    def test_ready_threshold(self, pool, slow_auth, monkeypatch):
+        """测试可用账号数未达到 min_ready_accounts 时不就绪"""
+        monkeypatch.setitem(config._data, "pixiv_accounts", [{"name": "acc0"}, {"name": "bad1"}])
+        pool.load_from_config(wait_ready=True)
+        assert pool.pending_auth == 0
+        assert pool.get_available_account_names() == ["acc0"]
+        assert not pool.is_ready()
+
+    def test_names_and_order_follow_config(self, pool, monkeypatch):
+        """测试未命名账号按配置序号命名，账号池顺序与配置一致（与认证完成顺序无关）"""
+        def fake_auth(account, auto_gppt=False):
+            time.sleep(0.2 - 0.04 * account.position)  # 配置中靠后的账号先认证完成
+            account.authenticated = True
+            return True
+
+        monkeypatch.setattr(PixivAccount, "auth", fake_auth)
+        monkeypatch.setitem(config._data, "startup", {"auth_workers": 8, "min_ready_accounts": 5})
+        monkeypatch.setitem(config._data, "pixiv_accounts", [
+            {"refresh_token": "t0"}, {"name": "account_2"}, {"refresh_token": "t2"}, {"refresh_token": "t3"},
+            {"name": "named"}])
+        pool.load_from_config(wait_ready=True)
+        assert [a.name for a in pool.accounts] == ["account_0", "account_2", "account_3", "account_4", "named"]
+
+    def test_auth_timeout_only_during_auth(self, pool, monkeypatch):
+        """测试 auth_timeout 只用于启动认证，认证后使用账号配置的超时"""
+        seen = {}
+
+        def fake_auth(account, auto_gppt=False):
+            seen[account.name] = account.api.requests_kwargs["timeout"]
+            account.authenticated = True
+            return True
+
+        monkeypatch.setattr(PixivAccount, "auth", fake_auth)
+        monkeypatch.setitem(config._data, "startup", {"auth_timeout": 3, "min_ready_accounts": 2})
+        monkeypatch.setitem(config._data, "pixiv_accounts", [{"name": "a"}, {"name": "b", "timeout": 20}])
+        pool.load_from_config(wait_ready=True)
+        assert seen == {"a": 3, "b": 3}
+        timeouts = {a.name: a.api.requests_kwargs["timeout"] for a in pool.accounts}
+        assert timeouts["b"] == 20
+        assert timeouts["a"] != 3
+
+
+class TestTokenRefresher:
+    """测试刷新调度器的计划时间"""
+
+    def test_due_before_expiry(self, pool):
+        """测试计划时间落在过期前的提前量 + 抖动窗口内"""
+        refresher = TokenRefresher(pool, lead_time=300, jitter=120)
+        account = make_account("a")
+        due = refresher._next_due(account)
+        assert account.token_expires_at - 420 <= due <= account.token_expires_at - 300
+
+    def test_reschedule_replaces_previous(self, pool):
+        """测试重复安排时以最新计划为准"""
+        refresher = TokenRefresher(pool)
+        account = make_account("a")
+        refresher.schedule(account, due=time.time() + 1000)
+        refresher.trigger(account)
+        assert refresher._pop_due() is account
+
+    def test_concurrent_triggers_deduplicated(self, pool):
+        """测试重复安排相同时间、并发触发同一账号都只入堆一次"""
+        refresher = TokenRefresher(pool)
+        account = make_account("a")
+        due = time.time() + 1000
+        refresher.schedule(account, due=due)
+        refresher.schedule(account, due=due)
+        assert len(refresher._heap) == 1
+        threads = [threading.Thread(target=lambda: [refresher.trigger(account) for _ in range(50)])
+                   for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(refresher._heap) == 2
+
+    def test_stale_entries_compacted(self, pool):
+        """测试反复重新安排时堆中过期条目不会无限增长"""
+        refresher = TokenRefresher(pool)
+        account = make_account("a")
+        for i in range(1000):
+            refresher.schedule(account, due=time.time() + 1000 - i)
+        assert len(refresher._heap) <= 2 * len(refresher._due) + 16
+        assert refresher._heap[0][2] is account
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
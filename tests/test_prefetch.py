@@ -0,0 +1,107 @@
+"""
+下一页预取单元测试（账号 API 使用桩对象，不访问 Pixiv）
+"""
+import pytest
+import sys
+import os
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import upstream, prefetch
+from app.config import config
+from app.prefetch import Prefetcher, PREFETCHED
+
+from conftest import make_account
+
+
+def search_illust(word, offset=0):
+    """每页 30 条，共 3 页"""
+    end = offset + 30
+    next_url = f"https://app-api.pixiv.net/v1/search/illust?word={word}&offset={end}" if end < 90 else None
+    return {"illusts": [{"id": i} for i in range(offset, end)], "next_url": next_url}
+
+
+def offsets(api):
+    """按调用顺序返回请求过的 offset"""
+    return [kwargs.get("offset", args[1] if len(args) > 1 else 0) for _, args, kwargs in api.calls]
+
+
+@pytest.fixture
+def account(pool, monkeypatch):
+    account = make_account("a", search_illust=search_illust)
+    pool.accounts = [account]
+    monkeypatch.setattr(prefetch, "pool", pool)
+    monkeypatch.setattr(prefetch, "prefetcher", Prefetcher())
+    monkeypatch.setattr("app.routes.common.prefetcher", prefetch.prefetcher)
+    monkeypatch.setitem(config._data, "prefetch", {"enabled": True})
+    return account
+
+
+@pytest.fixture
+def client(api_app, account):
+    return api_app.test_client()
+
+
+def search(client, offset):
+    return client.get("/api/search", query_string={"word": "x", "offset": offset},
+                      headers={"Authorization": "Bearer pk_test"})
+
+
+def wait_issued(n):
+    for _ in range(100):
+        if prefetch.prefetcher.issued >= n and prefetch.prefetcher._active == 0:
+            return
+        time.sleep(0.01)
+
+
+class TestPrefetch:
+    """测试预取下一页"""
+
+    def test_next_page_prefetched(self, client, account):
+        """测试下一页由预取返回，且不再访问上游"""
+        search(client, 0)
+        wait_issued(1)
+        assert offsets(account.api) == [0, 30]
+        response = search(client, 30)
+        assert response.headers["X-Cache"] == PREFETCHED
+        assert response.get_json()["illusts"][0]["id"] == 30
+        wait_issued(2)
+        assert offsets(account.api) == [0, 30, 60]
+        stats = prefetch.prefetcher.stats()
+        assert (stats["issued"], stats["used"], stats["hit_rate"]) == (2, 1, 0.5)
+
+    def test_last_page_not_prefetched(self, client, account):
+        """测试没有下一页时不预取"""
+        search(client, 60)
+        time.sleep(0.05)
+        assert offsets(account.api) == [60]
+
+    def test_disabled_by_default(self, client, account, monkeypatch):
+        """测试未开启时不预取"""
+        monkeypatch.setitem(config._data, "prefetch", {})
+        search(client, 0)
+        time.sleep(0.05)
+        assert offsets(account.api) == [0]
+
+    def test_back_off_when_busy(self, client, account):
+        """测试账号池繁忙时不预取"""
+        account.inflight = 2
+        search(client, 0)
+        time.sleep(0.05)
+        assert offsets(account.api) == [0]
+        assert prefetch.prefetcher.skipped_busy == 1
+
+    def test_budget(self, account):
+        """测试每个 API Key 同时只进行 max_per_key 个预取"""
+        prefetcher = prefetch.prefetcher
+        prefetcher._active_by_owner["k"] = 1
+        prefetcher._active = 1
+        page = account.api.search_illust("x", 0)
+        prefetcher.schedule("search_illust", ("x",), {"offset": 0}, upstream.AccountScope(), "k", page)
+        assert prefetcher.skipped_budget == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,135 @@
+"""
+响应字段投影单元测试（账号 API 使用桩对象，不访问 Pixiv）
+"""
+import pytest
+import sys
+import os
+import json
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import config
+from app.json_codec import RawJson
+from app.projection import compile_fields, InvalidFields
+
+from conftest import make_account
+
+
+def make_illust(illust_id):
+    return {
+        "id": illust_id,
+        "title": f"t{illust_id}",
+        "caption": "long caption",
+        "image_urls": {"square_medium": "sq", "medium": "m", "large": "l"},
+        "tags": [{"name": "a", "translated_name": None}, {"name": "b", "translated_name": "B"}],
+        "user": {"id": 9, "name": "u", "profile_image_urls": {"medium": "p"}},
+        "total_bookmarks": 10,
+    }
+
+
+class TestCompile:
+    """测试投影编译"""
+
+    def test_cached_by_spec(self):
+        """测试相同的 fields 字符串只编译一次"""
+        assert compile_fields("id,title") is compile_fields("id,title")
+
+    def test_tree(self):
+        """测试点路径合并为字段树，父字段覆盖子路径"""
+        assert compile_fields("id, image_urls.medium ,image_urls.large").tree == {
+            "id": None, "image_urls": {"medium": None, "large": None}}
+        assert compile_fields("user,user.name").tree == {"user": None}
+        assert compile_fields("user.name,user").tree == {"user": None}
+
+    @pytest.mark.parametrize("spec", [",", "a..b", ".a", ",".join(f"f{i}" for i in range(100))])
+    def test_invalid(self, spec):
+        """测试格式错误与字段数上限"""
+        with pytest.raises(InvalidFields):
+            compile_fields(spec)
+
+
+class TestApply:
+    """测试投影结果"""
+
+    def test_nested_and_lists(self):
+        """测试嵌套字段、列表元素与不存在的字段"""
+        projection = compile_fields("id,image_urls.medium,tags.name,missing,user.missing")
+        assert projection.apply(make_illust(1)) == {
+            "id": 1, "image_urls": {"medium": "m"}, "tags": [{"name": "a"}, {"name": "b"}], "user": {}}
+
+    def test_list_response(self):
+        """测试列表响应投影每个作品并保留 next_url"""
+        result = {"illusts": [make_illust(1), make_illust(2)], "next_url": "n"}
+        assert compile_fields("id,title").apply_response(result) == {
+            "illusts": [{"id": 1, "title": "t1"}, {"id": 2, "title": "t2"}], "next_url": "n"}
+
+    def test_detail_responses(self):
+        """测试作品详情作用于 illust，其他响应作用于整个对象"""
+        projection = compile_fields("id,user.name")
+        assert projection.apply_response({"illust": make_illust(1)}) == {"illust": {"id": 1, "user": {"name": "u"}}}
+        user_detail = {"user": {"id": 9, "name": "u", "comment": "c"}, "profile": {"total_illusts": 3}}
+        assert projection.apply_response(user_detail) == {"user": {"name": "u"}}
+
+    def test_raw_json(self):
+        """测试投影延迟解析的上游结果"""
+        raw = RawJson(json.dumps({"illusts": [make_illust(1)], "next_url": None}).encode("utf-8"))
+        assert compile_fields("total_bookmarks").apply_response(raw) == {
+            "illusts": [{"total_bookmarks": 10}], "next_url": None}
+
+
+def illust_ranking(mode="day", offset=0, **kwargs):
+    offset = int(offset)
+    next_url = None if offset else "https://app-api.pixiv.net/v1/illust/ranking?mode=day&offset=2"
+    return {"illusts": [make_illust(offset), make_illust(offset + 1)], "next_url": next_url}
+
+
+def illust_detail(illust_id):
+    if illust_id == 0:
+        return {"error": {"user_message": "Work has been deleted or the ID does not exist."}}
+    return {"illust": make_illust(illust_id)}
+
+
+def user_detail(user_id):
+    return {"user": {"id": user_id, "name": "u", "comment": "c"}, "profile": {"total_illusts": 3, "region": "r"}}
+
+
+@pytest.fixture
+def client(api_app, pool, monkeypatch):
+    pool.accounts = [make_account("a", illust_ranking=illust_ranking, illust_detail=illust_detail,
+                                    user_detail=user_detail)]
+    monkeypatch.setitem(config._data, "response_cache", {"enabled": False})
+    monkeypatch.setitem(config._data, "prefetch", {"enabled": False})
+    return api_app.test_client()
+
+
+def get(client, path, **params):
+    return client.get(path, query_string=params, headers={"Authorization": "Bearer pk_test"})
+
+
+class TestRoutes:
+    """测试路由的 fields 参数"""
+
+    def test_ranking(self, client):
+        """测试排行榜只返回指定字段"""
+        data = get(client, "/api/ranking", fields="id,title,image_urls.medium,total_bookmarks").get_json()
+        assert data["illusts"][0] == {"id": 0, "title": "t0", "image_urls": {"medium": "m"}, "total_bookmarks": 10}
+        assert data["next_url"]
+
+    def test_ndjson(self, client):
+        """测试自动翻页时每行作品都被投影"""
+        response = get(client, "/api/ranking", fields="id", pages=2)
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert lines == [{"id": 0}, {"id": 1}, {"id": 2}, {"id": 3}]
+
+    def test_detail_and_errors(self, client):
+        """测试详情投影，错误响应原样返回，格式错误返回 400"""
+        assert get(client, "/api/illust/5", fields="title").get_json() == {"illust": {"title": "t5"}}
+        assert "error" in get(client, "/api/illust/0", fields="title").get_json()
+        assert get(client, "/api/illust/5", fields="a..b").status_code == 400
+        assert get(client, "/api/ranking", fields="a..b", all="true").status_code == 400
+
+    def test_user_detail(self, client):
+        """测试用户详情的路径相对于整个响应"""
+        data = get(client, "/api/user/9", fields="user.name,profile.total_illusts").get_json()
+        assert data == {"user": {"name": "u"}, "profile": {"total_illusts": 3}}
@@ -0,0 +1,154 @@
+"""
+上游响应缓存单元测试（账号 API 使用桩对象，不访问 Pixiv）
+"""
+import pytest
+import sys
+import os
+import threading
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import upstream, response_cache
+from app.config import config
+from app.response_cache import ResponseCache, HIT, MISS, STALE
+
+from conftest import StubAPI, make_account
+
+NOT_FOUND = {"error": {"message": "", "user_message": "Work has been deleted or the ID does not exist.", "reason": ""}}
+
+
+def stub_api():
+    """illust_detail 返回带调用序号的结果，id 为 0 时返回不存在；search_illust 较慢"""
+    api = StubAPI()
+
+    def illust_detail(illust_id):
+        if illust_id == 0:
+            return NOT_FOUND
+        return {"illust": {"id": illust_id, "version": len(api.calls)}}
+
+    def search_illust(word, offset=0):
+        time.sleep(0.1)
+        return {"illusts": []}
+
+    api.results.update(illust_detail=illust_detail, search_illust=search_illust)
+    return api
+
+
+@pytest.fixture
+def api(pool, monkeypatch):
+    """单账号池 + 新的缓存实例"""
+    pool.accounts = [make_account("a", stub_api())]
+    response_cache.response_cache.purge(prefix="")
+    monkeypatch.setitem(config._data, "response_cache", {
+        "ttl": {"illust_detail": 60}, "stale_while_revalidate": 60, "negative_ttl": 60,
+    })
+    return pool.accounts[0].api
+
+
+def expire(key):
+    """让条目进入过期但仍可返回旧值的窗口"""
+    cache = response_cache.response_cache
+    entry = cache._entries[key]
+    cache._entries[key] = entry._replace(expires_at=time.time() - 1)
+
+
+class TestResponseCache:
+    """测试缓存命中、过期刷新与负缓存"""
+
+    def test_hit(self, api):
+        """测试第二次调用命中缓存"""
+        assert response_cache.call("illust_detail", 1) == ({"illust": {"id": 1, "version": 1}}, MISS)
+        assert response_cache.call("illust_detail", 1)[1] == HIT
+        assert len(api.calls) == 1
+
+    def test_uncached_method(self, api):
+        """测试未配置 TTL 的方法直接调用上游"""
+        assert response_cache.call("search_illust", "x")[1] is None
+        response_cache.call("search_illust", "x")
+        assert len(api.calls) == 2
+
+    def test_concurrent_calls_coalesced(self, api):
+        """测试并发的相同调用（包括不缓存的方法）只访问一次上游"""
+        threads = [threading.Thread(target=response_cache.call, args=("search_illust", "x")) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(api.calls) == 1
+
+    def test_stale_while_revalidate(self, api):
+        """测试过期后先返回旧值，后台刷新后返回新值"""
+        response_cache.call("illust_detail", 1)
+        expire("illust_detail:1")
+        result, status = response_cache.call("illust_detail", 1)
+        assert status == STALE
+        assert result["illust"]["version"] == 1
+        for _ in range(50):
+            if len(api.calls) == 2 and response_cache.call("illust_detail", 1)[1] == HIT:
+                break
+            time.sleep(0.02)
+        assert response_cache.call("illust_detail", 1)[0]["illust"]["version"] == 2
+
+    def test_negative_cache(self, api):
+        """测试作品不存在的结果被短暂缓存，其他错误不缓存"""
+        response_cache.call("illust_detail", 0)
+        assert response_cache.call("illust_detail", 0) == (NOT_FOUND, HIT)
+        assert len(api.calls) == 1
+
+    def test_expired_beyond_stale_window(self):
+        """测试超过 stale 窗口后视为未命中"""
+        cache = ResponseCache(10)
+        cache.set("k", 1, ttl=0.01, stale_ttl=0)
+        time.sleep(0.02)
+        assert cache.get("k") == (None, MISS)
+
+    def test_lru_bound(self):
+        """测试条目数超过上限时淘汰最久未使用的"""
+        cache = ResponseCache(2)
+        cache.set("a", 1, 60)
+        cache.set("b", 2, 60)
+        cache.get("a")
+        cache.set("c", 3, 60)
+        assert cache.get("b") == (None, MISS)
+        assert cache.get("a") == (1, HIT)
+
+    def test_purge(self):
+        """测试按 key 和前缀清除"""
+        cache = ResponseCache(10)
+        for key in ("illust_detail:1", "illust_detail:2", "user_detail:1"):
+            cache.set(key, {}, 60)
+        assert cache.purge(key="user_detail:1") == 1
+        assert cache.purge(prefix="illust_detail:") == 2
+        assert cache.stats()["entries"] == 0
+
+    def test_specific_scope_key(self):
+        """测试限定账号的 Key 使用独立缓存键"""
+        scope = upstream.AccountScope("specific", frozenset({"b", "a"}))
+        assert response_cache.make_key("illust_detail", (1,), {}, scope) == "illust_detail:1@a,b"
+        assert response_cache.make_key("illust_ranking", (), {"offset": 0, "mode": "day"}) == \
+            "illust_ranking:mode=day&offset=0"
+
+
+class TestCacheRoutes:
+    """测试 X-Cache 响应头与清除接口"""
+
+    @pytest.fixture
+    def client(self, api_app, api):
+        return api_app.test_client()
+
+    def test_x_cache_and_purge(self, client):
+        """测试响应带 X-Cache，清除后重新未命中"""
+        headers = {"Authorization": "Bearer pk_test"}
+        assert client.get("/api/illust/1", headers=headers).headers["X-Cache"] == MISS
+        assert client.get("/api/illust/1", headers=headers).headers["X-Cache"] == HIT
+        admin = {"Authorization": f"Bearer {config.auth_token}"}
+        response = client.post("/api/cache/purge", json={"prefix": "illust_detail:"}, headers=admin)
+        assert response.get_json() == {"purged": 1}
+        assert client.get("/api/illust/1", headers=headers).headers["X-Cache"] == MISS
+        assert client.post("/api/cache/purge", json={}, headers=admin).status_code == 400
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
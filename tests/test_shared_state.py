@@ -0,0 +1,217 @@
+"""
+多进程共享状态单元测试（同一 SQLite 文件上的多个 SharedState 模拟多个 worker，不访问 Pixiv）
+"""
+import pytest
+import sys
+import os
+import threading
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.pool import PixivAccount, AccountView
+from app.shared_state import SharedState
+from app.state_store import SQLiteStateStore
+
+
+class StubPool:
+    def __init__(self, accounts):
+        self.accounts = accounts
+        self.scheduled = []
+
+    def _schedule_refresh(self, account):
+        self.scheduled.append(account.name)
+
+
+def make_worker(path, worker_id, names=("a", "b"), cursor_block=1):
+    accounts = [PixivAccount(name, refresh_token=f"rt_{name}") for name in names]
+    pool = StubPool(accounts)
+    shared = SharedState(SQLiteStateStore(path), pool, worker_id=worker_id, token_wait=0.5,
+                         cursor_block=cursor_block)
+    for account in accounts:
+        account.shared = shared
+    return shared, pool
+
+
+def fake_auth(account, calls):
+    """模拟一次成功的 Pixiv 认证"""
+    def authenticate():
+        calls.append(account.name)
+        account.api.access_token = f"at_{account.name}_{len(calls)}"
+        account.refresh_token = f"rt_{account.name}_{len(calls)}"
+        account.token_expires_at = time.time() + 3600
+        account.authenticated = True
+        return True
+    return authenticate
+
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / "state.db")
+
+
+class TestStore:
+    """测试 SQLite 存储"""
+
+    def test_counter_atomic(self, db):
+        """测试多线程（各自连接）递增计数器不丢失"""
+        store = SQLiteStateStore(db)
+        values = []
+
+        def worker():
+            for _ in range(50):
+                values.append(store.incr("rr:all"))
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert sorted(values) == list(range(200))
+
+    def test_lease(self, db):
+        """测试租约独占、续期与过期后接手"""
+        store = SQLiteStateStore(db)
+        assert store.acquire_lease("a", "w1", 0.2)
+        assert store.acquire_lease("a", "w1", 0.2)
+        assert not store.acquire_lease("a", "w2", 0.2)
+        assert store.lease_owner("a") == "w1"
+        time.sleep(0.25)
+        assert store.acquire_lease("a", "w2", 0.2)
+        assert store.lease_owner("a") == "w2"
+
+    def test_invalidate_only_current_token(self, db):
+        """测试只有共享的仍是同一个 token 时才标记失效"""
+        store = SQLiteStateStore(db)
+        version = store.publish_token("a", "new", "rt", 1, time.time() + 3600)
+        store.invalidate_token("a", "old")
+        assert store.get_account("a")["token_version"] == version
+        store.invalidate_token("a", "new")
+        row = store.get_account("a")
+        assert row["token_expires_at"] == 0 and row["token_version"] == version + 1
+
+
+class TestSharedState:
+    """测试多个 worker 之间的协作"""
+
+    def test_single_refresher(self, db):
+        """测试只有租约持有者访问 Pixiv，其他 worker 采用发布的 token"""
+        (w1, pool1), (w2, pool2) = make_worker(db, "w1"), make_worker(db, "w2")
+        calls = []
+        a1, a2 = pool1.accounts[0], pool2.accounts[0]
+        assert w1.authenticate(a1, fake_auth(a1, calls))
+        assert w2.authenticate(a2, fake_auth(a2, calls))
+        assert calls == ["a"]
+        assert a2.api.access_token == a1.api.access_token
+        assert a2.refresh_token == a1.refresh_token
+        assert w1.is_owner("a") and not w2.is_owner("a")
+
+    def test_waits_for_owner(self, db):
+        """测试 token 过期时非持有者等待持有者刷新后的 token"""
+        (w1, pool1), (w2, pool2) = make_worker(db, "w1"), make_worker(db, "w2")
+        calls = []
+        a1, a2 = pool1.accounts[0], pool2.accounts[0]
+        w1.authenticate(a1, fake_auth(a1, calls))
+        w2.authenticate(a2, fake_auth(a2, calls))
+        a2.token_expires_at = 0  # w2 发现 token 过期
+
+        def owner_refresh():
+            time.sleep(0.1)
+            a1.token_expires_at = 0
+            w1.authenticate(a1, fake_auth(a1, calls))
+
+        thread = threading.Thread(target=owner_refresh)
+        thread.start()
+        assert w2.authenticate(a2, fake_auth(a2, calls))
+        thread.join()
+        assert calls == ["a", "a"]
+        assert a2.api.access_token == "at_a_2"
+
+    def test_takeover_after_lease_expires(self, db):
+        """测试持有者退出后由其他 worker 接手刷新"""
+        (w1, pool1), (w2, pool2) = make_worker(db, "w1"), make_worker(db, "w2")
+        calls = []
+        w1.authenticate(pool1.accounts[0], fake_auth(pool1.accounts[0], calls))
+        w1.stop()
+        a2 = pool2.accounts[0]
+        w2.authenticate(a2, fake_auth(a2, calls))
+        a2.token_expires_at = 0
+        a2.token_version = 0
+        w2.store.invalidate_token("a", a2.api.access_token)
+        assert w2.authenticate(a2, fake_auth(a2, calls))
+        assert calls == ["a", "a"] and w2.is_owner("a")
+
+    def test_sync_counts_and_cooldowns(self, db):
+        """测试请求计数合并、冷却在 worker 间传播"""
+        (w1, pool1), (w2, pool2) = make_worker(db, "w1"), make_worker(db, "w2")
+        for _ in range(3):
+            pool1.accounts[0].record_request()
+        pool2.accounts[0].record_request()
+        w1.sync()
+        w2.sync()
+        assert pool2.accounts[0].request_count == 4
+        w1.sync()
+        assert pool1.accounts[0].request_count == 4
+
+        account = pool1.accounts[1]
+        account.cooldown_until = time.time() + 60
+        account.cooldown_reason = "rate_limit"
+        w1.report_cooldown(account)
+        w2.sync()
+        assert pool2.accounts[1].in_cooldown()
+        assert pool2.accounts[1].cooldown_reason == "rate_limit"
+
+    def test_invalid_grant_refreshed_by_owner(self, db):
+        """测试其他 worker 发现 token 失效后由租约持有者立即刷新"""
+        (w1, pool1), (w2, pool2) = make_worker(db, "w1"), make_worker(db, "w2")
+        calls = []
+        w1.authenticate(pool1.accounts[0], fake_auth(pool1.accounts[0], calls))
+        a2 = pool2.accounts[0]
+        w2.authenticate(a2, fake_auth(a2, calls))
+        a2.token_expires_at = 0
+        a2.cooldown_until = time.time() + 60
+        a2.cooldown_reason = "invalid_grant"
+        w2.report_cooldown(a2)
+        w1.sync()
+        assert pool1.scheduled == ["a"]
+        assert pool1.accounts[0].is_stale()
+
+    def test_shared_round_robin(self, db):
+        """测试多个 worker 共同推进同一个轮询序列"""
+        (w1, pool1), (w2, pool2) = make_worker(db, "w1"), make_worker(db, "w2")
+        views = []
+        for shared, pool in ((w1, pool1), (w2, pool2)):
+            view = AccountView(pool.accounts)
+            view.next_index = lambda shared=shared: shared.next_index("all")
+            views.append(view)
+        picks = [views[i % 2].round_robin(lambda a: True).name for i in range(6)]
+        assert picks == ["a", "b", "a", "b", "a", "b"]
+
+    def test_cursor_blocks(self, db):
+        """测试按块领取游标：每块只访问一次存储，各 worker 的位置互不重叠"""
+        (w1, _), (w2, _) = make_worker(db, "w1", cursor_block=4), make_worker(db, "w2", cursor_block=4)
+        positions = [w.next_index("all") for w in (w1, w2, w1, w2, w1, w2)]
+        assert positions == [0, 4, 1, 5, 2, 6]
+        assert w1.store.incr("rr:all") == 8
+
+
+class TestAccountIntegration:
+    """测试账号认证 / 刷新经过共享状态"""
+
+    def test_auth_and_refresh(self, db, monkeypatch):
+        """测试第二个 worker 启动时不重复认证，刷新由持有者完成"""
+        (_, pool1), (w2, pool2) = make_worker(db, "w1"), make_worker(db, "w2")
+        calls = []
+        for pool in (pool1, pool2):
+            account = pool.accounts[0]
+            monkeypatch.setattr(account, "_auth", lambda auto_gppt, account=account: fake_auth(account, calls)())
+            monkeypatch.setattr(account, "_refresh", lambda account=account: fake_auth(account, calls)())
+        assert pool1.accounts[0].auth()
+        assert pool2.accounts[0].auth()
+        assert calls == ["a"]
+        pool1.accounts[0].token_expires_at = 0
+        assert pool1.accounts[0].refresh()
+        w2.sync()
+        assert calls == ["a", "a"]
+        assert pool2.accounts[0].api.access_token == pool1.accounts[0].api.access_token
@@ -0,0 +1,74 @@
+"""
+请求合并单元测试
+"""
+import pytest
+import sys
+import os
+import threading
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.singleflight import SingleFlight
+
+
+def run_concurrently(n, target):
+    results, errors = [], []
+
+    def worker():
+        try:
+            results.append(target())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, errors
+
+
+class TestSingleFlight:
+    """测试并发相同调用只执行一次"""
+
+    def test_shared_result(self):
+        """测试并发调用共享同一结果"""
+        flight = SingleFlight()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.1)
+            return {"ok": True}
+
+        results, errors = run_concurrently(10, lambda: flight.do("k", slow))
+        assert calls == [1]
+        assert not errors
+        assert all(r is results[0] for r in results)
+        assert flight.stats() == {"in_flight": 0, "executed": 1, "shared": 9}
+
+    def test_shared_error(self):
+        """测试异常同样传给所有等待者，之后的调用重新执行"""
+        flight = SingleFlight()
+
+        def failing():
+            time.sleep(0.1)
+            raise ValueError("boom")
+
+        results, errors = run_concurrently(5, lambda: flight.do("k", failing))
+        assert not results
+        assert len(errors) == 5
+        assert flight.do("k", lambda: 1) == 1
+
+    def test_distinct_keys(self):
+        """测试不同 key 互不合并"""
+        flight = SingleFlight()
+        assert flight.do("a", lambda: 1) == 1
+        assert flight.do("b", lambda: 2) == 2
+        assert flight.stats()["executed"] == 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,403 @@
+"""
+共享状态存储单元测试：各后端的接口行为一致，RESP 后端连接本地的模拟服务端，
+并用多个 SharedState 模拟集群中的多个节点（不访问 Pixiv / Redis）
+"""
+import pytest
+import socket
+import socketserver
+import sys
+import os
+import threading
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.key_manager import key_manager
+from app.pool import PixivAccount, AccountView
+from app.shared_state import SharedState
+from app.state_store import (MemoryStateStore, SQLiteStateStore, RespStateStore, RespClient, RespError, StateStore,
+                             RENEW_LEASE_SCRIPT, RELEASE_LEASE_SCRIPT)
+
+
+class FakeRespServer(socketserver.ThreadingTCPServer):
+    """模拟 Redis：只实现 RespStateStore 用到的命令"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _RespHandler)
+        self.lock = threading.Lock()
+        self.data = {}
+        self.expires = {}
+        self.commands = 0
+        self.drop_after = set()  # 执行后不回复、直接断开连接的命令
+        self.connections = set()
+
+    def close_connections(self):
+        """模拟服务端关闭所有空闲连接"""
+        for sock in list(self.connections):
+            sock.shutdown(socket.SHUT_RDWR)
+
+    def _get(self, key):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def execute(self, name, *args):
+        with self.lock:
+            self.commands += 1
+            return self._execute(name.upper(), list(args))
+
+    def _execute(self, name, args):
+        if name in ("PING", "AUTH", "SELECT"):
+            return "+OK"
+        if name == "GET":
+            return self._get(args[0])
+        if name == "MGET":
+            return [self._get(k) for k in args]
+        if name == "SET":
+            key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+            exists = self._get(key) is not None
+            if ("NX" in options and exists) or ("XX" in options and not exists):
+                return None
+            self.data[key] = value
+            self.expires.pop(key, None)
+            if "PX" in options:
+                self.expires[key] = time.time() + int(args[2 + options.index("PX") + 1]) / 1000
+            return "+OK"
+        if name == "DEL":
+            return sum(1 for k in args if self.data.pop(k, None) is not None)
+        if name == "EVAL":
+            script, key, owner = args[0], args[2], args[3]
+            if self._get(key) != owner:
+                return 0
+            if script == RENEW_LEASE_SCRIPT:
+                return self._execute("PEXPIRE", [key, args[4]])
+            if script == RELEASE_LEASE_SCRIPT:
+                return self._execute("DEL", [key])
+            return RespError("NOSCRIPT unknown script")
+        if name == "PEXPIRE":
+            if self._get(args[0]) is None:
+                return 0
+            self.expires[args[0]] = time.time() + int(args[1]) / 1000
+            return 1
+        if name in ("INCR", "INCRBY", "HINCRBY"):
+            if name == "INCR":
+                container, field, amount = self.data, args[0], 1
+            elif name == "INCRBY":
+                container, field, amount = self.data, args[0], int(args[1])
+            else:
+                container, field, amount = self.data.setdefault(args[0], {}), args[1], int(args[2])
+            value = int(container.get(field, 0)) + amount
+            container[field] = str(value)
+            return value
+        if name == "HSET":
+            fields = self.data.setdefault(args[0], {})
+            fields.update(zip(args[1::2], args[2::2]))
+            return len(args[1:]) // 2
+        if name == "HGET":
+            return (self._get(args[0]) or {}).get(args[1])
+        if name == "HGETALL":
+            return [x for pair in (self._get(args[0]) or {}).items() for x in pair]
+        if name == "SADD":
+            members = self.data.setdefault(args[0], set())
+            added = len(set(args[1:]) - members)
+            members.update(args[1:])
+            return added
+        if name == "SMEMBERS":
+            return sorted(self._get(args[0]) or ())
+        return RespError(f"ERR unknown command '{name}'")
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.connections.add(self.connection)
+        try:
+            self._serve()
+        except OSError:
+            pass
+        finally:
+            self.server.connections.discard(self.connection)
+
+    def _serve(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2].decode("utf-8"))
+            reply = self.server.execute(*args)
+            if args[0].upper() in self.server.drop_after:
+                return
+            self.wfile.write(self._encode(reply))
+
+    def _encode(self, value):
+        if isinstance(value, RespError):
+            return f"-{value}\r\n".encode()
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return f":{value}\r\n".encode()
+        if isinstance(value, list):
+            return f"*{len(value)}\r\n".encode() + b"".join(self._encode(v) for v in value)
+        if value.startswith("+"):
+            return f"{value}\r\n".encode()
+        data = value.encode("utf-8")
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+@pytest.fixture
+def resp_server():
+    server = FakeRespServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def resp_store(server, prefix="pixiv:"):
+    return RespStateStore(RespClient("127.0.0.1", server.server_address[1], password="secret", db=1), prefix)
+
+
+@pytest.fixture(params=["memory", "sqlite", "resp"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryStateStore()
+    if request.param == "sqlite":
+        return SQLiteStateStore(str(tmp_path / "state.db"))
+    return resp_store(request.getfixturevalue("resp_server"))
+
+
+class TestStoreContract:
+    """测试各后端行为一致"""
+
+    def test_tokens(self, store):
+        """测试发布 token 递增版本号，只有当前 token 才能被标记失效"""
+        assert store.get_account("a") is None
+        v1 = store.publish_token("a", "at1", "rt1", 42, 1000.5)
+        v2 = store.publish_token("a", "at2", "rt2", 42, 2000.5)
+        assert v2 == v1 + 1
+        row = store.get_account("a")
+        assert (row["access_token"], row["refresh_token"], row["user_id"]) == ("at2", "rt2", "42")
+        assert row["token_expires_at"] == 2000.5 and row["token_version"] == v2
+        store.invalidate_token("a", "at1")
+        assert store.get_account("a")["token_version"] == v2
+        store.invalidate_token("a", "at2")
+        row = store.get_account("a")
+        assert row["token_expires_at"] == 0 and row["token_version"] == v2 + 1
+
+    def test_cooldowns_and_counts(self, store):
+        """测试冷却取较晚者、请求数累加"""
+        store.set_cooldown("a", 500.0, "rate_limit")
+        store.set_cooldown("a", 100.0, "invalid_grant")
+        assert store.add_requests("a", 3, 10.0) == 3
+        assert store.add_requests("a", 2, 5.0) == 5
+        row = store.get_accounts()["a"]
+        assert row["cooldown_until"] == 500.0 and row["cooldown_reason"] == "invalid_grant"
+        assert row["request_count"] == 5 and row["last_request_time"] == 10.0
+
+    def test_counter(self, store):
+        """测试计数器返回递增前的值"""
+        assert [store.incr("rr:all") for _ in range(3)] == [0, 1, 2]
+        assert store.incr("rr:all", 10) == 3
+        assert store.incr("rr:all") == 13
+        assert store.incr("rr:other") == 0
+
+    def test_leases(self, store):
+        """测试租约独占、续期、释放与过期"""
+        assert store.acquire_lease("a", "n1", 0.3)
+        assert not store.acquire_lease("a", "n2", 0.3)
+        assert store.lease_owner("a") == "n1"
+        time.sleep(0.2)
+        store.renew_leases("n1", 0.3)
+        time.sleep(0.2)
+        assert store.lease_owner("a") == "n1"
+        store.release_leases("n1")
+        assert store.lease_owner("a") is None
+        assert store.acquire_lease("a", "n2", 0.1)
+        time.sleep(0.15)
+        assert store.lease_owner("a") is None
+        assert store.acquire_lease("a", "n1", 1)
+
+    def test_lease_taken_over(self, store):
+        """测试租约过期被其他节点获取后，原持有者续期与释放都不影响新持有者"""
+        assert store.acquire_lease("a", "n1", 0.1)
+        time.sleep(0.15)
+        assert store.acquire_lease("a", "n2", 0.3)
+        assert not store.acquire_lease("a", "n1", 10)
+        store.release_leases("n1")
+        assert store.lease_owner("a") == "n2"
+        time.sleep(0.35)
+        assert store.lease_owner("a") is None  # n1 的续期没有延长 n2 的租约
+
+    def test_api_keys(self, store):
+        """测试 API Key 列表版本化保存"""
+        assert store.get_api_keys() == (0, None)
+        v1 = store.put_api_keys([{"name": "a", "key": "pk_a"}])
+        v2 = store.put_api_keys([{"name": "b", "key": "pk_b"}])
+        assert v2 == v1 + 1
+        assert store.get_api_keys() == (v2, [{"name": "b", "key": "pk_b"}])
+
+
+class TestRespClient:
+    """测试 RESP 客户端"""
+
+    def test_pipeline_and_errors(self, resp_server):
+        """测试流水线一次发送、错误回复不破坏连接"""
+        client = RespClient("127.0.0.1", resp_server.server_address[1])
+        before = resp_server.commands
+        assert client.pipeline([("SET", "k", "v"), ("GET", "k"), ("INCR", "n")]) == ["OK", "v", 1]
+        assert resp_server.commands - before == 3
+        with pytest.raises(RespError):
+            client.execute("NOPE")
+        assert client.execute("GET", "k") == "v"
+
+    def test_reconnect(self, resp_server):
+        """测试连接断开后自动重连"""
+        client = RespClient("127.0.0.1", resp_server.server_address[1])
+        client.execute("SET", "k", "v")
+        client._local.conn[0].close()
+        assert client.execute("GET", "k") == "v"
+
+    def test_not_replayed_after_send(self, resp_server):
+        """测试命令发出后连接断开时，幂等命令重试，INCR 不重放"""
+        client = RespClient("127.0.0.1", resp_server.server_address[1])
+        client.execute("SET", "k", "v")
+        resp_server.drop_after.add("INCR")
+        with pytest.raises(ConnectionError):
+            client.execute("INCR", "n")
+        resp_server.drop_after = {"GET"}
+        with pytest.raises(ConnectionError):
+            client.execute("GET", "k")  # 重试一次后仍断开
+        resp_server.drop_after = set()
+        assert client.execute("GET", "n") == "1"
+
+    def test_idle_connection_closed_by_server(self, resp_server):
+        """测试服务端关闭空闲连接后，复用前检测到并重连，INCR 只执行一次"""
+        client = RespClient("127.0.0.1", resp_server.server_address[1])
+        client.execute("SET", "k", "v")
+        resp_server.close_connections()
+        time.sleep(0.05)
+        assert client.execute("INCR", "n") == 1
+        assert client.execute("GET", "n") == "1"
+
+
+class TestAbstract:
+    """测试存储接口"""
+
+    def test_incomplete_backend(self):
+        """测试缺少方法的后端在构造时报错"""
+        class Partial(StateStore):
+            def get_accounts(self):
+                return {}
+
+        with pytest.raises(TypeError):
+            Partial()
+
+
+def make_node(store, node_id, refresh_owner="account", names=("a", "b")):
+    accounts = [PixivAccount(name, refresh_token=f"rt_{name}") for name in names]
+    pool = type("StubPool", (), {"accounts": accounts, "_schedule_refresh": lambda self, account: None})()
+    shared = SharedState(store, pool, worker_id=node_id, lease_ttl=0.3, token_wait=0.3,
+                         refresh_owner=refresh_owner, cursor_block=1)
+    for account in accounts:
+        account.shared = shared
+    return shared, accounts
+
+
+def fake_auth(account, calls, node):
+    def authenticate():
+        calls.append((node, account.name))
+        account.api.access_token = f"at_{account.name}_{len(calls)}"
+        account.token_expires_at = time.time() + 3600
+        account.authenticated = True
+        return True
+    return authenticate
+
+
+class TestCluster:
+    """测试多个节点通过 RESP 存储协作"""
+
+    def test_leader_refreshes_all_accounts(self, resp_server):
+        """测试 leader 模式下只有 leader 刷新，leader 退出后其他节点接手"""
+        (n1, accounts1), (n2, accounts2) = (make_node(resp_store(resp_server), node, "leader")
+                                            for node in ("n1", "n2"))
+        n1.sync()
+        n2.sync()
+        assert n1.is_leader and not n2.is_leader
+        calls = []
+        for account in accounts1:
+            assert n1.authenticate(account, fake_auth(account, calls, "n1"))
+        for account in accounts2:
+            assert n2.authenticate(account, fake_auth(account, calls, "n2"))
+        assert calls == [("n1", "a"), ("n1", "b")]
+        assert [a.api.access_token for a in accounts2] == [a.api.access_token for a in accounts1]
+
+        n1.stop()
+        n2.sync()
+        assert n2.is_leader
+        accounts2[0].token_expires_at = 0
+        assert n2.authenticate(accounts2[0], fake_auth(accounts2[0], calls, "n2"))
+        assert calls[-1] == ("n2", "a")
+
+    def test_cluster_round_robin_and_cooldown(self, resp_server):
+        """测试节点间共同推进轮询序列并共享冷却"""
+        (n1, accounts1), (n2, accounts2) = (make_node(resp_store(resp_server), node) for node in ("n1", "n2"))
+        views = []
+        for shared, accounts in ((n1, accounts1), (n2, accounts2)):
+            view = AccountView(accounts)
+            view.next_index = lambda shared=shared: shared.next_index("all")
+            views.append(view)
+        assert [views[i % 2].round_robin(lambda a: True).name for i in range(4)] == ["a", "b", "a", "b"]
+
+        accounts1[0].cooldown_until = time.time() + 60
+        accounts1[0].cooldown_reason = "rate_limit"
+        n1.report_cooldown(accounts1[0])
+        n2.sync()
+        assert accounts2[0].in_cooldown()
+
+    def test_prefix_isolation(self, resp_server):
+        """测试不同前缀的集群互不影响"""
+        first, second = resp_store(resp_server, "one:"), resp_store(resp_server, "two:")
+        first.publish_token("a", "at", "rt", 1, 1.0)
+        assert second.get_accounts() == {}
+
+
+class TestKeySync:
+    """测试 API Key 经共享存储在节点间同步"""
+
+    @pytest.fixture(autouse=True)
+    def reset(self):
+        yield
+        key_manager.store = None
+        key_manager.load_from_config([])
+
+    def test_sync(self):
+        """测试接入时以存储为准、其他节点修改后同步"""
+        store = MemoryStateStore()
+        store.put_api_keys([{"name": "shared", "key": "pk_shared"}])
+        key_manager.load_from_config([{"name": "local", "key": "pk_local"}])
+        key_manager.use_state_store(store)
+        assert [k.name for k in key_manager.list_keys()] == ["shared"]
+
+        store.put_api_keys([{"name": "shared", "key": "pk_shared"}, {"name": "new", "key": "pk_new"}])
+        key_manager.sync_from_store()
+        assert key_manager.get_key("pk_new") is not None
+
+        key, _ = key_manager.create_key("mine")
+        assert key is not None
+        assert any(k["name"] == "mine" for k in store.get_api_keys()[1])
+
+    def test_upload_local_keys(self):
+        """测试存储中还没有 API Key 时上传本地的"""
+        store = MemoryStateStore()
+        key_manager.load_from_config([{"name": "local", "key": "pk_local"}])
+        key_manager.use_state_store(store)
+        assert [k["name"] for k in store.get_api_keys()[1]] == ["local"]
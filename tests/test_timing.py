@@ -0,0 +1,116 @@
+"""
+请求分阶段计时单元测试（账号 API 使用桩对象，不访问 Pixiv）
+"""
+import json
+import pytest
+import sys
+import os
+import time
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import timing
+from app.config import config
+
+from conftest import make_account
+
+
+def slow_detail(illust_id):
+    time.sleep(0.01)
+    return {"illust": {"id": illust_id}}
+
+
+@pytest.fixture
+def sampled(monkeypatch):
+    monkeypatch.setitem(config._data, "timing", {"sample_rate": 1})
+    yield
+    timing.end()
+
+
+@pytest.fixture
+def app(api_app, pool, monkeypatch, sampled):
+    pool.accounts = [make_account("a", illust_detail=slow_detail)]
+    monkeypatch.setitem(config._data, "response_cache", {"enabled": False})
+    timing.instrument(api_app)
+    return api_app
+
+
+def parse_header(header):
+    return {name: float(dur[4:]) for name, dur in (part.split(";") for part in header.split(", "))}
+
+
+def access_logs(capsys):
+    return [json.loads(line[len("[Access] "):]) for line in capsys.readouterr().out.splitlines()
+            if line.startswith("[Access] ")]
+
+
+class TestPhases:
+    """测试阶段计时"""
+
+    def test_nested_self_time(self, sampled):
+        """测试嵌套阶段只计自身耗时"""
+        request_timing = timing.begin()
+        with timing.phase("select"):
+            time.sleep(0.01)
+            with timing.phase("refresh"):
+                time.sleep(0.03)
+        with timing.phase("select"):
+            time.sleep(0.01)
+        assert request_timing.phases["refresh"] >= 0.03
+        assert 0.02 <= request_timing.phases["select"] < 0.03
+
+    def test_not_sampled(self, monkeypatch):
+        """测试未抽中的请求不记录"""
+        monkeypatch.setitem(config._data, "timing", {"sample_rate": 0})
+        assert timing.begin() is None
+        with timing.phase("upstream"):
+            pass
+        timing.note("account", "a")
+        assert timing.server_timing_header() is None
+
+
+class TestFlask:
+    """测试 Flask 请求的 Server-Timing 头与访问日志"""
+
+    def test_header_and_log(self, app, capsys):
+        """测试各阶段出现在响应头中，发送耗时与账号写入访问日志"""
+        response = app.test_client().get("/api/illust/7", headers={"Authorization": "Bearer pk_test"})
+        assert response.status_code == 200
+        phases = parse_header(response.headers["Server-Timing"])
+        assert {"auth", "key", "select", "upstream", "serialize", "total"} <= set(phases)
+        assert phases["upstream"] >= 10
+        response.close()
+        record = access_logs(capsys)[-1]
+        assert record["route"] == "/api/illust/<int:illust_id>"
+        assert record["path"] == "/api/illust/7"
+        assert record["status"] == 200
+        assert record["account"] == "a"
+        assert "send" in record["phases"]
+
+    def test_unhandled_exception_logged(self, sampled, capsys):
+        """测试异常向外传播（不经过 after_request）的请求按 500 输出访问日志"""
+        from flask import Flask
+        app = Flask(__name__)
+        app.config["PROPAGATE_EXCEPTIONS"] = True
+
+        @app.route("/boom")
+        def boom():
+            with timing.phase("upstream"):
+                raise RuntimeError("boom")
+
+        timing.instrument(app)
+        with pytest.raises(RuntimeError):
+            app.test_client().get("/boom")
+        record = access_logs(capsys)[-1]
+        assert (record["route"], record["status"], record["error"]) == ("/boom", 500, "RuntimeError")
+        assert "upstream" in record["phases"]
+
+    def test_switches(self, app, monkeypatch, capsys):
+        """测试关闭 Server-Timing 头时仍输出访问日志"""
+        monkeypatch.setitem(config._data, "timing", {"sample_rate": 1, "server_timing": False})
+        response = app.test_client().get("/api/illust/7", headers={"Authorization": "Bearer wrong"})
+        assert response.status_code == 401
+        assert "Server-Timing" not in response.headers
+        response.close()
+        assert access_logs(capsys)[-1]["status"] == 401
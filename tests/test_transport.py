@@ -0,0 +1,80 @@
+"""
+共享 HTTP 传输层单元测试（不访问网络）
+"""
+import pytest
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import transport
+from app.config import config
+from app.pool import PixivAccount
+
+
+@pytest.fixture
+def fresh_session(monkeypatch):
+    """使用按测试配置重新创建的共享会话"""
+    monkeypatch.setitem(config._data, "http", {"pool_maxsize": 7, "connect_timeout": 2, "read_timeout": 9})
+    monkeypatch.setattr(transport, "_session", None)
+
+
+class TestSharedSession:
+    """测试账号共享连接池"""
+
+    def test_accounts_share_session(self, fresh_session):
+        """测试所有账号使用同一个会话"""
+        a, b = PixivAccount("a"), PixivAccount("b")
+        assert a.api.requests is b.api.requests is transport.get_session()
+
+    def test_pool_settings(self, fresh_session):
+        """测试连接池大小与 keep-alive 来自配置"""
+        adapter = transport.get_session().adapters["https://"]
+        assert isinstance(adapter, transport.PooledAdapter)
+        assert adapter._pool_maxsize == 7
+        assert any(opt[1] == transport.socket.SO_KEEPALIVE for opt in adapter.socket_options)
+
+    def test_timeouts(self, fresh_session):
+        """测试账号未设置超时时使用 (connect, read)，单独设置时覆盖"""
+        assert PixivAccount("a").api.requests_kwargs["timeout"] == (2, 9)
+        account = PixivAccount("b", timeout=30)
+        assert account.api.requests_kwargs["timeout"] == 30
+        account.api.set_proxy({"https": "http://127.0.0.1:7890"})
+        assert account.api.requests_kwargs["timeout"] == 30
+
+    def test_config_accounts_use_default_timeout(self, fresh_session, pool, monkeypatch):
+        """测试从配置加载且未设置超时的账号在启动认证后使用 http 配置的超时"""
+        def fake_auth(account, auto_gppt=False):
+            account.authenticated = True
+            return True
+
+        monkeypatch.setattr(PixivAccount, "auth", fake_auth)
+        monkeypatch.setitem(config._data, "startup", {"auth_timeout": 30})
+        monkeypatch.setitem(config._data, "pixiv_accounts", [{"name": "a", "refresh_token": "rt"}])
+        pool.load_from_config(wait_ready=True)
+        account, = pool.accounts
+        assert account.api.requests_kwargs["timeout"] == transport.default_timeout() == (2, 9)
+
+    def test_warm_up(self, fresh_session, monkeypatch):
+        """测试预热按主机并发建立连接，失败不抛异常"""
+        monkeypatch.setitem(config._data, "http", {"warm_up_connections": 2})
+        hosts = []
+
+        class Response:
+            def close(self):
+                pass
+
+        def fake_head(url, **kwargs):
+            hosts.append(url)
+            if "bad" in url:
+                raise OSError("unreachable")
+            return Response()
+
+        monkeypatch.setattr(transport.get_session(), "head", fake_head)
+        assert transport.warm_up(hosts=("good.example", "bad.example")) == 2
+        assert sorted(hosts) == ["https://bad.example/"] * 2 + ["https://good.example/"] * 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
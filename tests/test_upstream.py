@@ -0,0 +1,114 @@
+"""
+上游调用失败转移单元测试（账号 API 使用桩对象，不访问 Pixiv）
+"""
+import pytest
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pixivpy3 import PixivError
+from app import upstream
+
+from conftest import make_account
+
+RATE_LIMITED = {"error": {"message": "Rate Limit", "user_message": "", "reason": ""}}
+NOT_FOUND = {"error": {"message": "", "user_message": "Work not found", "reason": ""}}
+
+
+class TestClassifyError:
+    """测试错误分类"""
+
+    def test_rate_limit(self):
+        assert upstream.classify_error(RATE_LIMITED) == upstream.RATE_LIMIT
+
+    def test_invalid_grant(self):
+        result = {"error": {"message": "Error occurred at the OAuth process. Error Message: invalid_grant"}}
+        assert upstream.classify_error(result) == upstream.INVALID_GRANT
+
+    def test_not_retryable(self):
+        assert upstream.classify_error(NOT_FOUND) is None
+        assert upstream.classify_error({"illust": {"id": 1}}) is None
+
+    def test_exceptions(self):
+        assert upstream.classify_error(exc=PixivError("requests GET error: timeout")) == upstream.NETWORK
+        assert upstream.classify_error(exc=ValueError("bug")) is None
+
+
+class TestFailover:
+    """测试限流账号冷却并换账号重试"""
+
+    def test_retry_on_other_account(self, pool):
+        """测试被限流后在其他账号上成功，并冷却被限流的账号"""
+        limited = make_account("limited", illust_detail=RATE_LIMITED)
+        healthy = make_account("healthy", illust_detail={"illust": {"id": 1}})
+        pool.accounts = [limited, healthy]
+        result, account = upstream.call("illust_detail", 1, scope=upstream.AccountScope(strategy="round_robin"))
+        assert account is healthy
+        assert result["illust"]["id"] == 1
+        assert limited.in_cooldown()
+        assert limited.cooldown_reason == upstream.RATE_LIMIT
+
+    def test_cooled_down_account_skipped(self, pool):
+        """测试冷却中的账号不会被选中"""
+        limited = make_account("limited", illust_detail=RATE_LIMITED)
+        healthy = make_account("healthy", illust_detail={"illust": {"id": 1}})
+        pool.accounts = [limited, healthy]
+        pool.quarantine(limited, 60, upstream.RATE_LIMIT)
+        for _ in range(5):
+            upstream.call("illust_detail", 1)
+        assert len(limited.api.calls) == 0
+        assert len(healthy.api.calls) == 5
+
+    def test_all_limited(self, pool):
+        """测试所有账号都被限流时返回 429"""
+        pool.accounts = [make_account("a", illust_detail=RATE_LIMITED), make_account("b", illust_detail=RATE_LIMITED)]
+        with pytest.raises(upstream.UpstreamFailed) as info:
+            upstream.call("illust_detail", 1)
+        assert info.value.status_code == 429
+        with pytest.raises(upstream.NoAvailableAccount):
+            upstream.call("illust_detail", 1)
+
+    def test_not_found_passed_through(self, pool):
+        """测试作品不存在等错误直接返回，不重试"""
+        account = make_account("a", illust_detail=NOT_FOUND)
+        pool.accounts = [account, make_account("b", illust_detail=NOT_FOUND)]
+        result, _ = upstream.call("illust_detail", 1)
+        assert result == NOT_FOUND
+        assert not account.in_cooldown()
+
+    def test_max_attempts(self, pool, monkeypatch):
+        """测试重试次数受 max_attempts 限制"""
+        monkeypatch.setitem(upstream.config._data, "failover", {"max_attempts": 2})
+        accounts = [make_account(f"acc{i}", illust_detail=PixivError("requests GET error: timeout")) for i in range(4)]
+        pool.accounts = accounts
+        with pytest.raises(upstream.UpstreamFailed) as info:
+            upstream.call("illust_detail", 1)
+        assert info.value.status_code == 502
+        assert sum(len(a.api.calls) for a in accounts) == 2
+
+    def test_inflight_released(self, pool):
+        """测试每次尝试（包括失败的）结束后都归还并发名额"""
+        limited = make_account("limited", illust_detail=RATE_LIMITED)
+        healthy = make_account("healthy", illust_detail={"illust": {"id": 1}})
+        limited.max_inflight = healthy.max_inflight = 1
+        pool.accounts = [limited, healthy]
+        for _ in range(3):
+            upstream.call("illust_detail", 1)
+        assert limited.inflight == healthy.inflight == 0
+        with upstream.lease() as account:
+            assert account.inflight == 1
+        assert account.inflight == 0
+
+    def test_specific_scope(self, pool):
+        """测试重试只在 Key 允许的账号中进行"""
+        pool.accounts = [make_account("a", illust_detail=RATE_LIMITED), make_account("b", illust_detail={"ok": True})]
+        scope = upstream.AccountScope("specific", frozenset({"a"}))
+        with pytest.raises(upstream.UpstreamFailed):
+            upstream.call("illust_detail", 1, scope=scope)
+        assert len(pool.accounts[1].api.calls) == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])